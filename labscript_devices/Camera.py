@@ -10,6 +10,7 @@
 # the project for the full license.                                 #
 #                                                                   #
 #####################################################################
+from bisect import bisect_right, insort
 from labscript_devices import BLACS_tab
 from labscript import TriggerableDevice, LabscriptError, set_passed_properties
 import numpy as np
@@ -44,6 +45,12 @@ class Camera(TriggerableDevice):
         self.sdk = str(SDK)
         self.effective_pixel_size = effective_pixel_size
         self.exposures = []
+        # For checking new exposures against existing ones without looping over them
+        # all: the set of (t, duration) of exposures, and sorted lists of (start, end)
+        # and (end, start) of exposures:
+        self._exposure_times = set()
+        self._exposure_starts = []
+        self._exposure_ends = []
         
         # DEPRECATED: backward compatibility:
         if 'exposuretime' in kwargs:
@@ -69,33 +76,44 @@ class Camera(TriggerableDevice):
         # another camera attached to the same trigger:
         already_requested = False
         for camera in self.trigger_device.child_devices:
-            if camera is not self:
-                for _, other_t, _, other_duration in camera.exposures:
-                    if t == other_t and duration == other_duration:
-                        already_requested = True
+            if camera is not self and (t, duration) in camera._exposure_times:
+                already_requested = True
         if not already_requested:
             self.trigger_device.trigger(t, duration)
         # Check for exposures too close together (check for overlapping 
-        # triggers already performed in self.trigger_device.trigger()):
+        # triggers already performed in self.trigger_device.trigger()). That is, any
+        # exposure starting within minimum_recovery_time of this one ending, or
+        # ending within minimum_recovery_time of this one starting. Each is found by
+        # bisecting the sorted starts or ends:
         start = t
         end = t + duration
-        for exposure in self.exposures:
-            _, other_t, _, other_duration = exposure
-            other_start = other_t
-            other_end = other_t + other_duration
-            if abs(other_start - end) < self.minimum_recovery_time or abs(other_end - start) < self.minimum_recovery_time:
-                raise LabscriptError('%s %s has two exposures closer together than the minimum recovery time: ' %(self.description, self.name) + \
-                                     'one at t = %fs for %fs, and another at t = %fs for %fs. '%(t,duration,start,duration) + \
-                                     'The minimum recovery time is %fs.'%self.minimum_recovery_time)
+        recovery = self.minimum_recovery_time
+        too_close = None
+        i = bisect_right(self._exposure_starts, (end - recovery, float('inf')))
+        if i < len(self._exposure_starts) and self._exposure_starts[i][0] < end + recovery:
+            too_close = self._exposure_starts[i]
+        i = bisect_right(self._exposure_ends, (start - recovery, float('inf')))
+        if i < len(self._exposure_ends) and self._exposure_ends[i][0] < start + recovery:
+            other_end, other_start = self._exposure_ends[i]
+            too_close = (other_start, other_end)
+        if too_close is not None:
+            other_start, other_end = too_close
+            raise LabscriptError('%s %s has two exposures closer together than the minimum recovery time: ' %(self.description, self.name) + \
+                                 'one at t = %fs for %fs, and another at t = %fs for %fs. '%(t,duration,other_start,other_end - other_start) + \
+                                 'The minimum recovery time is %fs.'%self.minimum_recovery_time)
         self.exposures.append((name, t, frametype, duration))
+        self._exposure_times.add((t, duration))
+        insort(self._exposure_starts, (start, end))
+        insort(self._exposure_ends, (end, start))
         return duration
     
     def do_checks(self):
         # Check that all Cameras sharing a trigger device have exposures when we have exposures:
         for camera in self.trigger_device.child_devices:
             if camera is not self:
+                other_exposures = set(camera.exposures)
                 for exposure in self.exposures:
-                    if exposure not in camera.exposures:
+                    if exposure not in other_exposures:
                         _, start, _, duration = exposure
                         raise LabscriptError('Cameras %s and %s share a trigger. ' % (self.name, camera.name) + 
                                              '%s has an exposure at %fs for %fs, ' % (self.name, start, duration) +
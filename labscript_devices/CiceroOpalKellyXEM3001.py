@@ -61,6 +61,21 @@ def add_instruction_to_bytearray(data, instruction, on, off, reps):
     data[offset+13] = reps[0]
     data[offset+14] = reps[3]
     data[offset+15] = reps[2]   
+
+def pulse_program_to_bytearray(pulse_program):
+    # Packs a whole pulse program (a structured array with 'on_period', 'off_period'
+    # and 'reps' fields) into the upload buffer at once. The output is identical to
+    # calling add_instruction_to_bytearray for each instruction: each field is split
+    # into big endian order 16-bit words (3 each for the periods, 2 for reps), and
+    # each word is stored little endian.
+    words = np.empty((len(pulse_program), 8), dtype='<u2')
+    column = 0
+    for name, n_words in [('on_period', 3), ('off_period', 3), ('reps', 2)]:
+        values = pulse_program[name].astype(np.uint64)
+        for shift in range(n_words-1, -1, -1):
+            words[:, column] = (values >> np.uint64(16*shift)) & np.uint64(0xFFFF)
+            column += 1
+    return bytearray(words)
     
         
 # Define a CiceroOpalKellyXEM3001Clock that only accepts one child clockline
@@ -345,7 +360,7 @@ class CiceroOpalKellyXEM3001Tab(DeviceTab):
         self.primary_worker = "main_worker"
         
         # Set the capabilities of this device
-        self.supports_smart_programming(False) 
+        self.supports_smart_programming(True) 
         
         # Add button to force reflash
         self.flash_fpga_button = QPushButton('Flash FPGA firmware (this should be handled automatically by BLACS, if the device is not working correctly, try this button!)')
@@ -453,6 +468,12 @@ class CiceroOpalKellyXEM3001Worker(Worker):
         self.h5_file = None
     
         self.current_value = 0
+
+        # The debounce wire-in value last programmed. Wire-ins hold their values until
+        # changed or the FPGA is reflashed. The pulse program is not cached, since
+        # every transition to buffered aborts the state machine first, and the
+        # firmware does not guarantee the program survives that:
+        self.smart_cache = {'trigger_debounce_clock_ticks': None}
     
         # Initialise connection to OPAL KELLY Board
         self.dev = ok.okCFrontPanel()
@@ -481,6 +502,8 @@ class CiceroOpalKellyXEM3001Worker(Worker):
             raise RuntimeError('Cannot flash the FPGA for the current reference clock configuration as the .bit file is missing. Please ensure the correct bit file is available at %s'%fpga_path)
             
         self.logger.debug('Flashing FPGA bit file located at: %s'%fpga_path)
+        # Whatever was programmed is gone:
+        self.smart_cache = {'trigger_debounce_clock_ticks': None}
         self.dev.ConfigureFPGA(fpga_path)
         assert self.dev.IsFrontPanelEnabled(), 'Flashing of the FPGA failed. The device is not configured with the .bit file correctly'
 
@@ -524,20 +547,26 @@ class CiceroOpalKellyXEM3001Worker(Worker):
                 self.wait_table = None # This device doesn't need to worry about looking at waits
                 self.measured_waits = None
                 
-        # set debounce counter
-        self.dev.SetWireInValue(0x01, self.connection_table_properties['trigger_debounce_clock_ticks'])
-        self.dev.UpdateWireIns()
+        if fresh:
+            self.smart_cache = {'trigger_debounce_clock_ticks': None}
+
+        # set debounce counter, if it has changed
+        debounce = self.connection_table_properties['trigger_debounce_clock_ticks']
+        if debounce != self.smart_cache['trigger_debounce_clock_ticks']:
+            self.smart_cache['trigger_debounce_clock_ticks'] = None
+            self.dev.SetWireInValue(0x01, debounce)
+            self.dev.UpdateWireIns()
+            self.smart_cache['trigger_debounce_clock_ticks'] = debounce
         
         # consistency check
         if self.wait_table is not None and not self.is_master_pseudoclock:
             raise RuntimeError('Something has gone wrong in labscript. You should not be able to configure this device as the wait monitor while it is a secondary pseudoclock. Please contact the developers on the mailing list.')
                 
-        # Create empty data array
-        data = bytearray(len(pulse_program)*16)
-        for i, instruction in enumerate(pulse_program):
-            add_instruction_to_bytearray(data, i, instruction['on_period'], instruction['off_period'], instruction['reps'])
+        # Pack the instructions into the upload buffer
+        data = pulse_program_to_bytearray(pulse_program)
         
-        # program the FPGA
+        # program the FPGA. This is always done, even if the program is unchanged,
+        # since the abort above may have reset the state machine's program:
         assert self.dev.WriteToPipeIn(0x80, data) == len(data)
 
         # If not the master pseudoclock, then we need to start the device
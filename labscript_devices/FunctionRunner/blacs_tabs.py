@@ -22,9 +22,13 @@ class FunctionRunnerTab(DeviceTab):
         self._ui.splitter.setSizes([0, 0, 1])
 
     def initialise_workers(self):
+        properties = self.connection_table.find_by_name(self.device_name).properties
         self.create_worker(
             'main_worker',
             'labscript_devices.FunctionRunner.blacs_workers.FunctionRunnerWorker',
-            {},
+            {
+                'async_stop_functions': properties.get('async_stop_functions', False),
+                'stop_function_deadline': properties.get('stop_function_deadline', 60),
+            },
         )
         self.primary_worker = 'main_worker'
@@ -11,6 +11,9 @@
 #                                                                   #
 #####################################################################
 import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
 from time import monotonic
 import numpy as np
 import labscript_utils.h5_lock
@@ -19,6 +22,7 @@ import h5py
 from blacs.tab_base_classes import Worker
 import runmanager.remote
 from zprocess import rich_print
+from labscript_utils import dedent
 from .utils import deserialise_function
 
 BLUE = '#66D9EF'
@@ -33,6 +37,8 @@ def deserialise_function_table(function_table, device_name):
             t = 'start'
         elif t == np.inf:
             t = 'stop'
+        if isinstance(name, bytes):
+            name = name.decode('utf8')
         # We deserialise the functions in a namespace with the given __name__ and
         # __file__ so that if the user instantiates a lyse.Run object, that the results
         # will automatically be saved to a results group with the name of this
@@ -52,10 +58,118 @@ class ShotContext(object):
 
 
 class FunctionRunnerWorker(Worker):
+    def init(self):
+        self.scheduler = None
+        # For running stop functions in the background if async_stop_functions is set,
+        # and the Future and deadline of the last shot's stop functions:
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.stop_functions = None
+        self.stop_functions_deadline = None
+
     def program_manual(self, values):
         return {}
 
+    def run_timed_functions(self, timed_functions, t0, stop):
+        """Run the mid-shot functions at their times relative to t0, recording the
+        latency of each call, until done or until the stop event is set"""
+        for t, name, function, args, kwargs in timed_functions:
+            if stop.wait(max(0, t0 + t - monotonic())):
+                break
+            latency = monotonic() - (t0 + t)
+            self.latencies.append((t, name, latency))
+            rich_print(f"  t={t}: {name}() (latency {latency * 1e3:.3f} ms)", color=BLUE)
+            try:
+                function(self.shot_context, t, *args, **kwargs)
+            except Exception as e:
+                self.scheduler_exception = e
+                self.logger.exception(f"Error in mid-shot function {name}")
+                break
+
+    def stop_scheduler(self):
+        """Skip any mid-shot functions not yet run, wait for any that is running to
+        return, and return the exception raised by one of them, if any"""
+        if self.scheduler is None:
+            return None
+        thread, stop = self.scheduler
+        self.scheduler = None
+        stop.set()
+        thread.join()
+        return self.scheduler_exception
+
+    def save_latencies(self, h5_file):
+        table_dtypes = [('t', float), ('name', h5py.special_dtype(vlen=str)), ('latency', float)]
+        data = np.array(self.latencies, dtype=table_dtypes)
+        with h5py.File(h5_file, 'r+') as f:
+            group = f.require_group('data/function_latencies')
+            group.create_dataset(self.device_name, data=data)
+
+    def wait_for_stop_functions(self):
+        """Wait for the previous shot's stop functions, if running in the background,
+        to complete. Raise an exception if they don't complete by their deadline, or
+        if one of them raised one. Either is raised only once: stop functions still
+        running after the deadline are abandoned, and later shots do not wait for
+        them."""
+        if self.stop_functions is None:
+            return
+        stop_functions, self.stop_functions = self.stop_functions, None
+        timeout = max(0, self.stop_functions_deadline - monotonic())
+        try:
+            stop_functions.result(timeout=timeout)
+        except TimeoutError:
+            # Leave the thread running them behind, so that the stop functions of
+            # later shots do not queue up behind them:
+            self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            msg = f"""Stop functions of the previous shot did not complete within
+                {self.stop_function_deadline}s"""
+            raise RuntimeError(dedent(msg)) from None
+
+    def stop_function_results_file(self, h5_file):
+        """The file to which the outcomes of stop functions run in the background are
+        saved. This is not the shot file, which by then has been handed on, and may be
+        open elsewhere (e.g. in lyse)"""
+        basename = os.path.splitext(h5_file)[0]
+        return f'{basename}_{self.device_name}_stop_functions.h5'
+
+    def run_stop_functions_async(self, function_table, shot_context):
+        """Run stop functions in the background, and save their outcomes to
+        stop_function_results_file()"""
+        results = []
+        exception = None
+        for t, name, function, args, kwargs in function_table:
+            rich_print(f"  t={t}: {name}() (background)", color=BLUE)
+            start_time = monotonic()
+            try:
+                function(shot_context, t, *args, **kwargs)
+                error = ''
+            except Exception as e:
+                error = traceback.format_exc()
+                exception = e
+                self.logger.exception(f"Error in stop function {name}")
+            results.append((name, monotonic() - start_time, error))
+            if error:
+                break
+        table_dtypes = [
+            ('name', h5py.special_dtype(vlen=str)),
+            ('duration', float),
+            ('error', h5py.special_dtype(vlen=str)),
+        ]
+        data = np.array(results, dtype=table_dtypes)
+        results_file = self.stop_function_results_file(shot_context.h5_file)
+        with h5py.File(results_file, 'w') as f:
+            dataset = f.create_dataset('stop_function_results', data=data)
+            dataset.attrs['shot_file'] = shot_context.h5_file
+            dataset.attrs['device_name'] = self.device_name
+        rich_print("[finished background stop functions]", color=PURPLE)
+        if exception is not None:
+            # Raised by wait_for_stop_functions() in the next shot, so that it is
+            # reported in BLACS:
+            shot_name = os.path.basename(shot_context.h5_file)
+            msg = f"Stop function {name} of shot {shot_name} raised an exception"
+            raise RuntimeError(msg) from exception
+
     def transition_to_buffered(self, device_name, h5_file, initial_values, fresh):
+        self.wait_for_stop_functions()
         rich_print(f"====== new shot: {os.path.basename(h5_file)} ======", color=GREEN)
         with h5py.File(h5_file, 'r') as f:
             group = f[f'devices/{self.device_name}']
@@ -71,6 +185,7 @@ class FunctionRunnerWorker(Worker):
         self.shot_context = ShotContext(h5_file, self.device_name)
         if self.function_table[0][0] != 'start':
             rich_print("no start functions", color=GREY)
+            self.start_scheduler()
             return {}
         rich_print("[running start functions]", color=PURPLE)
         while self.function_table:
@@ -81,14 +196,51 @@ class FunctionRunnerWorker(Worker):
             rich_print(f"  t={t}: {name}()", color=BLUE)
             function(self.shot_context, t, *args, **kwargs)
         rich_print("[finished start functions]", color=PURPLE)
+        self.start_scheduler()
         return {}
 
+    def start_scheduler(self):
+        """Start running the mid-shot functions in a thread, with times relative to
+        now, the end of this device's transition to buffered. This is not t=0 of the
+        shot, which begins when the master pseudoclock is started, after all devices
+        have transitioned to buffered."""
+        timed_functions = []
+        while self.function_table and self.function_table[0][0] != 'stop':
+            timed_functions.append(self.function_table.pop(0))
+        if not timed_functions:
+            return
+        rich_print("[scheduling mid-shot functions]", color=PURPLE)
+        self.latencies = []
+        self.scheduler_exception = None
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self.run_timed_functions,
+            args=(timed_functions, monotonic(), stop),
+            daemon=True,
+        )
+        self.scheduler = thread, stop
+        thread.start()
+
     def transition_to_manual(self):
         if self.function_table is None:
             return True
-        elif not self.function_table:
+        if self.scheduler is not None:
+            exception = self.stop_scheduler()
+            rich_print("[finished mid-shot functions]", color=PURPLE)
+            self.save_latencies(self.shot_context.h5_file)
+            if exception is not None:
+                raise exception
+        if not self.function_table:
             rich_print("no stop functions", color=GREY)
             return True
+        if self.async_stop_functions:
+            rich_print("[running stop functions in the background]", color=PURPLE)
+            self.stop_functions = self.executor.submit(
+                self.run_stop_functions_async, self.function_table, self.shot_context
+            )
+            self.stop_functions_deadline = monotonic() + self.stop_function_deadline
+            self.function_table = []
+            return True
         rich_print("[running stop functions]", color=PURPLE)
         while self.function_table:
             t, name, function, args, kwargs = self.function_table.pop(0)
@@ -100,10 +252,17 @@ class FunctionRunnerWorker(Worker):
         return True
 
     def shutdown(self):
-        return
+        self.stop_scheduler()
+        # Give background stop functions until their deadline to finish, but don't
+        # hang if they never do:
+        if self.stop_functions is not None:
+            timeout = max(0, self.stop_functions_deadline - monotonic())
+            wait([self.stop_functions], timeout=timeout)
+        self.executor.shutdown(wait=False)
 
     def abort_buffered(self):
         return self.transition_to_manual()
 
     def abort_transition_to_buffered(self):
+        self.stop_scheduler()
         return True
@@ -1,15 +1,46 @@
 import numpy as np
-from labscript import Device
+from labscript import Device, set_passed_properties
 from labscript_utils import dedent
 import labscript_utils.h5_lock, h5py
 from .utils import serialise_function
 
 
 class FunctionRunner(Device):
-    """A labscript device to run custom functions before, after, or during (not yet
-    implemented) the experiment in software time"""
-
-    def __init__(self, name, **kwargs):
+    """A labscript device to run custom functions before, after, or during the
+    experiment in software time.
+
+    Args:
+        name (str): python variable name to assign to the FunctionRunner
+        async_stop_functions (bool, optional): If True, 'stop' functions are run in
+            the background after transition_to_manual returns, so that slow functions
+            do not delay the next shot. The next shot's transition_to_buffered waits
+            for them to finish, so functions still run in order from one shot to the
+            next. Note that the shot file may then be handed on (e.g. to lyse) before
+            the stop functions have finished with it, so they should not write to it.
+            The outcome of each function (its duration, and the traceback of any
+            exception, which then stops the remaining functions) is therefore not
+            saved in the shot file, but in the dataset 'stop_function_results' of a
+            separate file next to it, '<shot name>_<name>_stop_functions.h5'. An
+            exception is also raised when the next shot transitions to buffered, so
+            that it is reported in BLACS.
+        stop_function_deadline (float, optional): With async_stop_functions, the
+            number of seconds the stop functions of a shot may take before the next
+            shot fails to transition to buffered. Stop functions still running then
+            are abandoned, so only that shot fails. This is also how long closing
+            BLACS waits for them.
+    """
+
+    @set_passed_properties(
+        property_names={
+            'connection_table_properties': [
+                'async_stop_functions',
+                'stop_function_deadline',
+            ]
+        }
+    )
+    def __init__(
+        self, name, async_stop_functions=False, stop_function_deadline=60, **kwargs
+    ):
         Device.__init__(self, name=name, parent_device=None, connection=None, **kwargs)
         self.functions = []
         self.BLACS_connection = name
@@ -21,8 +52,23 @@ class FunctionRunner(Device):
         instantiating this device to control the relative order that its 'start' and
         'stop' functions run compared to the transition_to_manual and
         transition_to_buffered functions of other devices. Multiple functions added to
-        run at the same time will be run in the order added. Running functions mid-shot
-        in software time is yet to be implemented.
+        run at the same time will be run in the order added.
+
+        If t is a number, the function will run mid-shot in software time, t seconds
+        after this device has finished transitioning to buffered (and run its 'start'
+        functions). Note that t is therefore *not* measured from t=0 of the shot: the
+        shot starts later, once all devices have transitioned to buffered and the
+        master pseudoclock has been started, by an amount that depends on the other
+        devices and is not known to this device. Mid-shot functions are not
+        synchronised with the hardware timing of the shot, and so are only as precise
+        as BLACS' transitions and the operating system's scheduling allow. Set a large
+        `start_order` to have this device transition last, as close as possible to the
+        start of the shot, and allow for the remaining offset when choosing t.
+        Mid-shot functions are run in order in a separate thread, and any not yet run
+        when the shot ends are skipped. The delay between the requested and actual
+        time of each call, both relative to the end of this device's transition to
+        buffered, is saved in the shot file in the dataset
+        'data/function_latencies/<device_name>'.
 
         The function must have a call signature like the following:
 
@@ -82,9 +128,10 @@ class FunctionRunner(Device):
             t = np.inf
         else:
             t = float(t)
-            msg = """Running functions mid-experiment not yet implemented. For now, t
-                must be "start" or "stop"."""
-            raise NotImplementedError(dedent(msg))
+            if not 0 <= t < np.inf:
+                msg = """t must be "start", "stop", or a finite, non-negative number of
+                    seconds"""
+                raise ValueError(dedent(msg))
         self.functions.append((t, name, source, args, kwargs))
 
     def generate_code(self, hdf5_file):
@@ -0,0 +1,58 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/FunctionRunner/testing/test_FunctionRunner_utils.py
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+from labscript_devices.FunctionRunner.utils import (
+    serialise_function,
+    deserialise_function,
+    _compile_function_source,
+)
+
+def foo(shot_context, t, arg, scale=1):
+    # Count calls in the namespace the function was defined in:
+    namespace = globals()
+    namespace['calls'] = namespace.get('calls', 0) + 1
+    return namespace['calls'] * arg * scale
+
+
+def bar(shot_context, t):
+    return 'bar'
+
+
+def test_deserialise_reuses_cached_code():
+    _compile_function_source.cache_clear()
+    serialised = serialise_function(foo, 2, scale=3)
+
+    first, args, kwargs = deserialise_function(*serialised)
+    assert _compile_function_source.cache_info().misses == 1
+    assert _compile_function_source.cache_info().hits == 0
+    assert list(args) == [2]
+    assert kwargs == {'scale': 3}
+
+    second, _, _ = deserialise_function(*serialised)
+    assert _compile_function_source.cache_info().misses == 1
+    assert _compile_function_source.cache_info().hits == 1
+    assert second.__code__ is first.__code__
+
+    # Each deserialisation still gets a fresh namespace, so no state is shared:
+    assert second.__globals__ is not first.__globals__
+    assert first(None, 0, 1) == 1
+    assert first(None, 0, 1) == 2
+    assert second(None, 0, 1) == 1
+
+
+def test_deserialise_changed_source_is_recompiled():
+    _compile_function_source.cache_clear()
+    first, _, _ = deserialise_function(*serialise_function(foo, 1))
+    other, _, _ = deserialise_function(*serialise_function(bar))
+    assert _compile_function_source.cache_info().misses == 2
+    assert other.__code__ is not first.__code__
+    assert other(None, 0) == 'bar'
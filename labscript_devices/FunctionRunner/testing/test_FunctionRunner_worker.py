@@ -0,0 +1,215 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/FunctionRunner/testing/test_FunctionRunner_worker.py
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+import logging
+from time import monotonic
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+from labscript_devices.FunctionRunner.blacs_workers import FunctionRunnerWorker
+from labscript_devices.FunctionRunner.utils import serialise_function
+
+DEVICE_NAME = 'function_runner'
+
+
+def record(shot_context, t):
+    from time import monotonic
+
+    if not hasattr(shot_context, 'calls'):
+        shot_context.calls = []
+    shot_context.calls.append((t, monotonic()))
+
+
+def slow(shot_context, t, duration):
+    import time
+
+    time.sleep(duration)
+    shot_context.slow_finished = True
+
+
+def fail(shot_context, t):
+    raise ValueError('stop function failed')
+
+
+def make_shot(path, functions):
+    """Write a shot file with a function table like FunctionRunner.generate_code does,
+    given a list of (t, function, args, kwargs)"""
+    table = []
+    for t, function, args, kwargs in functions:
+        t = {'start': -np.inf, 'stop': np.inf}.get(t, t)
+        table.append((t, *serialise_function(function, *args, **kwargs)))
+    table.sort(key=lambda item: item[0])
+    vlenstr = h5py.special_dtype(vlen=str)
+    table_dtypes = [
+        ('t', float),
+        ('name', vlenstr),
+        ('source', vlenstr),
+        ('args', vlenstr),
+        ('kwargs', vlenstr),
+    ]
+    with h5py.File(path, 'w') as f:
+        f.create_group('globals')
+        group = f.create_group(f'devices/{DEVICE_NAME}')
+        group.create_dataset('FUNCTION_TABLE', data=np.array(table, dtype=table_dtypes))
+    return str(path)
+
+
+def make_worker(async_stop_functions=False, stop_function_deadline=60):
+    worker = FunctionRunnerWorker.__new__(FunctionRunnerWorker)
+    worker.device_name = DEVICE_NAME
+    worker.logger = logging.getLogger(DEVICE_NAME)
+    worker.async_stop_functions = async_stop_functions
+    worker.stop_function_deadline = stop_function_deadline
+    worker.init()
+    return worker
+
+
+@pytest.fixture
+def worker():
+    worker = make_worker()
+    yield worker
+    worker.shutdown()
+
+
+def test_mid_shot_timing(worker, tmp_path):
+    times = [0, 0.05, 0.1, 0.2]
+    functions = [('start', record, (), {})] + [(t, record, (), {}) for t in times]
+    h5_file = make_shot(tmp_path / 'shot.h5', functions)
+
+    worker.transition_to_buffered(DEVICE_NAME, h5_file, {}, True)
+    # The functions' times are measured from the end of transition_to_buffered, after
+    # the start functions have run, so this bounds the reference from above:
+    end_of_transition = monotonic()
+    while len(worker.shot_context.calls) < 1 + len(times):
+        assert monotonic() - end_of_transition < 5, "mid-shot functions did not run"
+        worker.scheduler[0].join(0.01)
+    worker.transition_to_manual()
+
+    (_, start_function_called), *calls = worker.shot_context.calls
+    assert [t for t, _ in calls] == times
+    for t, called in calls:
+        assert start_function_called <= called - t <= end_of_transition + 0.05
+
+    with h5py.File(h5_file, 'r') as f:
+        latencies = f[f'data/function_latencies/{DEVICE_NAME}'][:]
+    assert list(latencies['t']) == times
+    assert [name.decode() for name in latencies['name']] == ['record'] * len(times)
+    assert np.all(latencies['latency'] >= 0)
+    assert np.all(latencies['latency'] < 0.05)
+    # The recorded latencies are consistent with when the functions actually ran:
+    t0 = calls[0][1] - latencies['latency'][0]
+    for (t, called), latency in zip(calls, latencies['latency']):
+        assert called - (t0 + t) == pytest.approx(latency, abs=0.01)
+
+
+def test_mid_shot_functions_skipped_at_end_of_shot(worker, tmp_path):
+    functions = [(0, record, (), {}), (60, record, (), {})]
+    h5_file = make_shot(tmp_path / 'shot.h5', functions)
+
+    worker.transition_to_buffered(DEVICE_NAME, h5_file, {}, True)
+    start = monotonic()
+    while not hasattr(worker.shot_context, 'calls'):
+        assert monotonic() - start < 5, "mid-shot function did not run"
+        worker.scheduler[0].join(0.01)
+    worker.transition_to_manual()
+    assert monotonic() - start < 5
+    assert [t for t, _ in worker.shot_context.calls] == [0]
+
+
+def test_slow_async_stop_functions(tmp_path):
+    worker = make_worker(async_stop_functions=True, stop_function_deadline=5)
+    try:
+        functions = [('stop', slow, (0.5,), {}), ('stop', record, (), {})]
+        h5_file = make_shot(tmp_path / 'shot.h5', functions)
+        with open(h5_file, 'rb') as f:
+            shot_file_contents = f.read()
+
+        worker.transition_to_buffered(DEVICE_NAME, h5_file, {}, True)
+        start = monotonic()
+        worker.transition_to_manual()
+        # The shot is handed on without waiting for the stop functions:
+        assert monotonic() - start < 0.25
+        shot_context = worker.shot_context
+        assert not hasattr(shot_context, 'slow_finished')
+
+        # The next shot waits for them, and their outcomes are not written to the
+        # shot file, which may by then be open elsewhere:
+        next_h5_file = make_shot(tmp_path / 'next_shot.h5', functions)
+        worker.transition_to_buffered(DEVICE_NAME, next_h5_file, {}, True)
+        assert monotonic() - start >= 0.5
+        assert shot_context.slow_finished
+        assert [t for t, _ in shot_context.calls] == ['stop']
+        with open(h5_file, 'rb') as f:
+            assert f.read() == shot_file_contents
+
+        results_file = worker.stop_function_results_file(h5_file)
+        assert results_file == str(tmp_path / f'shot_{DEVICE_NAME}_stop_functions.h5')
+        with h5py.File(results_file, 'r') as f:
+            dataset = f['stop_function_results']
+            assert dataset.attrs['shot_file'] == h5_file
+            results = dataset[:]
+        assert [name.decode() for name in results['name']] == ['slow', 'record']
+        assert results['duration'][0] >= 0.5
+        assert [error.decode() for error in results['error']] == ['', '']
+    finally:
+        worker.shutdown()
+
+
+def test_async_stop_function_error_is_raised_at_next_shot(tmp_path):
+    worker = make_worker(async_stop_functions=True, stop_function_deadline=5)
+    try:
+        functions = [('stop', fail, (), {}), ('stop', record, (), {})]
+        h5_file = make_shot(tmp_path / 'shot.h5', functions)
+        worker.transition_to_buffered(DEVICE_NAME, h5_file, {}, True)
+        worker.transition_to_manual()
+        next_h5_file = make_shot(tmp_path / 'next_shot.h5', [('stop', record, (), {})])
+        with pytest.raises(RuntimeError, match='Stop function fail of shot shot.h5') as e:
+            worker.transition_to_buffered(DEVICE_NAME, next_h5_file, {}, True)
+        assert str(e.value.__cause__) == 'stop function failed'
+        with h5py.File(worker.stop_function_results_file(h5_file), 'r') as f:
+            results = f['stop_function_results'][:]
+        # An exception stops the remaining functions:
+        assert [name.decode() for name in results['name']] == ['fail']
+        assert 'stop function failed' in results['error'][0].decode()
+        # And is raised only once:
+        worker.transition_to_buffered(DEVICE_NAME, next_h5_file, {}, True)
+    finally:
+        worker.shutdown()
+
+
+def test_async_stop_functions_deadline(tmp_path):
+    worker = make_worker(async_stop_functions=True, stop_function_deadline=0.2)
+    slow_shot = make_shot(tmp_path / 'slow_shot.h5', [('stop', slow, (1,), {})])
+    shot = make_shot(tmp_path / 'shot.h5', [('stop', record, (), {})])
+    worker.transition_to_buffered(DEVICE_NAME, slow_shot, {}, True)
+    worker.transition_to_manual()
+    with pytest.raises(RuntimeError, match='did not complete'):
+        worker.transition_to_buffered(DEVICE_NAME, shot, {}, True)
+
+    # The overdue stop functions are reported once, and don't hold up later shots:
+    start = monotonic()
+    worker.transition_to_buffered(DEVICE_NAME, shot, {}, True)
+    shot_context = worker.shot_context
+    worker.transition_to_manual()
+    worker.transition_to_buffered(DEVICE_NAME, shot, {}, True)
+    assert monotonic() - start < 0.5
+    assert [t for t, _ in shot_context.calls] == ['stop']
+
+    # Nor does shutting down wait for stop functions beyond their deadline:
+    worker.transition_to_buffered(DEVICE_NAME, slow_shot, {}, True)
+    worker.transition_to_manual()
+    start = monotonic()
+    worker.shutdown()
+    assert 0.15 < monotonic() - start < 0.5
@@ -13,6 +13,7 @@
 
 import inspect
 import textwrap
+from functools import lru_cache
 from types import FunctionType
 from labscript_utils import dedent
 from labscript_utils.properties import serialise, deserialise
@@ -46,6 +47,14 @@ def serialise_function(function, *args, **kwargs):
     return function.__name__, source, args, kwargs
 
 
+@lru_cache(maxsize=256)
+def _compile_function_source(source):
+    """Compile the source of a serialised function. Cached, keyed by the source, so that
+    shot after shot of the same functions are only compiled once. A change in the
+    source is a different key, so stale code is never used."""
+    return compile(source, '<string>', 'exec', dont_inherit=True,)
+
+
 def deserialise_function(
     name, source, args, kwargs, __name__=None, __file__='<string>'
 ):
@@ -56,7 +65,9 @@ def deserialise_function(
         name = name.decode('utf8')
     args = deserialise(args)
     kwargs = deserialise(kwargs)
-    code = compile(source, '<string>', 'exec', dont_inherit=True,)
+    # The code object is reused, but it is executed afresh in a new namespace each
+    # time, so that no state is shared between shots:
+    code = _compile_function_source(source)
     namespace = {'__name__': __name__, '__file__': __file__}
     exec(code, namespace)
     return namespace[name], args, kwargs
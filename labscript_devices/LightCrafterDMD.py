@@ -15,8 +15,6 @@
 import base64
 import os
 import struct
-import PIL.Image
-from io import BytesIO
     
 import labscript_utils.h5_lock, h5py
 
@@ -42,12 +40,23 @@ from qtutils.qt.QtCore import pyqtSignal as Signal
 
 def arr_to_bmp(arr):
     """Convert array to 1 bit BMP, white wherever the array is nonzero, and return a
-    bytestring of the BMP data"""
-    binary_arr = 255 * (arr != 0).astype(np.uint8)
-    im = PIL.Image.fromarray(binary_arr, mode='L').convert('1')
-    f = BytesIO()
-    im.save(f, "BMP")
-    return f.getvalue()
+    bytestring of the BMP data. The output is identical to that of saving the image
+    as a BMP with PIL in mode '1'."""
+    arr = np.asarray(arr)
+    height, width = arr.shape
+    # Rows are stored bottom to top, one bit per pixel with the most significant bit
+    # first, and each row padded to a multiple of four bytes:
+    row_bytes = (width + 7) // 8
+    stride = row_bytes + (-row_bytes % 4)
+    pixels = np.zeros((height, stride), dtype=np.uint8)
+    pixels[:, :row_bytes] = np.packbits(arr[::-1] != 0, axis=1)
+    # File header, info header (with 96 DPI resolution and a two colour palette),
+    # and the palette itself (black, white):
+    offset = 14 + 40 + 8
+    header = struct.pack('<2sIHHI', b'BM', offset + pixels.size, 0, 0, offset)
+    info = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 1, 0, pixels.size, 3780, 3780, 2, 2)
+    palette = b'\x00\x00\x00\x00\xff\xff\xff\x00'
+    return header + info + palette + pixels.tobytes()
 
 
 WIDTH = 608
@@ -72,7 +81,13 @@ class ImageSet(Output):
         Output.__init__(self, name, parent_device, connection)
         
     def set_array(self, t, arr):
-        self.set_image(t, raw=arr_to_bmp(arr))
+        """set an image at the given time from an array, white wherever the array is
+        nonzero"""
+        arr = np.asarray(arr)
+        # arr_to_bmp produces a valid 1 bit BMP, so only the dimensions need checking:
+        if arr.shape != (self.height, self.width):
+            raise LabscriptError('Array (for DMD output %s) has wrong dimensions. Array shape was %s, expected %s'%(self.name, arr.shape, (self.height, self.width)))
+        self.add_instruction(t, arr_to_bmp(arr))
          
     def set_image(self, t, path=None, raw=None):
         """set an image at the given time, either by a filepath to a bmp file,
@@ -150,8 +165,20 @@ class LightCrafterDMD(IntermediateDevice):
           
         # Apparently you should use np.void for binary data in a h5 file. Then on the way out, we need to use data.tostring() to decode again.
         out_table = np.void(output.raw_output)
+        # Store each distinct image only once, along with the index of the image to
+        # display at each step of the sequence:
+        pattern_indices = {}
+        first_uses = []
+        indices = np.zeros(len(out_table), dtype=np.uint32)
+        for i, image in enumerate(out_table):
+            image = image.tobytes()
+            if image not in pattern_indices:
+                pattern_indices[image] = len(first_uses)
+                first_uses.append(i)
+            indices[i] = pattern_indices[image]
         grp = self.init_device_group(hdf5_file)
-        grp.create_dataset('IMAGE_TABLE',compression=config.compression,data=out_table)
+        grp.create_dataset('PATTERN_TABLE',compression=config.compression,data=out_table[first_uses])
+        grp.create_dataset('PATTERN_INDICES',compression=config.compression,data=indices)
         
 @BLACS_tab
 class LightCrafterTab(DeviceTab):
@@ -237,15 +264,26 @@ class LightCrafterWorker(Worker):
                     'pattern': b'\x04',
                     }
     # Packets must be in the form [packet type (1 bit), command (2), flags (1), payload length (2), data (N), checksum (1)]
+
+    # When the device reports it is busy, wait this long before sending the packet
+    # again, doubling the wait each time up to busy_max_delay, and giving up after
+    # busy_retries retries:
+    busy_initial_delay = 0.01
+    busy_max_delay = 5
+    busy_retries = 12
+    # How long to wait for a response before giving up (in seconds):
+    timeout = 10
     
     def init(self):
         global socket; import socket
         global struct; import struct
+        global time; import time
+        global hashlib; import hashlib
         self.host, self.port = self.server.split(':')
         self.port = int(self.port)
-        self.smart_cache = {'IMAGE_TABLE': ''}
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.host,self.port))
+        # A hash of the pattern last uploaded to each pattern slot on the device:
+        self.smart_cache = {'pattern_slots': []}
+        self.sock = socket.create_connection((self.host,self.port), timeout=self.timeout)
         # Initialise it to a static image display
         self.send(self.send_packet_type['write'], self.command['display_mode'], self.display_mode['static'])
         
@@ -257,35 +295,52 @@ class LightCrafterWorker(Worker):
     def send(self, type, command, data):
         packet = b''.join([type,command,self.flag['complete'],struct.pack('<H',len(data)),data])
         packet += struct.pack('<B',sum(bytearray(packet)) % 256) # add the checksum
-        self.sock.send(packet)
-        return self.receive()
+        delay = self.busy_initial_delay
+        for retries in range(self.busy_retries + 1):
+            if retries:
+                # the system was busy and didn't process the packet, so send it again
+                # after a delay that grows each time:
+                time.sleep(delay)
+                delay = min(2 * delay, self.busy_max_delay)
+            self.sock.sendall(packet)
+            recv = self._receive()
+            if recv['type'] != "System Busy":
+                return self.receive(recv)
+        raise Exception('Device still busy after %d retries of command 0x%s' % (self.busy_retries, command.hex()))
+        
+    def _recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            try:
+                chunk = self.sock.recv(size - len(data))
+            except socket.timeout:
+                raise Exception('No response from device at %s:%d within %s seconds' % (self.host, self.port, self.timeout))
+            if not chunk:
+                raise Exception('Connection to device at %s:%d closed' % (self.host, self.port))
+            data += chunk
+        return data
         
     def _receive(self):
         # This function assumes that we are getting a fresh packet, i.e. there is nothing waiting in the buffer
         # First we get the header bits, to see how big the payload will be:
-        header = self.sock.recv(6)
+        header = self._recv_exactly(6)
         pkt_type = self.receive_packet_type[header[0:1]]
         command = header[1:3]
         flag = header[3:4]
         length = struct.unpack('<H',header[4:6])[0]
-        body = self.sock.recv(length + 1)
+        body = self._recv_exactly(length + 1)
         checksum = body[-1:]
         body = body[:-1]
         return {'header' : header, 'type' : pkt_type, 'command' : command, 'flag' : flag, 'length' : length, 'body' : body, 'checksum' : checksum}
         
-    def receive(self):
-        recv = self._receive()
-        # Check the type
-        while recv['type'] == "System Busy":
-            # the system is busy, guess we should try again in 5 seconds?
-            time.sleep(5)
-            recv = self._receive()
-            
+    def receive(self, recv):
+        """Check a received packet, raising an exception if it is an error, and return
+        True for a write response or the body of a read response"""
         if recv['type'] == "Error":
             # We have an error
             errors = ""
             for e in recv['body']:
-                errors+= self.error_messages[e] + "\n"
+                errors+= self.error_messages[bytes([e])] + "\n"
             
             raise Exception("Error(s) in receive packet: %s"%errors)
         
@@ -301,7 +356,7 @@ class LightCrafterWorker(Worker):
         if recv['type'] == 'Write response':
             return True
         else:
-            return body
+            return recv['body']
     
     
     
@@ -325,12 +380,18 @@ class LightCrafterWorker(Worker):
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         with h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['/devices/'+device_name]
-            if 'IMAGE_TABLE' in group:
+            if 'PATTERN_TABLE' in group:
+                # Expand the distinct patterns into the full sequence of images:
+                table_data = group['PATTERN_TABLE'][:][group['PATTERN_INDICES'][:]]
+            elif 'IMAGE_TABLE' in group:
+                # Shots compiled before patterns were deduplicated:
                 table_data = group['IMAGE_TABLE'][:]
         
         
         if table_data is not None:
-            oldtable = self.smart_cache['IMAGE_TABLE']
+            pattern_slots = self.smart_cache['pattern_slots']
+            if fresh:
+                del pattern_slots[:]
             self.send(self.send_packet_type['write'], self.command['display_mode'], self.display_mode['pattern'])
             num_of_patterns = len(table_data)
             # We will pad the images we send up to a multiple of four:
@@ -338,25 +399,33 @@ class LightCrafterWorker(Worker):
             
             # bit depth, number of patterns, invert patterns?, trigger type, trigger delay (4 bytes), trigger period (4 bytes), exposure time (4 bytes), led select
             self.send(self.send_packet_type['write'], self.command['sequence_setting'],  struct.pack('<BBBBiiiB',1,padded_num_of_patterns,0,2,0,0,0,0))
-            if fresh or len(oldtable)!=len(table_data) or (oldtable != table_data).any():
-                for i in range(padded_num_of_patterns):
-                    if i < num_of_patterns:
-                        im = table_data[i]
-                    else:
-                        # Padding uses the final image:
-                        im = table_data[-1]
-                    self.send(self.send_packet_type['write'], self.command['pattern_definition'], struct.pack('<B',i) + im.tostring())
+            # Only upload the patterns that differ from what is already in each slot:
+            for i in range(padded_num_of_patterns):
+                if i < num_of_patterns:
+                    im = table_data[i]
+                else:
+                    # Padding uses the final image:
+                    im = table_data[-1]
+                im = im.tobytes()
+                im_hash = hashlib.sha1(im).digest()
+                if i < len(pattern_slots) and pattern_slots[i] == im_hash:
+                    continue
+                if i == len(pattern_slots):
+                    pattern_slots.append(None)
+                # Unknown until the upload is confirmed:
+                pattern_slots[i] = None
+                self.send(self.send_packet_type['write'], self.command['pattern_definition'], struct.pack('<B',i) + im)
+                pattern_slots[i] = im_hash
                 
             self.send(self.send_packet_type['write'], self.command['display_pattern'], struct.pack('<H',0))
             self.send(self.send_packet_type['write'], self.command['start_pattern_sequence'], struct.pack('<B',1))
-            self.smart_cache['IMAGE_TABLE'] = table_data
             
             
         # if response != 'ok':
             # raise Exception('Failed to transition to manual. Message from server was: %s'%response)
             
         
-        self.final_value = {"None" : base64.b64encode(table_data[-1].tostring())}
+        self.final_value = {"None" : base64.b64encode(table_data[-1].tobytes())}
         
         return self.final_value
         
@@ -15,6 +15,7 @@ import h5py
 from labscript_utils import dedent
 
 from blacs.device_base_class import DeviceTab
+from labscript_devices.shot_prefetch import prefetch_queued_shots
 from .utils import split_conn_AO, split_conn_DO
 from . import models
 import warnings
@@ -162,6 +163,8 @@ class NI_DAQmxTab(DeviceTab):
             },
         )
         self.primary_worker = "main_worker"
+        # Read the output tables of the next shot in the queue in advance:
+        prefetch_queued_shots(self)
 
         if wait_acq_device == self.device_name:
             if wait_timeout_device:
@@ -31,6 +31,7 @@ from labscript_utils.connections import _ensure_str
 
 from blacs.tab_base_classes import Worker
 
+from labscript_devices.shot_prefetch import ShotFilePrefetcher
 from .utils import split_conn_port, split_conn_DO, split_conn_AI
 from .daqmx_utils import incomplete_sample_detection
 
@@ -42,6 +43,11 @@ class NI_DAQmxOutputWorker(Worker):
         # some devices, which require power cycling to truly reset.
         DAQmxResetDevice(self.MAX_name)
         self.start_manual_mode_tasks()
+        self.prefetcher = ShotFilePrefetcher(self.device_name, self.read_output_tables)
+        # uint32 DO buffers from previous shots, reused to avoid allocating a new one
+        # every shot. Accessed from the prefetch thread as well, hence the lock:
+        self.DO_buffers = []
+        self.DO_buffers_lock = threading.Lock()
 
     def stop_tasks(self):
         if self.AO_task is not None:
@@ -54,6 +60,7 @@ class NI_DAQmxOutputWorker(Worker):
             self.DO_task = None
 
     def shutdown(self):
+        self.prefetcher.discard()
         self.stop_tasks()
 
     def check_version(self):
@@ -135,19 +142,58 @@ class NI_DAQmxOutputWorker(Worker):
         # TODO: return coerced/quantised values
         return {}
 
-    def get_output_tables(self, h5file, device_name):
-        """Return the AO and DO tables rom the file, or None if they do not exist."""
-        with h5py.File(h5file, 'r') as hdf5_file:
-            group = hdf5_file['devices'][device_name]
-            try:
-                AO_table = group['AO'][:]
-            except KeyError:
-                AO_table = None
-            try:
-                DO_table = group['DO'][:]
-            except KeyError:
-                DO_table = None
-        return AO_table, DO_table
+    def get_DO_buffer(self, shape):
+        """Return a C-contiguous uint32 array of the given shape to read a DO table
+        into, reusing one from a previous shot if there is one of the right shape."""
+        with self.DO_buffers_lock:
+            for i, buffer in enumerate(self.DO_buffers):
+                if buffer.shape == shape:
+                    return self.DO_buffers.pop(i)
+        return np.empty(shape, dtype=np.uint32)
+
+    def release_DO_buffer(self, buffer):
+        """Return a DO buffer for reuse in subsequent shots, once its contents have
+        been written to the device. At most two are kept, enough for one shot being
+        prefetched whilst another is programmed."""
+        with self.DO_buffers_lock:
+            if len(self.DO_buffers) < 2:
+                self.DO_buffers.append(buffer)
+
+    def read_output_tables(self, hdf5_file):
+        """Read the AO and DO tables from an open shot file, and convert each to the
+        C-contiguous array that is written to its output task. Return a tuple
+        (AO_table, AO_data, DO_ports, DO_data), with None for tables that do not
+        exist, where DO_ports is the names of the ports in the columns of DO_data.
+        Called by self.prefetcher, possibly in a background thread."""
+        group = hdf5_file['devices'][self.device_name]
+        AO_table = AO_data = DO_ports = DO_data = None
+        if 'AO' in group:
+            AO_table = group['AO'][:]
+            AO_data = np.ascontiguousarray(
+                structured_to_unstructured(AO_table, dtype=np.float64)
+            )
+        if 'DO' in group:
+            dataset = group['DO']
+            if dataset.dtype.names is None:
+                # Compiled with uint32_DO_table=True, already in the layout we write to
+                # the device. Read it straight into a reusable buffer:
+                DO_ports = [_ensure_str(port) for port in dataset.attrs['ports']]
+                DO_data = self.get_DO_buffer(dataset.shape)
+                dataset.read_direct(DO_data)
+            else:
+                DO_table = dataset[:]
+                DO_ports = DO_table.dtype.names
+                DO_data = np.ascontiguousarray(
+                    structured_to_unstructured(DO_table, dtype=np.uint32)
+                )
+        return AO_table, AO_data, DO_ports, DO_data
+
+    def prefetch_shot(self, h5file):
+        """Read and convert the output tables from the given shot file in a background
+        thread, so that transition_to_buffered need only program the hardware. Called
+        by the tab for the shot at the front of the queue. Optional, if not called the
+        tables are read in transition_to_buffered."""
+        self.prefetcher.prefetch(h5file)
 
     def set_mirror_clock_terminal_connected(self, connected):
         """Mirror the clock terminal on another terminal to allow daisy chaining of the
@@ -180,33 +226,36 @@ class NI_DAQmxOutputWorker(Worker):
             for terminal_pair in self.connected_terminals:
                 DAQmxDisconnectTerms(terminal_pair[0], terminal_pair[1])
 
-    def program_buffered_DO(self, DO_table):
+    def program_buffered_DO(self, DO_table, ports=None):
         """Create the DO task and program in the DO table for a shot. Return a
-        dictionary of the final values of each channel in use"""
+        dictionary of the final values of each channel in use. DO_table is either the
+        structured DO table from the shot file, or, if ports is given, the table
+        already converted by read_output_tables, with a column for each port."""
         if DO_table is None:
             return {}
         self.DO_task = Task()
         written = int32()
-        ports = DO_table.dtype.names
+
+        # Convert DO table to a regular array and ensure it is C continguous:
+        if ports is None:
+            ports = DO_table.dtype.names
+            DO_table = np.ascontiguousarray(
+                structured_to_unstructured(DO_table, dtype=np.uint32)
+            )
 
         final_values = {}
-        for port_str in ports:
+        for i, port_str in enumerate(ports):
             # Add each port to the task:
             con = '%s/%s' % (self.MAX_name, port_str)
             self.DO_task.CreateDOChan(con, "", DAQmx_Val_ChanForAllLines)
 
             # Collect the final values of the lines on this port:
-            port_final_value = DO_table[port_str][-1]
+            port_final_value = DO_table[-1, i]
             for line in range(self.ports[port_str]["num_lines"]):
                 # Extract each digital value from the packed bits:
                 line_final_value = bool((1 << line) & port_final_value)
                 final_values['%s/line%d' % (port_str, line)] = int(line_final_value)
 
-        # Convert DO table to a regular array and ensure it is C continguous:
-        DO_table = np.ascontiguousarray(
-            structured_to_unstructured(DO_table, dtype=np.uint32)
-        )
-
         # Check if DOs are all zero for the whole shot. If they are this triggers a
         # bug in NI-DAQmx that throws a cryptic error for buffered output. In this
         # case, run it as a non-buffered task.
@@ -261,7 +310,10 @@ class NI_DAQmxOutputWorker(Worker):
 
         return final_values
 
-    def program_buffered_AO(self, AO_table):
+    def program_buffered_AO(self, AO_table, AO_data=None):
+        """Create the AO task and program in the AO table for a shot. Return a
+        dictionary of the final values of each channel in use. AO_data, if given, is
+        the AO table already converted by read_output_tables."""
         if AO_table is None:
             return {}
         self.AO_task = Task()
@@ -275,9 +327,11 @@ class NI_DAQmxOutputWorker(Worker):
         final_values = dict(zip(AO_table.dtype.names, AO_table[-1]))
 
         # Convert AO table to a regular array and ensure it is C continguous:
-        AO_table = np.ascontiguousarray(
-            structured_to_unstructured(AO_table, dtype=np.float64)
-        )
+        if AO_data is None:
+            AO_data = np.ascontiguousarray(
+                structured_to_unstructured(AO_table, dtype=np.float64)
+            )
+        AO_table = AO_data
 
         # Check if AOs are all zero for the whole shot. If they are this triggers a
         # bug in NI-DAQmx that throws a cryptic error for buffered output. In this
@@ -331,8 +385,10 @@ class NI_DAQmxOutputWorker(Worker):
         # Stop the manual mode output tasks, if any:
         self.stop_tasks()
 
-        # Get the data to be programmed into the output tasks:
-        AO_table, DO_table = self.get_output_tables(h5file, device_name)
+        # Get the data to be programmed into the output tasks, prefetched if
+        # prefetch_shot() was called for this file:
+        with h5py.File(h5file, 'r') as hdf5_file:
+            AO_table, AO_data, DO_ports, DO_data = self.prefetcher.get(hdf5_file)
 
         # Mirror the clock terminal, if applicable:
         self.set_mirror_clock_terminal_connected(True)
@@ -341,8 +397,11 @@ class NI_DAQmxOutputWorker(Worker):
         self.set_connected_terminals_connected(True)
 
         # Program the output tasks and retrieve the final values of each output:
-        DO_final_values = self.program_buffered_DO(DO_table)
-        AO_final_values = self.program_buffered_AO(AO_table)
+        DO_final_values = self.program_buffered_DO(DO_data, DO_ports)
+        if DO_data is not None:
+            # DAQmx has copied the data into its own buffer, so we can reuse ours:
+            self.release_DO_buffer(DO_data)
+        AO_final_values = self.program_buffered_AO(AO_table, AO_data)
 
         final_values = {}
         final_values.update(DO_final_values)
@@ -28,8 +28,10 @@ from labscript import (
     set_passed_properties,
 )
 from labscript_utils import dedent
+from labscript_devices.shot_prefetch import table_hash
 from .utils import split_conn_DO, split_conn_AO, split_conn_AI
 import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
 import warnings
 
 _ints = {8: np.uint8, 16: np.uint16, 32: np.uint32, 64: np.uint64}
@@ -57,6 +59,7 @@ class NI_DAQmx(IntermediateDevice):
                 "MAX_name",
                 "static_AO",
                 "static_DO",
+                "uint32_DO_table",
                 "clock_mirror_terminal",
                 "connected_terminals",
                 "AI_range",
@@ -95,6 +98,7 @@ class NI_DAQmx(IntermediateDevice):
         MAX_name=None,
         static_AO=None,
         static_DO=None,
+        uint32_DO_table=False,
         clock_mirror_terminal=None,
         connected_terminals=None,
         acquisition_rate=None,
@@ -135,6 +139,13 @@ class NI_DAQmx(IntermediateDevice):
             MAX_name (str): NI-MAX device name
             static_AO (int, optional): Number of static analog output channels.
             static_DO (int, optional): Number of static digital output channels.
+            uint32_DO_table (bool, optional): If True, store the digital output
+                table in the shot file as a C-contiguous 2D `uint32` array with one
+                column per port, which is the layout written to the device by the
+                BLACS worker. This saves the worker converting and copying the table
+                every shot, at the cost of a larger shot file for ports with fewer than
+                32 lines. The names of the ports are saved in the `'ports'` attribute
+                of the dataset.
             clock_mirror_terminal (str, optional): Channel string of digital output
                 that mirrors the input clock. Useful for daisy-chaning DAQs on the same
                 clockline.
@@ -220,6 +231,7 @@ class NI_DAQmx(IntermediateDevice):
         self.MAX_name = MAX_name if MAX_name is not None else name
         self.static_AO = static_AO
         self.static_DO = static_DO
+        self.uint32_DO_table = uint32_DO_table
 
         self.acquisition_rate = acquisition_rate
         self.AO_range = AO_range
@@ -617,10 +629,28 @@ class NI_DAQmx(IntermediateDevice):
         grp = self.init_device_group(hdf5_file)
         if AO_table is not None:
             grp.create_dataset('AO', data=AO_table, compression=config.compression)
-        if DO_table is not None:
+        if DO_table is not None and self.uint32_DO_table:
+            # Save the table in the layout in which the BLACS worker writes it to the
+            # device. See the comment in the worker's program_manual as to why this is
+            # uint32 regardless of the size of each port:
+            ports = DO_table.dtype.names
+            DO_table = np.ascontiguousarray(
+                structured_to_unstructured(DO_table, dtype=np.uint32)
+            )
+            dataset = grp.create_dataset(
+                'DO', data=DO_table, compression=config.compression
+            )
+            dataset.attrs['ports'] = np.array(ports, dtype='S256')
+        elif DO_table is not None:
             grp.create_dataset('DO', data=DO_table, compression=config.compression)
         if AI_table is not None:
             grp.create_dataset('AI', data=AI_table, compression=config.compression)
+        # Lets the BLACS worker tell whether tables it read in advance are still
+        # those in the shot file, without reading them again:
+        outputs = [name for name in ['AO', 'DO'] if name in grp]
+        self.set_property(
+            'table_hash', table_hash(grp, outputs), location='device_properties'
+        )
 
 
 from .models import *
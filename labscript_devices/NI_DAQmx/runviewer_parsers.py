@@ -4,6 +4,7 @@ import numpy as np
 
 import labscript_utils.properties as properties
 from labscript_utils import dedent
+from labscript_utils.connections import _ensure_str
 
 
 class NI_DAQmxParser(object):
@@ -25,6 +26,12 @@ class NI_DAQmxParser(object):
 
             if 'DO' in f['devices/%s' % self.name]:
                 DO_table = group['DO'][:]
+                if DO_table.dtype.names is None:
+                    # Compiled with uint32_DO_table=True, one column per port:
+                    DO_ports = [_ensure_str(p) for p in group['DO'].attrs['ports']]
+                    DO_table = {p: DO_table[:, i] for i, p in enumerate(DO_ports)}
+                else:
+                    DO_table = {p: DO_table[p] for p in DO_table.dtype.names}
             else:
                 DO_table = None
 
@@ -55,8 +62,7 @@ class NI_DAQmxParser(object):
         traces = {}
 
         if DO_table is not None:
-            ports_in_use = DO_table.dtype.names
-            for port_str in ports_in_use:
+            for port_str in DO_table:
                 for line in range(ports[port_str]["num_lines"]):
                     # Extract each digital value from the packed bits:
                     line_vals = (((1 << line) & DO_table[port_str]) != 0).astype(float)
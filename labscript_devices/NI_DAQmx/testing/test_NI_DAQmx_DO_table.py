@@ -0,0 +1,172 @@
+"""Tests of the NI_DAQmx output worker's handling of the DO table, run against a fake
+PyDAQmx that records what would be written to the device."""
+import sys
+import types
+import importlib
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+import pytest
+
+PORTS = {'port0': {'num_lines': 32}, 'port1': {'num_lines': 8}}
+DAQMX_FUNCTIONS = [
+    'DAQmxConnectTerms',
+    'DAQmxDisconnectTerms',
+    'DAQmxEveryNSamplesEventCallbackPtr',
+    'DAQmxGetSysNIDAQMajorVersion',
+    'DAQmxGetSysNIDAQMinorVersion',
+    'DAQmxGetSysNIDAQUpdateVersion',
+    'DAQmxResetDevice',
+]
+DAQMX_CONSTANTS = [
+    'DAQmx_Val_Acquired_Into_Buffer',
+    'DAQmx_Val_ChanForAllLines',
+    'DAQmx_Val_ContSamps',
+    'DAQmx_Val_Diff',
+    'DAQmx_Val_DoNotInvertPolarity',
+    'DAQmx_Val_FiniteSamps',
+    'DAQmx_Val_GroupByChannel',
+    'DAQmx_Val_GroupByScanNumber',
+    'DAQmx_Val_NRSE',
+    'DAQmx_Val_PseudoDiff',
+    'DAQmx_Val_RSE',
+    'DAQmx_Val_Rising',
+    'DAQmx_Val_Seconds',
+    'DAQmx_Val_Volts',
+]
+
+
+class FakeTask(object):
+    """Records the data written to it"""
+
+    def __init__(self):
+        self.channels = []
+        self.written = []
+
+    def CreateDOChan(self, con, name, grouping):
+        self.channels.append(con)
+
+    def WriteDigitalU32(self, npts, autostart, timeout, layout, data, written, reserved):
+        self.written.append(np.array(data[:npts]))
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class FakeInt(object):
+    def __init__(self, value=0):
+        self.value = value
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """The blacs_workers module, imported with a fake PyDAQmx."""
+    PyDAQmx = types.ModuleType('PyDAQmx')
+    names = {'Task': FakeTask, 'int32': FakeInt, 'uInt32': FakeInt, 'uInt64': FakeInt}
+    names.update({name: lambda *args: None for name in DAQMX_FUNCTIONS})
+    names.update({name: i for i, name in enumerate(DAQMX_CONSTANTS)})
+    for name, value in names.items():
+        setattr(PyDAQmx, name, value)
+    PyDAQmx.__all__ = list(names)
+    monkeypatch.setitem(sys.modules, 'PyDAQmx', PyDAQmx)
+    for submodule in ['DAQmxConstants', 'DAQmxTypes', 'DAQmxCallBack']:
+        module = types.ModuleType('PyDAQmx.' + submodule)
+        module.__all__ = []
+        monkeypatch.setitem(sys.modules, 'PyDAQmx.' + submodule, module)
+    monkeypatch.delitem(
+        sys.modules, 'labscript_devices.NI_DAQmx.blacs_workers', raising=False
+    )
+    module = importlib.import_module('labscript_devices.NI_DAQmx.blacs_workers')
+    yield module
+    monkeypatch.delitem(sys.modules, 'labscript_devices.NI_DAQmx.blacs_workers')
+
+
+def make_worker(workers):
+    worker = workers.NI_DAQmxOutputWorker.__new__(workers.NI_DAQmxOutputWorker)
+    worker.device_name = 'Dev1'
+    worker.MAX_name = 'Dev1'
+    worker.ports = PORTS
+    worker.static_DO = False
+    worker.clock_terminal = 'PFI0'
+    worker.clock_limit = 1e6
+    worker.DO_buffers = []
+    worker.DO_buffers_lock = workers.threading.Lock()
+    return worker
+
+
+def make_DO_table(num_points):
+    """A structured DO table as made by the labscript device"""
+    rng = np.random.default_rng(0)
+    DO_table = np.empty(num_points, dtype=[('port0', np.uint32), ('port1', np.uint8)])
+    DO_table['port0'] = rng.integers(0, 2**32, num_points, dtype=np.uint32)
+    DO_table['port1'] = rng.integers(0, 2**8, num_points, dtype=np.uint8)
+    return DO_table
+
+
+def write_shot(path, DO_table, uint32_DO_table):
+    """Save the DO table as NI_DAQmx.generate_code does"""
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group('Dev1')
+        if uint32_DO_table:
+            ports = DO_table.dtype.names
+            DO_table = np.ascontiguousarray(
+                structured_to_unstructured(DO_table, dtype=np.uint32)
+            )
+            dataset = group.create_dataset('DO', data=DO_table)
+            dataset.attrs['ports'] = np.array(ports, dtype='S256')
+        else:
+            group.create_dataset('DO', data=DO_table)
+
+
+def program(worker, path):
+    with h5py.File(path, 'r') as f:
+        _, _, DO_ports, DO_data = worker.read_output_tables(f)
+    final_values = worker.program_buffered_DO(DO_data, DO_ports)
+    return DO_data, final_values, worker.DO_task
+
+
+def test_uint32_DO_table_matches_structured_table(workers, tmp_path):
+    DO_table = make_DO_table(1000)
+    write_shot(tmp_path / 'structured.h5', DO_table, uint32_DO_table=False)
+    write_shot(tmp_path / 'uint32.h5', DO_table, uint32_DO_table=True)
+
+    # The path before uint32 DO tables, with the structured table passed straight to
+    # program_buffered_DO:
+    worker = make_worker(workers)
+    expected_final_values = worker.program_buffered_DO(DO_table)
+    expected_task = worker.DO_task
+
+    for filename in ['structured.h5', 'uint32.h5']:
+        worker = make_worker(workers)
+        _, final_values, task = program(worker, tmp_path / filename)
+        assert final_values == expected_final_values
+        assert task.channels == expected_task.channels == ['Dev1/port0', 'Dev1/port1']
+        assert len(task.written) == 1
+        assert task.written[0].dtype == np.uint32
+        np.testing.assert_array_equal(task.written[0], expected_task.written[0])
+
+
+def test_DO_buffer_pool_reuse(workers, tmp_path):
+    write_shot(tmp_path / 'shot.h5', make_DO_table(1000), uint32_DO_table=True)
+    write_shot(tmp_path / 'other.h5', make_DO_table(500), uint32_DO_table=True)
+    worker = make_worker(workers)
+
+    first, _, _ = program(worker, tmp_path / 'shot.h5')
+    worker.release_DO_buffer(first)
+    second, _, _ = program(worker, tmp_path / 'shot.h5')
+    # The buffer from the first shot is reused for the second:
+    assert second is first
+    assert not worker.DO_buffers
+
+    # But not for a table of a different shape:
+    worker.release_DO_buffer(second)
+    other, _, _ = program(worker, tmp_path / 'other.h5')
+    assert other is not first
+    assert worker.DO_buffers == [first]
+
+    # At most two buffers are kept:
+    worker.release_DO_buffer(other)
+    worker.release_DO_buffer(np.empty((10, 2), dtype=np.uint32))
+    assert len(worker.DO_buffers) == 2
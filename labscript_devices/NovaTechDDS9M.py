@@ -12,9 +12,10 @@
 #####################################################################
 
 from labscript_devices import runviewer_parser, BLACS_tab
+from labscript_devices.shot_prefetch import table_hash
 
 from labscript import IntermediateDevice, DDS, StaticDDS, Device, config, LabscriptError, set_passed_properties
-from labscript_utils.unitconversions import NovaTechDDS9mFreqConversion, NovaTechDDS9mAmpConversion
+from labscript_utils.unitconversions.NovaTechDDS9m import NovaTechDDS9mFreqConversion, NovaTechDDS9mAmpConversion
 
 import numpy as np
 import labscript_utils.h5_lock, h5py
@@ -30,8 +31,11 @@ class NovaTechDDS9M(IntermediateDevice):
     """
     This class is initilzed with the key word argument  
     'update_mode' -- synchronous or asynchronous\
-    'baud_rate',  -- operating baud rate
+    'baud_rate',  -- operating baud rate, or 'auto' to use the fastest rate at which
+                     the device responds reliably, found when BLACS connects to it
     'default_baud_rate' -- assumed baud rate at startup
+    'upload_window' -- number of table commands BLACS sends before waiting for a
+                       response to the first of them, 1 to wait for each in turn
     """
     description = 'NT-DDS9M'
     allowed_children = [DDS, StaticDDS]
@@ -53,6 +57,7 @@ class NovaTechDDS9M(IntermediateDevice):
                 'update_mode',
                 'synchronous_first_line_repeat',
                 'phase_mode',
+                'upload_window',
             ]
         }
     )
@@ -66,6 +71,7 @@ class NovaTechDDS9M(IntermediateDevice):
         update_mode='synchronous',
         synchronous_first_line_repeat=False,
         phase_mode='continuous',
+        upload_window=16,
         **kwargs
     ):
         IntermediateDevice.__init__(self, name, parent_device, **kwargs)
@@ -74,8 +80,8 @@ class NovaTechDDS9M(IntermediateDevice):
         if not update_mode in ['synchronous', 'asynchronous']:
             raise LabscriptError('update_mode must be \'synchronous\' or \'asynchronous\'')            
         
-        if not baud_rate in bauds:     
-            raise LabscriptError('baud_rate must be one of {0}'.format(list(bauds)))            
+        if not baud_rate in bauds and baud_rate != 'auto':     
+            raise LabscriptError('baud_rate must be one of {0} or \'auto\''.format(list(bauds)))            
 
         if not default_baud_rate in bauds and default_baud_rate is not None:     
             raise LabscriptError('default_baud_rate must be one of {0} or None (to indicate no default)'.format(list(bauds)))            
@@ -83,6 +89,9 @@ class NovaTechDDS9M(IntermediateDevice):
         if not phase_mode in ['aligned', 'continuous']:
             raise LabscriptError('phase_mode must be \'aligned\' or \'continuous\'')
 
+        if upload_window < 1:
+            raise LabscriptError('upload_window must be at least 1')
+
         self.update_mode = update_mode
         self.phase_mode = phase_mode 
         self.synchronous_first_line_repeat = synchronous_first_line_repeat
@@ -230,6 +239,8 @@ class NovaTechDDS9M(IntermediateDevice):
         self.set_property('frequency_scale_factor', 10, location='device_properties')
         self.set_property('amplitude_scale_factor', 1023, location='device_properties')
         self.set_property('phase_scale_factor', 45.511111111111113, location='device_properties')
+        # Lets BLACS skip reading the table if it is the one already on the device:
+        self.set_property('table_hash', table_hash(grp, ['TABLE_DATA']), location='device_properties')
 
 
 
@@ -239,6 +250,7 @@ from blacs.tab_base_classes import Worker, define_state
 from blacs.tab_base_classes import MODE_MANUAL, MODE_TRANSITION_TO_BUFFERED, MODE_TRANSITION_TO_MANUAL, MODE_BUFFERED  
 
 from blacs.device_base_class import DeviceTab
+from labscript_devices.shot_prefetch import prefetch_queued_shots
 
 @BLACS_tab
 class NovatechDDS9MTab(DeviceTab):
@@ -278,6 +290,7 @@ class NovatechDDS9MTab(DeviceTab):
         self.baud_rate = connection_table_properties.get('baud_rate', None)
         self.default_baud_rate = connection_table_properties.get('default_baud_rate', None)
         self.update_mode = connection_table_properties.get('update_mode', 'synchronous')
+        self.upload_window = connection_table_properties.get('upload_window', 16)
         
         # Backward compat:
         blacs_connection =  str(connection_object.BLACS_connection)
@@ -298,8 +311,11 @@ class NovatechDDS9MTab(DeviceTab):
                                                               'baud_rate': self.baud_rate,
                                                               'default_baud_rate': self.default_baud_rate,
                                                               'update_mode': self.update_mode,
-                                                              'phase_mode': self.phase_mode})
+                                                              'phase_mode': self.phase_mode,
+                                                              'upload_window': self.upload_window})
         self.primary_worker = "main_worker"
+        # Read the tables of the next shot in the queue in advance:
+        prefetch_queued_shots(self)
 
         # Set the capabilities of this device
         self.supports_remote_value_check(True)
@@ -307,14 +323,29 @@ class NovatechDDS9MTab(DeviceTab):
 
 
 class NovatechDDS9mWorker(Worker):
+    # Number of consecutive round trips the device must respond to for a baud rate
+    # to be considered reliable:
+    baud_rate_checks = 3
+
     def init(self):
         global serial; import serial
         global socket; import socket
         global h5py; import labscript_utils.h5_lock, h5py
-        self.smart_cache = {'STATIC_DATA': None, 'TABLE_DATA': ''}
+        from labscript_devices.shot_prefetch import ShotFilePrefetcher
+        # The table last programmed, the last static command sent for each
+        # (channel, subchannel) and the last table ('m 0'/'m t') and update
+        # ('I a'/'I e') mode commands sent, and the hash and length of the table
+        # last programmed, if it is entirely on the device:
+        self.smart_cache = {'TABLE_DATA': '', 'static_commands': {}, 'modes': {},
+                            'table_hash': None, 'table_length': None}
+        self.prefetcher = ShotFilePrefetcher(self.device_name, self.read_shot_tables)
         
         if self.default_baud_rate is not None:
             initial_baud_rate = self.default_baud_rate
+        elif self.baud_rate == 'auto':
+            # Open the port at a concrete rate, the slowest, which find_baud_rate()
+            # tries first if the device doesn't respond to it:
+            initial_baud_rate = min(bauds)
         else:
             initial_baud_rate = self.baud_rate
 
@@ -322,27 +353,16 @@ class NovatechDDS9mWorker(Worker):
             self.com_port, baudrate=initial_baud_rate, timeout=0.1
         )
         
-        # Check if the novatech will talk to us on this baud rate:
-        if not self.check_connection():
-            # Nope. Try all baud rates, from slowest to fastest:
-            for rate in sorted(bauds):
-                self.connection.baudrate = rate
-                if self.check_connection():
-                    # found it!
-                    break
-            else:
-                # None of them worked.
-                msg = "Error: tried all baud rates but got no response from NovaTech."
-                raise RuntimeError(msg)
-
-        # If the baud rate we are using to initially talk to the device is not the one
-        # we want to use to program it, switch now to the desired baud rate:
-        if self.connection.baudrate != self.baud_rate:
-            self.connection.write(b'%s\r\n' % bauds[self.baud_rate])
-            # ensure command finishes before switching rates in pyserial:
-            time.sleep(0.1)
-            self.connection.baudrate = self.baud_rate
-            if not self.check_connection():
+        # Find the baud rate the novatech will talk to us on:
+        self.find_baud_rate()
+
+        if self.baud_rate == 'auto':
+            # Switch to the fastest baud rate that works:
+            self.negotiate_baud_rate()
+        elif self.connection.baudrate != self.baud_rate:
+            # The baud rate we are using to initially talk to the device is not the one
+            # we want to use to program it, switch now to the desired baud rate:
+            if not self.switch_baud_rate(self.baud_rate):
                 msg = 'Error: Failed to execute command %s' % bauds[self.baud_rate]
                 raise RuntimeError(msg)           
         
@@ -367,14 +387,10 @@ class NovatechDDS9mWorker(Worker):
             msg = 'Error: Failed to execute command: "e d", received "%s".' % response
             raise Exception(msg)
 
-        self.connection.write(b'I a\r\n')
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: "I a"')
+        self.set_mode('update', b'I a', force=True)
         
         # Ensure we are in single-tone mode:
-        self.connection.write(b'm 0\r\n')
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: "m 0"')
+        self.set_mode('table', b'm 0', force=True)
 
         # Set the phase mode:
         self.connection.write(b'%s\r\n'%self.phase_mode_command)
@@ -397,6 +413,60 @@ class NovatechDDS9mWorker(Worker):
             # empty response, probably not connected
             return False
 
+    def find_baud_rate(self):
+        """Find the baud rate the device is currently talking on, trying the current
+        one first and then all of them from slowest to fastest, and switch our end of
+        the connection to it"""
+        if self.check_connection():
+            return self.connection.baudrate
+        for rate in sorted(bauds):
+            self.connection.baudrate = rate
+            if self.check_connection():
+                # found it!
+                return rate
+        # None of them worked.
+        msg = "Error: tried all baud rates but got no response from NovaTech."
+        raise RuntimeError(msg)
+
+    def switch_baud_rate(self, rate):
+        """Switch the device and our end of the connection to the given baud rate.
+        Returns True if the device then responds to baud_rate_checks consecutive
+        round trips, else False, in which case the rate the device is on is
+        unknown"""
+        self.connection.write(b'%s\r\n' % bauds[rate])
+        # ensure command finishes before switching rates in pyserial:
+        time.sleep(0.1)
+        self.connection.baudrate = rate
+        return all(self.check_connection() for _ in range(self.baud_rate_checks))
+
+    def negotiate_baud_rate(self, max_rate=None):
+        """Switch to the fastest baud rate, up to max_rate if given, at which the
+        device responds reliably, trying them from fastest to slowest"""
+        for rate in sorted(bauds, reverse=True):
+            if max_rate is not None and rate > max_rate:
+                continue
+            if self.switch_baud_rate(rate):
+                self.logger.info('Using baud rate %d' % rate)
+                return rate
+            self.logger.warning('No reliable response at baud rate %d' % rate)
+            # Get back in contact with the device before trying the next rate:
+            self.find_baud_rate()
+        msg = "Error: NovaTech did not respond reliably at any baud rate."
+        raise RuntimeError(msg)
+
+    def verify_baud_rate(self):
+        """Called after a communication error. If the baud rate is being negotiated,
+        check the device still responds reliably at the current rate, and if not,
+        fall back to the fastest slower rate at which it does"""
+        if self.baud_rate != 'auto':
+            return
+        rate = self.connection.baudrate
+        if all(self.check_connection() for _ in range(self.baud_rate_checks)):
+            return
+        self.logger.warning('No reliable response at baud rate %d, renegotiating' % rate)
+        self.find_baud_rate()
+        self.negotiate_baud_rate(max([r for r in bauds if r < rate], default=min(bauds)))
+
     def check_remote_values(self):
         # Get the currently output values:
         self.connection.write(b'QUE\r\n')
@@ -435,93 +505,152 @@ class NovatechDDS9mWorker(Worker):
             command = b'P%d %u\r\n'%(channel,value*16384/360)
         else:
             raise TypeError(type)
+        self.send_static_command(channel, type, command)
+
+    def send_static_command(self, channel, type, command, smart=False):
+        """Send a static frequency, amplitude or phase command and check the response.
+        If smart, skip sending it if the smart cache shows it was the last command sent
+        for that channel and type, and so is already in effect"""
+        static_commands = self.smart_cache['static_commands']
+        if smart and static_commands.get((channel, type)) == command:
+            return
+        # Unknown until confirmed:
+        static_commands.pop((channel, type), None)
         self.connection.write(command)
         if self.connection.readline() != b"OK\r\n":
+            self.verify_baud_rate()
             raise Exception('Error: Failed to execute command: %s' % command.decode('utf8'))
-        # Now that a static update has been done, we'd better invalidate the saved STATIC_DATA:
-        self.smart_cache['STATIC_DATA'] = None
+        static_commands[(channel, type)] = command
+
+    def set_mode(self, kind, command, force=False, check=True):
+        """Send a mode command, either a 'table' mode command (b'm 0' or b'm t') or an
+        'update' mode command (b'I a' or b'I e'), and check the response if check is
+        True. Unless force, skip sending it if the smart cache shows the device is
+        already in that mode"""
+        modes = self.smart_cache['modes']
+        if not force and modes.get(kind) == command:
+            return
+        # Unknown until confirmed:
+        modes.pop(kind, None)
+        self.connection.write(b'%s\r\n' % command)
+        response = self.connection.readline()
+        if check and response != b"OK\r\n":
+            self.verify_baud_rate()
+            raise Exception('Error: Failed to execute command: "%s"' % command.decode('utf8'))
+        modes[kind] = command
+
+    def read_shot_tables(self, hdf5_file, use_cache=True):
+        """Read the static and table data from an open shot file, returning None for
+        either if it is absent, and the table's hash. If use_cache is True and the
+        hash matches that of the table last programmed, the table is not read, and
+        cached is True. Called by self.prefetcher, possibly in a background
+        thread."""
+        static_data = None
+        table_data = None
+        group = hdf5_file['/devices/'+self.device_name]
+        digest = group.attrs.get('table_hash', None)
+        cached = (use_cache and digest is not None
+                  and digest == self.smart_cache['table_hash'])
+        if 'STATIC_DATA' in group:
+            static_data = group['STATIC_DATA'][:][0]
+        if 'TABLE_DATA' in group and not cached:
+            table_data = group['TABLE_DATA'][:]
+        return static_data, table_data, digest, cached
+
+    def prefetch_shot(self, h5file):
+        """Read the tables for the given shot file in a background thread, so that
+        transition_to_buffered need only talk to the device. Called by the tab for the
+        shot at the front of the queue. Optional, if not called the tables are read in
+        transition_to_buffered."""
+        self.prefetcher.prefetch(h5file)
      
     def transition_to_buffered(self,device_name,h5file,initial_values,fresh):
-
-        # The "double clutch" trick: switching to table mode and back again, before
-        # going into table mode for real, is observed empirically to resolve an
-        # off-by-one error in table mode in some circumstances. Presumably it resets the
-        # memory pointer of the device to zero (though it is a mystery why it would not
-        # be zero already at this point)
-
-        # Transition to table mode:
-        self.connection.write(b'm t\r\n')
-        self.connection.readline()
-        # And back to manual mode
-        self.connection.write(b'm 0\r\n')
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: "m 0"')
-
+        if fresh:
+            self.smart_cache['static_commands'] = {}
+            self.smart_cache['modes'] = {}
 
         # Store the initial values in case we have to abort and restore them:
         self.initial_values = initial_values
         # Store the final values to for use during transition_to_static:
         self.final_values = {}
-        static_data = None
-        table_data = None
-        with h5py.File(h5file, 'r') as hdf5_file:
-            group = hdf5_file['/devices/'+device_name]
-            # If there are values to set the unbuffered outputs to, set them now:
-            if 'STATIC_DATA' in group:
-                static_data = group['STATIC_DATA'][:][0]
-            # Now program the buffered outputs:
-            if 'TABLE_DATA' in group:
-                table_data = group['TABLE_DATA'][:]
+        # Read the shot file, or collect the tables already read by prefetch_shot():
+        with h5py.File(h5file,'r') as hdf5_file:
+            static_data, table_data, digest, cached = self.prefetcher.get(hdf5_file)
+            if cached and digest != self.smart_cache['table_hash']:
+                # The smart cache has changed since the file was prefetched:
+                static_data, table_data, digest, cached = self.read_shot_tables(hdf5_file, use_cache=False)
+        if cached:
+            # The table is the one last programmed, which is at the start of the
+            # cached table:
+            table_data = self.smart_cache['TABLE_DATA'][:self.smart_cache['table_length']]
         
         if static_data is not None:
             data = static_data
-            if fresh or data != self.smart_cache['STATIC_DATA']:
-                self.logger.debug('Static data has changed, reprogramming.')
-                self.smart_cache['STATIC_DATA'] = data
-                self.connection.write(b'F2 %.7f\r\n'%(data['freq2']/10.0**7))
-                self.connection.readline()
-                self.connection.write(b'V2 %u\r\n'%(data['amp2']))
-                self.connection.readline()
-                self.connection.write(b'P2 %u\r\n'%(data['phase2']))
-                self.connection.readline()
-                self.connection.write(b'F3 %.7f\r\n'%(data['freq3']/10.0**7))
-                self.connection.readline()
-                self.connection.write(b'V3 %u\r\n'%data['amp3'])
-                self.connection.readline()
-                self.connection.write(b'P3 %u\r\n'%data['phase3'])
-                self.connection.readline()
+            # Only the commands for values that differ from those already on the device
+            # are sent:
+            for ddsno in range(2,4):
+                self.send_static_command(ddsno, 'freq', b'F%d %.7f\r\n'%(ddsno, data['freq%d'%ddsno]/10.0**7), smart=True)
+                self.send_static_command(ddsno, 'amp', b'V%d %u\r\n'%(ddsno, data['amp%d'%ddsno]), smart=True)
+                self.send_static_command(ddsno, 'phase', b'P%d %u\r\n'%(ddsno, data['phase%d'%ddsno]), smart=True)
                 
                 # Save these values into final_values so the GUI can
                 # be updated at the end of the run to reflect them:
-                self.final_values['channel 2'] = {}
-                self.final_values['channel 3'] = {}
-                self.final_values['channel 2']['freq'] = data['freq2']/10.0
-                self.final_values['channel 3']['freq'] = data['freq3']/10.0
-                self.final_values['channel 2']['amp'] = data['amp2']/1023.0
-                self.final_values['channel 3']['amp'] = data['amp3']/1023.0
-                self.final_values['channel 2']['phase'] = data['phase2']*360/16384.0
-                self.final_values['channel 3']['phase'] = data['phase3']*360/16384.0
+                self.final_values['channel %d'%ddsno] = {}
+                self.final_values['channel %d'%ddsno]['freq'] = data['freq%d'%ddsno]/10.0
+                self.final_values['channel %d'%ddsno]['amp'] = data['amp%d'%ddsno]/1023.0
+                self.final_values['channel %d'%ddsno]['phase'] = data['phase%d'%ddsno]*360/16384.0
                     
         # Now program the buffered outputs:
         if table_data is not None:
+            # The "double clutch" trick: switching to table mode and back again, before
+            # going into table mode for real, is observed empirically to resolve an
+            # off-by-one error in table mode in some circumstances. Presumably it resets
+            # the memory pointer of the device to zero (though it is a mystery why it
+            # would not be zero already at this point). So these are always sent.
+
+            # Transition to table mode:
+            self.smart_cache['modes'].pop('table', None)
+            self.connection.write(b'm t\r\n')
+            self.connection.readline()
+            # And back to manual mode
+            self.set_mode('table', b'm 0', force=True)
+
             data = table_data
-            for i, line in enumerate(data):
-                st = time.time()
-                oldtable = self.smart_cache['TABLE_DATA']
-                for ddsno in range(2):
-                    if fresh or i >= len(oldtable) or (line['freq%d'%ddsno],line['phase%d'%ddsno],line['amp%d'%ddsno]) != (oldtable[i]['freq%d'%ddsno],oldtable[i]['phase%d'%ddsno],oldtable[i]['amp%d'%ddsno]):
-                        self.connection.write(b't%d %04x %08x,%04x,%04x,ff\r\n'%(ddsno, i,line['freq%d'%ddsno],line['phase%d'%ddsno],line['amp%d'%ddsno]))
-                        self.connection.readline()
-                et = time.time()
-                tt=et-st
-                self.logger.debug('Time spent on line %s: %s'%(i,tt))
+            oldtable = self.smart_cache['TABLE_DATA']
+            if cached and not fresh:
+                # Nothing to compare, the table is already on the device:
+                commands = []
+            else:
+                commands = self.table_commands(data, oldtable, fresh)
+            self.logger.debug('Programming %d table commands' % len(commands))
+            # Invalidate the smart cache until the upload has succeeded, since we won't
+            # know what's on the device if it fails:
+            self.smart_cache['TABLE_DATA'] = ''
+            self.smart_cache['table_hash'] = None
+            st = time.time()
+            remaining, response = self.send_commands(commands, self.upload_window)
+            if remaining:
+                # Commands that were in flight may or may not have been programmed, so
+                # send them again, waiting for the response to each before the next:
+                msg = 'Received %s during pipelined table upload, retrying in lockstep'
+                self.logger.warning(msg % repr(response))
+                self.verify_baud_rate()
+                remaining, response = self.send_commands(remaining, 1)
+                if remaining:
+                    self.verify_baud_rate()
+                    msg = 'Error: Failed to execute command: %s, received %s'
+                    raise Exception(msg % (remaining[0].decode('utf8'), repr(response)))
+            self.logger.debug('Time spent programming table: %s' % (time.time() - st))
             # Store the table for future smart programming comparisons:
-            try:
-                self.smart_cache['TABLE_DATA'][:len(data)] = data
+            if isinstance(oldtable, np.ndarray) and len(oldtable) >= len(data):
+                oldtable[:len(data)] = data
+                self.smart_cache['TABLE_DATA'] = oldtable
                 self.logger.debug('Stored new table as subset of old table')
-            except: # new table is longer than old table
+            else: # new table is longer than old table
                 self.smart_cache['TABLE_DATA'] = data
                 self.logger.debug('New table is longer than old table and has replaced it.')
+            self.smart_cache['table_hash'] = digest
+            self.smart_cache['table_length'] = len(data)
                 
             # Get the final values of table mode so that the GUI can
             # reflect them after the run:
@@ -535,12 +664,10 @@ class NovatechDDS9mWorker(Worker):
             self.final_values['channel 1']['phase'] = data[-1]['phase1']*360/16384.0
             
             # Transition to table mode:
-            self.connection.write(b'm t\r\n')
-            self.connection.readline()
+            self.set_mode('table', b'm t', check=False)
             if self.update_mode == 'synchronous':
                 # Transition to hardware synchronous updates:
-                self.connection.write(b'I e\r\n')
-                self.connection.readline()
+                self.set_mode('update', b'I e', check=False)
                 # We are now waiting for a rising edge to trigger the output
                 # of the second table pair (first of the experiment)
             elif self.update_mode == 'asynchronous':
@@ -552,6 +679,47 @@ class NovatechDDS9mWorker(Worker):
             
         return self.final_values
     
+    def table_commands(self, data, oldtable, fresh):
+        """Return a list of the commands that program each line of the table data that
+        differs from the old table, for each of the two dynamic channels"""
+        changed = np.ones((len(data), 2), dtype=bool)
+        if not fresh and isinstance(oldtable, np.ndarray):
+            # Compare to the smart cache, up to the end of the shorter table:
+            n = min(len(data), len(oldtable))
+            for ddsno in range(2):
+                names = ['freq%d'%ddsno, 'phase%d'%ddsno, 'amp%d'%ddsno]
+                changed[:n, ddsno] = data[names][:n] != oldtable[names][:n]
+        # Lines in order, then channel within each line:
+        lines, ddsnos = np.nonzero(changed)
+        freqs = np.where(ddsnos, data['freq1'][lines], data['freq0'][lines])
+        phases = np.where(ddsnos, data['phase1'][lines], data['phase0'][lines])
+        amps = np.where(ddsnos, data['amp1'][lines], data['amp0'][lines])
+        return [b't%d %04x %08x,%04x,%04x,ff\r\n' % args for args in
+                zip(ddsnos.tolist(), lines.tolist(), freqs.tolist(), phases.tolist(), amps.tolist())]
+
+    def send_commands(self, commands, window):
+        """Send the commands with up to window commands in flight at a time, and check
+        their responses are OK in order. Return a list of the commands not confirmed
+        as programmed, which is empty on success, and the unexpected response, if
+        any"""
+        confirmed = 0
+        sent = 0
+        while confirmed < len(commands):
+            # Keep the window full, with a single write call:
+            if sent - confirmed < window and sent < len(commands):
+                batch = commands[sent:confirmed + window]
+                self.connection.write(b''.join(batch))
+                sent += len(batch)
+            response = self.connection.readline()
+            if response != b'OK\r\n':
+                # Consume the responses to the commands still in flight so that they
+                # are not mistaken for responses to subsequent commands:
+                for _ in range(sent - confirmed - 1):
+                    self.connection.readline()
+                return commands[confirmed:], response
+            confirmed += 1
+        return [], None
+    
     def abort_transition_to_buffered(self):
         return self.transition_to_manual(True)
         
@@ -560,19 +728,17 @@ class NovatechDDS9mWorker(Worker):
         return self.transition_to_manual(True)
     
     def transition_to_manual(self,abort = False):
-        self.connection.write(b'm 0\r\n')
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: "m 0"')
-        self.connection.write(b'I a\r\n')
-        if self.connection.readline() != b"OK\r\n":
-            raise Exception('Error: Failed to execute command: "I a"')
+        if abort:
+            # We don't know how far through transition_to_buffered we got:
+            self.smart_cache['modes'] = {}
+        # These are skipped if the shot didn't use table mode:
+        self.set_mode('table', b'm 0')
+        self.set_mode('update', b'I a')
         if abort:
             # If we're aborting the run, then we need to reset DDSs 2 and 3 to their initial values.
-            # 0 and 1 will already be in their initial values. We also need to invalidate the smart
-            # programming cache for them.
+            # 0 and 1 will already be in their initial values.
             values = self.initial_values
             DDSs = [2,3]
-            self.smart_cache['STATIC_DATA'] = None
         else:
             # If we're not aborting the run, then we need to set DDSs 0 and 1 to their final values.
             # 2 and 3 will already be in their final values.
@@ -589,6 +755,7 @@ class NovatechDDS9mWorker(Worker):
         return True
                      
     def shutdown(self):
+        self.prefetcher.discard()
         
         # return to the default baud rate
         if self.default_baud_rate is not None:
@@ -145,7 +145,7 @@ class PhaseMatrixQuickSynTab(DeviceTab):
 
         # Set the capabilities of this device
         self.supports_remote_value_check(True)
-        self.supports_smart_programming(False) 
+        self.supports_smart_programming(True) 
         self.statemachine_timeout_add(2000, self.status_monitor)
         
         
@@ -199,6 +199,10 @@ class PhaseMatrixQuickSynTab(DeviceTab):
 
 
 class QuickSynWorker(Worker):
+    # Number of times a read that times out is retried before a query is considered
+    # to have failed:
+    query_retries = 2
+
     def init(self):
         global serial; import serial
         global h5py; import labscript_utils.h5_lock, h5py
@@ -208,58 +212,76 @@ class QuickSynWorker(Worker):
         port = self.address
         self.connection = serial.Serial(port, baudrate = baud_rate, timeout=0.1)
         self.connection.readlines()
+        # The frequency (in mHz) and output state last read back from the device:
+        self.smart_cache = {'freq': None, 'gate': None}
         
         #check to see if the reference is set to external. If not, make it so! (should we ask the user about this?)
-        self.connection.write(b'ROSC:SOUR?\r')
-        response = self.connection.readline().decode('utf8')
+        response = self.query(b'ROSC:SOUR?\r')
         if response == 'INT\n':
             #ref was set to internal, let's change it to ext
             self.connection.write(b'ROSC:SOUR EXT\r')
-    
-    def check_remote_values(self):
-        # Get the currently output values:
 
-        results = {'dds 0':{}}
-        line = ''
-        count = 0
+    def query(self, command):
+        """Send a query and return the response, read up to its newline terminator.
+        The device doesn't like being asked things too quickly, so rather than sleeping
+        between commands we wait for each response before sending the next command.
+        Reads that time out are retried up to query_retries times."""
+        self.connection.write(command)
+        line = b''
+        for _ in range(self.query_retries + 1):
+            line += self.connection.readline()
+            if line.endswith(b'\n'):
+                return line.decode('utf8')
+        msg = "Device didn't respond to %s, received %s"
+        raise Exception(msg % (command.decode('utf8').strip(), repr(line)))
 
+    def read_freq(self):
+        """Return the output frequency in integer mHz"""
+        return int(round(float(self.query(b'FREQ?\r'))))
 
-        self.connection.write(b'FREQ?\r')
-        line = self.connection.readline().decode('utf8')
+    def read_gate(self):
+        """Return 1 if the output is on, else 0"""
+        return 0 if self.query(b'OUTP:STAT?\r') == 'OFF\n' else 1
 
-        if line == '':
-            #try again
-            line = self.connection.readline().decode('utf8')
-            if line == '':
-                raise Exception("Device didn't say what its frequncy was :(")
-            
-        # Convert mHz to Hz:
-        results['dds 0']['freq'] = float(line)/1000
-
-        # wait a little while first, it doesn't like being asked things too quickly!
-        time.sleep(0.05)
-        self.connection.write(b'OUTP:STAT?\r')
-        line = self.connection.readline().decode('utf8')
-        if line == '':
-            raise Exception("Device didn't say what its status was :(")
-        time.sleep(0.05)    
-            
+    def program_freq(self, freq, smart=True):
+        """Set the output frequency in mHz, unless smart and the device is already at
+        that frequency. The frequency is read back, which both confirms the command
+        has been processed before the next one is sent, and updates the smart
+        cache. Rounded to integer mHz, the resolution of the device, to compare with
+        the cache."""
+        freq = int(round(freq))
+        if smart and self.smart_cache['freq'] == freq:
+            return
+        self.smart_cache['freq'] = None
+        self.connection.write(b'FREQ %i\r' % freq)
+        self.smart_cache['freq'] = self.read_freq()
 
-        #get the gate status
-        results['dds 0']['gate'] = 0 if line == 'OFF\n' else 1
+    def program_gate(self, gate, smart=True):
+        """Turn the output on (1) or off (0), unless smart and it is already in that
+        state. As with program_freq, the state is read back."""
+        if smart and self.smart_cache['gate'] == gate:
+            return
+        self.smart_cache['gate'] = None
+        self.connection.write(b'OUTP:STAT %i\r' % gate)
+        self.smart_cache['gate'] = self.read_gate()
+    
+    def check_remote_values(self):
+        # Get the currently output values:
+        freq = self.read_freq()
+        gate = self.read_gate()
+        self.smart_cache['freq'] = freq
+        self.smart_cache['gate'] = gate
 
+        results = {'dds 0':{}}
+        # Convert mHz to Hz:
+        results['dds 0']['freq'] = freq/1000
+        results['dds 0']['gate'] = gate
 
         return results
     
     def check_status(self):
         results = {}
-        line = ''
-        self.connection.write(b'STAT?\r')
-        line = self.connection.readline().decode('utf8')
-        if line == '':
-            raise Exception("Device didn't say what its status was :(")
-        time.sleep(0.05)    
-            
+        line = self.query(b'STAT?\r')
         
         #get the status and convert to binary, and take off the '0b' header:
         status = bin(int(line,16))[2:]
@@ -289,8 +311,7 @@ class QuickSynWorker(Worker):
         results['lock_recovery'] = int(status[-8])
         
         # now let's check it's temperature!
-        self.connection.write(b'DIAG:MEAS? 21\r')
-        results['temperature'] = float(self.connection.readline().decode('utf8'))
+        results['temperature'] = float(self.query(b'DIAG:MEAS? 21\r'))
         
         # check if the temperature is bad, if it is, raise an exception. Hopefully one day this will be sent to syslog,
         #at which point we'll add some extra magic to segregate into warning and critical temperatures.
@@ -304,17 +325,8 @@ class QuickSynWorker(Worker):
     def program_manual(self,front_panel_values):
         freq = front_panel_values['dds 0']['freq']
         #program in millihertz:
-        freq*=1e3
-        command = 'FREQ %i\r'%freq
-        self.connection.write(command.encode('utf8'))
-        
-        # add some sleep time here since the phasematrix gets grumpy
-        time.sleep(0.05)
-        
-        
-        gate = front_panel_values['dds 0']['gate']
-        command = 'OUTP:STAT %i\r'%gate
-        self.connection.write(command.encode('utf8'))
+        self.program_freq(freq*1e3)
+        self.program_gate(int(front_panel_values['dds 0']['gate']))
         
         return self.check_remote_values()
         
@@ -333,15 +345,16 @@ class QuickSynWorker(Worker):
         self.initial_values = initial_values
         # Store the final values to for use during transition_to_static:
         self.final_values = {}
+        if fresh:
+            self.smart_cache = {'freq': None, 'gate': None}
         with h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['/devices/'+device_name]
             # If there are values to set the unbuffered outputs to, set them now:
             if 'STATIC_DATA' in group:
                 data = group['STATIC_DATA'][:][0]
                 
-        self.connection.write(b'FREQ %i\r'%(data['freq0']))
-        time.sleep(0.05)
-        self.connection.write(b'OUTP:STAT 1')#%i'%(data['gate0']))
+        self.program_freq(int(data['freq0']))
+        self.program_gate(1)#data['gate0'])
         
         
         # Save these values into final_values so the GUI can
@@ -46,10 +46,15 @@ class PineBlaster(PseudoclockDevice):
     max_instructions = 15000
     
     @set_passed_properties(property_names = {
-        "connection_table_properties": ["usbport"]}
+        "connection_table_properties": ["usbport", "upload_window"]}
         )    
-    def __init__(self, name, trigger_device=None, trigger_connection=None, usbport='COM1'):
+    def __init__(self, name, trigger_device=None, trigger_connection=None, usbport='COM1', upload_window=8):
+        """upload_window is the number of instructions BLACS sends to the PineBlaster
+        before waiting for a response to the first of them. Set to 1 to wait for the
+        response to each instruction before sending the next."""
         PseudoclockDevice.__init__(self, name, trigger_device, trigger_connection)
+        if upload_window < 1:
+            raise LabscriptError('upload_window must be at least 1')
         self.BLACS_connection = usbport
         
         # create Pseudoclock and clockline
@@ -196,9 +201,12 @@ class PineblasterTab(DeviceTab):
         self.auto_place_widgets(("Flags", do_widgets))
         
         # Store the board number to be used
-        self.usb_port = str(self.settings['connection_table'].find_by_name(self.device_name).BLACS_connection)
+        connection_object = self.settings['connection_table'].find_by_name(self.device_name)
+        self.usb_port = str(connection_object.BLACS_connection)
+        self.upload_window = connection_object.properties.get('upload_window', 8)
         # Create and set the primary worker
-        self.create_worker("main_worker", PineblasterWorker, {'usbport':self.usb_port})
+        self.create_worker("main_worker", PineblasterWorker, {'usbport':self.usb_port,
+                                                             'upload_window':self.upload_window})
         self.primary_worker = "main_worker"
         
         # Set the capabilities of this device
@@ -276,17 +284,19 @@ class PineblasterWorker(Worker):
             device_properties = labscript_utils.properties.get(hdf5_file, device_name, 'device_properties')
             self.is_master_pseudoclock = device_properties['is_master_pseudoclock']
             
-        for i, instruction in enumerate(pulse_program):
-            if i == len(self.smart_cache):
-                # Pad the smart cache out to be as long as the program:
-                self.smart_cache.append(None)
-                
-            # Only program instructions that differ from what's in the smart cache:
-            if self.smart_cache[i] != instruction:
-                self.pineblaster.write(b'set %d %d %d\r\n'%(i, instruction['period'], instruction['reps']))
-                response = self.pineblaster.readline().decode()
-                assert response == 'ok\r\n', 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
-                self.smart_cache[i] = instruction
+        # Pad the smart cache out to be as long as the program:
+        self.smart_cache.extend([None] * (len(pulse_program) - len(self.smart_cache)))
+        # Only program instructions that differ from what's in the smart cache:
+        instructions = [(i, instruction) for i, instruction in enumerate(pulse_program)
+                        if self.smart_cache[i] != instruction]
+        remaining, response = self.program_instructions(instructions, self.upload_window)
+        if remaining:
+            # Something went wrong with the pipelined upload. Commands that were in
+            # flight may or may not have been programmed, so send them again, this time
+            # waiting for the response to each before sending the next:
+            self.logger.warning('PineBlaster said %s during pipelined upload, retrying in lockstep'%repr(response))
+            remaining, response = self.program_instructions(remaining, 1)
+            assert not remaining, 'PineBlaster said \'%s\', expected \'ok\''%repr(response)
                 
         if not self.is_master_pseudoclock:
             # Get ready for a hardware trigger:
@@ -296,6 +306,31 @@ class PineblasterWorker(Worker):
             
         return {'internal':0} # always finish on 0
             
+    def program_instructions(self, instructions, window):
+        """Send a set command for each (index, instruction) pair, with up to window
+        commands in flight at a time, and check their responses in order. Return a
+        list of the pairs not confirmed as programmed, which is empty on success, and
+        the unexpected response, if any"""
+        confirmed = 0
+        sent = 0
+        while confirmed < len(instructions):
+            # Keep the window full:
+            while sent < len(instructions) and sent - confirmed < window:
+                i, instruction = instructions[sent]
+                self.pineblaster.write(b'set %d %d %d\r\n'%(i, instruction['period'], instruction['reps']))
+                sent += 1
+            response = self.pineblaster.readline().decode()
+            if response != 'ok\r\n':
+                # Consume the responses to the commands still in flight so that they are
+                # not mistaken for responses to subsequent commands:
+                for _ in range(sent - confirmed - 1):
+                    self.pineblaster.readline()
+                return instructions[confirmed:], response
+            i, instruction = instructions[confirmed]
+            self.smart_cache[i] = instruction
+            confirmed += 1
+        return [], None
+            
     def start_run(self):
         # Start in software:
         self.pineblaster.write(b'start\r\n')
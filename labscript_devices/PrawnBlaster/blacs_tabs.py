@@ -19,6 +19,8 @@ from blacs.device_base_class import (
     MODE_TRANSITION_TO_MANUAL,
 )
 import labscript_utils.properties
+from labscript_devices.shot_prefetch import prefetch_queued_shots
+from . import polling
 
 from qtutils.qt import QtWidgets
 
@@ -110,6 +112,8 @@ class PrawnBlasterTab(DeviceTab):
             worker_initialisation_kwargs,
         )
         self.primary_worker = "main_worker"
+        # Read the tables of the next shot in the queue in advance:
+        prefetch_queued_shots(self)
 
     @define_state(
         MODE_MANUAL
@@ -131,7 +135,7 @@ class PrawnBlasterTab(DeviceTab):
 
         """
 
-        status, clock_status, waits_pending = yield (
+        status, clock_status, waits_pending, time_remaining = yield (
             self.queue_work(self.primary_worker, "check_status")
         )
 
@@ -149,6 +153,32 @@ class PrawnBlasterTab(DeviceTab):
             notify_queue.put("done")
             self.statemachine_timeout_remove(self.status_monitor)
             self.statemachine_timeout_add(2000, self.status_monitor)
+        elif notify_queue is not None:
+            self.schedule_status_monitor(time_remaining, notify_queue)
+
+    def schedule_status_monitor(self, time_remaining, notify_queue):
+        """Schedules the next status poll during a shot.
+
+        If the time remaining in the shot is known, sleeps until
+        :py:data:`.polling.poll_lead_time` before the expected end. Otherwise
+        polls at a fine rate, at the intervals given by
+        :py:func:`.polling.poll_intervals`.
+
+        Args:
+            time_remaining (float): Expected time in seconds until the end of the
+                shot, or `None` if unknown.
+            notify_queue (:class:`~queue.Queue`): Queue to notify when
+                the experiment is done.
+        """
+        if time_remaining is not None and time_remaining > polling.poll_lead_time:
+            interval = time_remaining - polling.poll_lead_time
+            self.poll_intervals = polling.poll_intervals()
+        else:
+            interval = next(self.poll_intervals)
+        self.statemachine_timeout_remove(self.status_monitor)
+        self.statemachine_timeout_add(
+            max(1, round(1000 * interval)), self.status_monitor, notify_queue
+        )
 
     @define_state(MODE_BUFFERED, True)
     def start_run(self, notify_queue):
@@ -157,4 +187,11 @@ class PrawnBlasterTab(DeviceTab):
         self.statemachine_timeout_remove(self.status_monitor)
         yield (self.queue_work(self.primary_worker, "start_run"))
         self.status_monitor()
-        self.statemachine_timeout_add(100, self.status_monitor, notify_queue)
+        # Poll once promptly to get the expected end time of the shot, subsequent polls
+        # are scheduled by schedule_status_monitor():
+        self.poll_intervals = polling.poll_intervals()
+        self.statemachine_timeout_add(
+            max(1, round(1000 * next(self.poll_intervals))),
+            self.status_monitor,
+            notify_queue,
+        )
@@ -18,6 +18,8 @@ from blacs.tab_base_classes import Worker
 from labscript import LabscriptError
 from labscript_utils.connections import _ensure_str
 import labscript_utils.properties as properties
+from labscript_devices.shot_prefetch import ShotFilePrefetcher
+from .polling import poll_intervals
 
 
 class PrawnBlasterWorker(Worker):
@@ -27,6 +29,10 @@ class PrawnBlasterWorker(Worker):
     with the hardware.
     """
 
+    range_merge_gap = 8
+    """Changed ranges of instructions separated by this many unchanged instructions
+    or fewer are uploaded as one range by smart programming."""
+
     def init(self):
         """Initialises the hardware communication.
 
@@ -44,6 +50,7 @@ class PrawnBlasterWorker(Worker):
         global zprocess; import zprocess
         self.smart_cache = {}
         self.cached_pll_params = {}
+        self.prefetcher = ShotFilePrefetcher(self.device_name, self.read_shot_tables)
         # fmt: on
 
         self.all_waits_finished = zprocess.Event("all_waits_finished", type="post")
@@ -57,6 +64,8 @@ class PrawnBlasterWorker(Worker):
         self.wait_timeout = None
         self.h5_file = None
         self.started = False
+        self.stop_time = None
+        self.run_start_time = None
         self.min_version = (1, 1, 0)
         
         self.conn = serial.Serial(self.com_port, 115200, timeout=1)
@@ -169,7 +178,7 @@ class PrawnBlasterWorker(Worker):
         accumulated waits during a shot.
 
         Returns:
-            (int, int, bool): Tuple containing:
+            (int, int, bool, float): Tuple containing:
 
             - **run_status** (int): Possible values are: 
 
@@ -188,6 +197,11 @@ class PrawnBlasterWorker(Worker):
 
             - **waits_pending** (bool): Indicates if all expected waits have
               not been read out yet.
+
+            - **time_remaining** (float): Estimated time in seconds until the
+              end of the shot, from its stop time and the lengths of its waits,
+              or `None` if this is not known, for example because waits are
+              pending or the shot was started by a hardware trigger.
         """
 
         if (
@@ -257,8 +271,22 @@ class PrawnBlasterWorker(Worker):
             else:
                 waits_pending = True
 
+        # Estimate how long until the shot ends, once all waits have been measured:
+        time_remaining = None
+        if (
+            self.started
+            and self.run_start_time is not None
+            and self.stop_time is not None
+            and not waits_pending
+        ):
+            total_wait_time = 0
+            if self.measured_waits is not None:
+                total_wait_time = self.measured_waits.sum()
+            time_elapsed = time.monotonic() - self.run_start_time
+            time_remaining = self.stop_time + total_wait_time - time_elapsed
+
         run_status, clock_status = self.read_status()
-        return run_status, clock_status, waits_pending
+        return run_status, clock_status, waits_pending, time_remaining
 
     def read_status(self):
         """Reads the status of the PrawnBlaster.
@@ -304,6 +332,88 @@ class PrawnBlasterWorker(Worker):
 
         return values
 
+    def read_shot_tables(self, hdf5_file, use_cache=True):
+        """Reads the pulse programs, device properties and wait table from a shot.
+
+        Called by :py:attr:`prefetcher`, possibly in a background thread, so must
+        not communicate with the hardware or modify the worker's state.
+
+        Args:
+            hdf5_file (:obj:`h5py.File`): Open shot file.
+            use_cache (bool, optional): If `True`, the pulse programs are not read
+                if the shot's `table_hash` matches that of the programs in the
+                :py:attr:`smart_cache`.
+
+        Returns:
+            dict: Dictionary with keys `pulse_programs`, `program_arrays`,
+            `device_properties`, `wait_table`, `table_hash` and `cached`. The
+            wait table is `None` if this device is not monitoring waits in this
+            shot, and the pulse programs and program arrays are `None` if
+            `cached` is `True`.
+        """
+        group = hdf5_file[f"devices/{self.device_name}"]
+        device_properties = labscript_utils.properties.get(
+            hdf5_file, self.device_name, "device_properties"
+        )
+        table_hash = device_properties.get("table_hash", None)
+        cached = (
+            use_cache
+            and table_hash is not None
+            and table_hash == self.smart_cache.get("table_hash", None)
+        )
+        if cached:
+            pulse_programs = None
+            program_arrays = None
+        else:
+            pulse_programs = [
+                group[f"PULSE_PROGRAM_{i}"][:] for i in range(self.num_pseudoclocks)
+            ]
+            # The pulse programs in the interleaved little-endian layout used by
+            # `setb`:
+            program_arrays = [
+                np.ascontiguousarray(
+                    np.array(
+                        [pulse_program["half_period"], pulse_program["reps"]],
+                        dtype="<u4",
+                    ).T
+                )
+                for pulse_program in pulse_programs
+            ]
+
+        dataset = hdf5_file["waits"]
+        acquisition_device = dataset.attrs["wait_monitor_acquisition_device"]
+        timeout_device = dataset.attrs["wait_monitor_timeout_device"]
+        internal_wait_monitor = f"{self.device_name}_internal_wait_monitor_outputs"
+        if (
+            len(dataset) > 0
+            and acquisition_device == internal_wait_monitor
+            and timeout_device == internal_wait_monitor
+        ):
+            wait_table = dataset[:]
+        else:
+            wait_table = None
+
+        return {
+            "pulse_programs": pulse_programs,
+            "program_arrays": program_arrays,
+            "device_properties": device_properties,
+            "wait_table": wait_table,
+            "table_hash": table_hash,
+            "cached": cached,
+        }
+
+    def prefetch_shot(self, h5file):
+        """Reads the tables for a shot in a background thread.
+
+        Called by the tab for the shot at the front of the queue. Optional. Once
+        prefetched, :py:meth:`transition_to_buffered` for that shot only needs to
+        communicate with the hardware.
+
+        Args:
+            h5file (str): path to shot file that is to be run next
+        """
+        self.prefetcher.prefetch(h5file)
+
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         """Configures the PrawnBlaster for buffered execution.
 
@@ -328,37 +438,33 @@ class PrawnBlasterWorker(Worker):
         #                        betwen now and when we actually send the start signal
         # fmt: on
 
-        # Get data from HDF5 file
-        pulse_programs = []
+        # Get data from HDF5 file, prefetched if prefetch_shot() was called for it:
         with h5py.File(h5file, "r") as hdf5_file:
-            group = hdf5_file[f"devices/{device_name}"]
-            for i in range(self.num_pseudoclocks):
-                pulse_programs.append(group[f"PULSE_PROGRAM_{i}"][:])
-                self.smart_cache.setdefault(i, [])
-            self.device_properties = labscript_utils.properties.get(
-                hdf5_file, device_name, "device_properties"
-            )
-            self.is_master_pseudoclock = self.device_properties["is_master_pseudoclock"]
-
-            # waits
-            dataset = hdf5_file["waits"]
-            acquisition_device = dataset.attrs["wait_monitor_acquisition_device"]
-            timeout_device = dataset.attrs["wait_monitor_timeout_device"]
-            if (
-                len(dataset) > 0
-                and acquisition_device
-                == "%s_internal_wait_monitor_outputs" % device_name
-                and timeout_device == "%s_internal_wait_monitor_outputs" % device_name
-            ):
-                self.wait_table = dataset[:]
-                self.measured_waits = numpy.zeros(len(self.wait_table))
-                self.wait_timeout = numpy.zeros(len(self.wait_table), dtype=bool)
-            else:
-                self.wait_table = (
-                    None  # This device doesn't need to worry about looking at waits
-                )
-                self.measured_waits = None
-                self.wait_timeout = None
+            shot_tables = self.prefetcher.get(hdf5_file)
+            if shot_tables["cached"] and shot_tables[
+                "table_hash"
+            ] != self.smart_cache.get("table_hash", None):
+                # The smart cache has changed since the file was prefetched:
+                shot_tables = self.read_shot_tables(hdf5_file, use_cache=False)
+        pulse_programs = shot_tables["pulse_programs"]
+        program_arrays = shot_tables["program_arrays"]
+        for i in range(self.num_pseudoclocks):
+            self.smart_cache.setdefault(i, [])
+        self.device_properties = shot_tables["device_properties"]
+        self.is_master_pseudoclock = self.device_properties["is_master_pseudoclock"]
+        # Only present for the master pseudoclock:
+        self.stop_time = self.device_properties.get("stop_time", None)
+        self.run_start_time = None
+
+        # waits
+        self.wait_table = shot_tables["wait_table"]
+        if self.wait_table is not None:
+            self.measured_waits = numpy.zeros(len(self.wait_table))
+            self.wait_timeout = numpy.zeros(len(self.wait_table), dtype=bool)
+        else:
+            # This device doesn't need to worry about looking at waits
+            self.measured_waits = None
+            self.wait_timeout = None
 
         # Configure clock from device properties
         clock_mode = 0
@@ -376,68 +482,38 @@ class PrawnBlasterWorker(Worker):
         # Now set the clock details
         response = self.send_command_ok(f"setclock {clock_mode} {clock_frequency}")
 
-        # Program instructions
+        # Program instructions, unless they are identical to those already programmed:
+        if shot_tables["cached"]:
+            pulse_programs = []
+        else:
+            # Invalidate the hash until the new programs are all in the smart cache:
+            self.smart_cache["table_hash"] = None
         for pseudoclock, pulse_program in enumerate(pulse_programs):
-            total_inst = len(pulse_program)
-            # check if it is more efficient to fully refresh
-            if not fresh and self.smart_cache[pseudoclock] is not None:
-                # get more convenient handles to smart cache arrays
-                curr_inst = self.smart_cache[pseudoclock]
-
-                # if arrays aren't of same shape, only compare up to smaller array size
-                n_curr = len(curr_inst)
-                n_new = len(pulse_program)
-                if n_curr > n_new:
-                    # technically don't need to reprogram current elements beyond end of new elements
-                    new_inst = np.sum(curr_inst[:n_new] != pulse_program)
-                elif n_curr < n_new:
-                    n_diff = n_new - n_curr
-                    val_diffs = np.sum(curr_inst != pulse_program[:n_curr])
-                    new_inst = val_diffs + n_diff
-                else:
-                    new_inst = np.sum(curr_inst != pulse_program)
-
-                if new_inst / total_inst > 0.1:
-                    fresh = True
-
-            if (fresh or self.smart_cache[pseudoclock] is None):
-                print('binary programming')
-                self.conn.write(b"setb %d %d %d\r\n" % (pseudoclock, 0, len(pulse_program)))
-                response = self.conn.readline().decode()
-                assert (
-                    response == "ready\r\n"
-                ), f"PrawnBlaster said '{response}', expected 'ready'"
-                program_array = np.array([pulse_program['half_period'],
-                                          pulse_program['reps']], dtype='<u4').T
-                self.conn.write(program_array.tobytes())
-                response = self.conn.readline().decode()
-                assert (
-                    response == "ok\r\n"
-                ), f"PrawnBlaster said '{response}', expected 'ok'"
-                self.smart_cache[pseudoclock] = pulse_program
+            cached_program = self.smart_cache[pseudoclock]
+            if fresh or not isinstance(cached_program, np.ndarray):
+                ranges = [(0, len(pulse_program))]
             else:
-                print('incremental programming')
-                for i, instruction in enumerate(pulse_program):
-                    if i == len(self.smart_cache[pseudoclock]):
-                        # Pad the smart cache out to be as long as the program:
-                        self.smart_cache[pseudoclock].append(None)
-
-                    # Only program instructions that differ from what's in the smart cache:
-                    if self.smart_cache[pseudoclock][i] != instruction:
-                        self.conn.write(
-                            b"set %d %d %d %d\r\n"
-                            % (
-                                pseudoclock,
-                                i,
-                                instruction["half_period"],
-                                instruction["reps"],
-                            )
-                        )
-                        response = self.conn.readline().decode()
-                        assert (
-                            response == "ok\r\n"
-                        ), f"PrawnBlaster said '{response}', expected 'ok'"
-                        self.smart_cache[pseudoclock][i] = instruction
+                ranges = self._changed_ranges(cached_program, pulse_program)
+            if not ranges:
+                continue
+            self.logger.debug(
+                f"programming {len(ranges)} range(s) of pseudoclock {pseudoclock}"
+            )
+            try:
+                self._upload_ranges(pseudoclock, program_arrays[pseudoclock], ranges)
+            except LabscriptError:
+                # Invalidate the cache, since we do not know what made it to the device
+                # before the failure, and retry one range at a time, waiting for each
+                # response before continuing:
+                self.smart_cache[pseudoclock] = None
+                self.logger.exception("Pipelined upload failed, retrying in lockstep")
+                self._read_full_buffer()
+                ranges = [(0, len(pulse_program))]
+                self._upload_ranges(
+                    pseudoclock, program_arrays[pseudoclock], ranges, pipelined=False
+                )
+            self.smart_cache[pseudoclock] = pulse_program
+        self.smart_cache["table_hash"] = shot_tables["table_hash"]
 
         if not self.is_master_pseudoclock:
             # Start the Prawnblaster and have it wait for a hardware trigger
@@ -449,6 +525,72 @@ class PrawnBlasterWorker(Worker):
             final[f"GPIO {pin:02d}"] = 0
         return final
 
+    def _changed_ranges(self, cached_program, pulse_program):
+        """Finds the ranges of instructions that differ from the smart cache.
+
+        Instructions beyond the end of the new program are ignored, since the
+        new program ends in a stop instruction. Ranges separated by no more than
+        :py:attr:`range_merge_gap` unchanged instructions are merged, since
+        re-sending those few instructions costs less than an extra command.
+
+        Args:
+            cached_program (numpy.ndarray): Pulse program currently on the device.
+            pulse_program (numpy.ndarray): Pulse program to be programmed.
+
+        Returns:
+            list: List of `(start, stop)` tuples of instruction indices to upload.
+        """
+        n_common = min(len(cached_program), len(pulse_program))
+        changed = np.ones(len(pulse_program), dtype=bool)
+        changed[:n_common] = cached_program[:n_common] != pulse_program[:n_common]
+        indices = np.flatnonzero(changed)
+        if not len(indices):
+            return []
+        # Split wherever the gap between consecutive changed instructions is too large:
+        splits = np.flatnonzero(np.diff(indices) > self.range_merge_gap + 1)
+        starts = np.concatenate([indices[:1], indices[splits + 1]])
+        stops = np.concatenate([indices[splits], indices[-1:]]) + 1
+        return [(int(start), int(stop)) for start, stop in zip(starts, stops)]
+
+    def _upload_ranges(self, pseudoclock, program_array, ranges, pipelined=True):
+        """Uploads ranges of a pulse program with one binary `setb` command each.
+
+        Args:
+            pseudoclock (int): Pseudoclock to program.
+            program_array (numpy.ndarray): Pulse program packed as `setb` expects it,
+                see :py:meth:`read_shot_tables`.
+            ranges (list): `(start, stop)` tuples of instruction indices to upload.
+            pipelined (bool, optional): If `True`, the command for each range is
+                sent before reading the `ok` for the previous one, so that each range
+                costs one round trip of the serial connection rather than two. If
+                `False`, each `ok` is read before sending the next command.
+
+        Raises:
+            LabscriptError: If the PrawnBlaster does not respond as expected.
+        """
+
+        def check_response(expected):
+            response = self.conn.readline().decode()
+            if response != expected:
+                raise LabscriptError(
+                    f"PrawnBlaster said '{response}', expected '{expected.strip()}'"
+                )
+
+        for i, (start, stop) in enumerate(ranges):
+            self.conn.write(b"setb %d %d %d\r\n" % (pseudoclock, start, stop - start))
+            if pipelined and i > 0:
+                # The ok for the previous range. Reading it only after sending this
+                # command saves a round trip, as the PrawnBlaster reads it in order:
+                check_response("ok\r\n")
+            # The PrawnBlaster only reads binary data once it has said it is ready, any
+            # sent sooner would be read as commands:
+            check_response("ready\r\n")
+            self.conn.write(program_array[start:stop].tobytes())
+            if not pipelined:
+                check_response("ok\r\n")
+        if pipelined and ranges:
+            check_response("ok\r\n")
+
     def start_run(self):
         """When used as the primary pseudoclock, starts execution
         in software time to engage the shot."""
@@ -456,6 +598,7 @@ class PrawnBlasterWorker(Worker):
         # Start in software:
         self.logger.info("sending start")
         self.send_command_ok("start")
+        self.run_start_time = time.monotonic()
 
         # set started = True
         self.started = True
@@ -520,8 +663,9 @@ class PrawnBlasterWorker(Worker):
         # in the BLACS tab status check before any transition to manual is called.
         # However, if it's not the master pseudoclock, we need to check here instead!
         if not self.is_master_pseudoclock:
-            # Wait until shot completes
-            while True:
+            # Wait until shot completes. It most likely already has, since the master
+            # pseudoclock has, so start polling quickly and back off if not:
+            for poll_interval in poll_intervals():
                 run_status, clock_status = self.read_status()
                 if run_status == 0:
                     break
@@ -529,13 +673,14 @@ class PrawnBlasterWorker(Worker):
                     raise RuntimeError(
                         f"Prawnblaster status returned run-status={run_status} during transition to manual"
                     )
-                time.sleep(0.01)
+                time.sleep(poll_interval)
 
         return True
 
     def shutdown(self):
         """Cleanly shuts down the connection to the PrawnBlaster hardware."""
 
+        self.prefetcher.discard()
         self.conn.close()
 
     def abort_buffered(self):
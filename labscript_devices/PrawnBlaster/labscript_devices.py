@@ -26,6 +26,8 @@ from labscript import (
 )
 import numpy as np
 
+from labscript_devices.shot_prefetch import table_hash
+
 
 class _PrawnBlasterPseudoclock(Pseudoclock):
     """Customized Clockline for use with the PrawnBlaster.
@@ -476,3 +478,12 @@ class PrawnBlaster(PseudoclockDevice):
             location="device_properties",
         )
         self.set_property("stop_time", self.stop_time, location="device_properties")
+        # So the BLACS worker can tell whether the pulse programs have changed since the
+        # previous shot without reading them:
+        self.set_property(
+            "table_hash",
+            table_hash(
+                group, [f"PULSE_PROGRAM_{i}" for i in range(len(self.pseudoclocks))]
+            ),
+            location="device_properties",
+        )
@@ -0,0 +1,43 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/PrawnBlaster/polling.py                        #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Timing of PrawnBlaster status polls, shared by the BLACS tab, which polls for the
+end of a shot when the PrawnBlaster is the master pseudoclock, and the worker, which
+does so itself otherwise."""
+
+poll_lead_time = 0.05
+"""How long in seconds before the expected end of a shot to start polling the
+PrawnBlaster's status at a fine rate."""
+
+min_poll_interval = 0.002
+"""Interval in seconds between status polls at the start of fine polling."""
+
+max_poll_interval = 0.1
+"""Interval in seconds that fine polling backs off to if the shot runs longer than
+expected, or while waits are pending."""
+
+poll_backoff = 1.5
+"""Factor by which the interval between fine status polls increases each poll."""
+
+
+def poll_intervals():
+    """Generates the intervals between fine status polls.
+
+    Yields:
+        float: Interval in seconds until the next poll, starting at
+        :py:data:`min_poll_interval` and increasing by a factor of
+        :py:data:`poll_backoff` each poll, up to :py:data:`max_poll_interval`.
+    """
+    interval = min_poll_interval
+    while True:
+        yield interval
+        interval = min(poll_backoff * interval, max_poll_interval)
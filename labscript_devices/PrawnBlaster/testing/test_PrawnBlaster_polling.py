@@ -0,0 +1,134 @@
+"""Tests of the timing of status polls for the end of a shot, against an emulated
+PrawnBlaster"""
+import itertools
+import logging
+import re
+import time
+
+import pytest
+
+pytest.importorskip('pty')
+serial = pytest.importorskip('serial')
+
+from labscript_devices.testing.serial_emulator import SerialEmulator
+from labscript_devices.PrawnBlaster import polling
+from labscript_devices.PrawnBlaster import blacs_workers
+from labscript_devices.PrawnBlaster.blacs_workers import PrawnBlasterWorker
+from labscript_devices.PrawnBlaster.blacs_tabs import PrawnBlasterTab
+
+SHOT_DURATION = 0.5
+
+
+class PrawnBlasterEmulator(SerialEmulator):
+    """Runs a shot of fixed duration when started, counting status polls"""
+
+    def __init__(self, **kwargs):
+        self.start_time = None
+        self.end_time = None
+        self.status_polls = 0
+        super().__init__(**kwargs)
+
+    def handle(self, line):
+        command = line.decode().strip()
+        if command == 'start':
+            self.start_time = time.monotonic()
+            self.end_time = self.start_time + SHOT_DURATION
+            self.write(b'ok\r\n')
+        elif command == 'status':
+            self.status_polls += 1
+            running = self.end_time is not None and time.monotonic() < self.end_time
+            self.write(b'run-status:%d clock-status:0\r\n' % (2 if running else 0))
+        else:
+            self.errors.append('unexpected command %r' % line)
+
+
+class Tab(PrawnBlasterTab):
+    """The tab, with the state machine replaced by a record of the timeouts added"""
+
+    def __init__(self):
+        self.timeouts = []
+
+    def statemachine_timeout_add(self, delay, statefunction, *args):
+        self.timeouts.append(delay)
+
+    def statemachine_timeout_remove(self, statefunction):
+        pass
+
+
+def make_worker(emulator, stop_time, monkeypatch):
+    # Imported by the worker's init method, which is not called:
+    monkeypatch.setattr(blacs_workers, 're', re, raising=False)
+    worker = PrawnBlasterWorker.__new__(PrawnBlasterWorker)
+    # Status responses are read until a timeout, so keep it short:
+    worker.conn = serial.Serial(emulator.port, timeout=0.005)
+    worker.logger = logging.getLogger('PrawnBlaster test')
+    worker.started = False
+    worker.wait_table = None
+    worker.measured_waits = None
+    worker.stop_time = stop_time
+    worker.run_start_time = None
+    return worker
+
+
+def test_poll_intervals():
+    intervals = list(itertools.islice(polling.poll_intervals(), 20))
+    assert intervals[0] == polling.min_poll_interval
+    assert intervals[-1] == polling.max_poll_interval
+    for previous, interval in zip(intervals, intervals[1:]):
+        assert interval == min(
+            polling.poll_backoff * previous, polling.max_poll_interval
+        )
+
+
+def test_schedule_status_monitor():
+    tab = Tab()
+    tab.poll_intervals = polling.poll_intervals()
+    # Known time remaining, sleep until shortly before the end:
+    tab.schedule_status_monitor(1.0, None)
+    assert tab.timeouts[-1] == round(1000 * (1.0 - polling.poll_lead_time))
+    # Then poll finely, backing off:
+    expected = itertools.islice(polling.poll_intervals(), 20)
+    for interval in expected:
+        tab.schedule_status_monitor(polling.poll_lead_time / 2, None)
+        assert tab.timeouts[-1] == max(1, round(1000 * interval))
+    # Unknown time remaining, keep polling at the maximum interval:
+    tab.schedule_status_monitor(None, None)
+    assert tab.timeouts[-1] == round(1000 * polling.max_poll_interval)
+    # Known again, the fine polls start from the minimum interval again:
+    tab.schedule_status_monitor(1.0, None)
+    tab.schedule_status_monitor(0, None)
+    assert tab.timeouts[-1] == max(1, round(1000 * polling.min_poll_interval))
+
+
+@pytest.mark.parametrize('stop_time', [SHOT_DURATION, None])
+def test_end_of_shot_detection(stop_time, monkeypatch):
+    """Poll the emulated PrawnBlaster as the tab would, and check how soon after the
+    end of the shot it is detected, and how many polls that takes. Without the stop
+    time, polling backs off to max_poll_interval throughout the shot."""
+    tab = Tab()
+    with PrawnBlasterEmulator() as emulator:
+        worker = make_worker(emulator, stop_time, monkeypatch)
+        worker.start_run()
+        tab.poll_intervals = polling.poll_intervals()
+        time.sleep(next(tab.poll_intervals))
+        while True:
+            status, _, waits_pending, time_remaining = worker.check_status()
+            if status == 0 and not waits_pending:
+                detected = time.monotonic()
+                break
+            tab.schedule_status_monitor(time_remaining, None)
+            time.sleep(tab.timeouts[-1] / 1000)
+        worker.conn.close()
+    assert not emulator.errors
+    latency = detected - emulator.end_time
+    print(
+        'stop_time=%s: %d polls, detected %.1f ms after the end of the shot'
+        % (stop_time, emulator.status_polls, 1000 * latency)
+    )
+    if stop_time is not None:
+        # One poll to get the time remaining, and then the fine polls, which back
+        # off to no more than the lead time:
+        assert emulator.status_polls < 2 + polling.poll_lead_time / 0.005 + 5
+        assert latency < polling.poll_lead_time + 0.05
+    else:
+        assert latency < polling.max_poll_interval + 0.1
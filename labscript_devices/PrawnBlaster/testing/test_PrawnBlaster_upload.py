@@ -0,0 +1,66 @@
+"""Tests of uploading pulse programs to an emulated PrawnBlaster with `setb`"""
+import logging
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pty')
+serial = pytest.importorskip('serial')
+
+from labscript_devices.testing.serial_emulator import SerialEmulator
+from labscript_devices.PrawnBlaster.blacs_workers import PrawnBlasterWorker
+
+MAX_INSTRUCTIONS = 1000
+
+
+class PrawnBlasterEmulator(SerialEmulator):
+    """Responds to `setb` as the firmware does, recording an error if any binary data
+    arrives before it has said it is ready for it."""
+
+    def __init__(self, **kwargs):
+        self.memory = np.zeros((4, MAX_INSTRUCTIONS, 2), dtype='<u4')
+        super().__init__(**kwargs)
+
+    def handle(self, line):
+        command, *args = line.decode().split()
+        assert command == 'setb', line
+        pseudoclock, start, count = map(int, args)
+        if self.data_waiting():
+            self.errors.append('binary data sent before ready')
+        self.write(b'ready\r\n')
+        data = self.read(8 * count)
+        self.memory[pseudoclock, start : start + count] = np.frombuffer(
+            data, dtype='<u4'
+        ).reshape(count, 2)
+        self.write(b'ok\r\n')
+
+
+def make_worker(emulator):
+    worker = PrawnBlasterWorker.__new__(PrawnBlasterWorker)
+    worker.conn = serial.Serial(emulator.port, timeout=5)
+    worker.logger = logging.getLogger('PrawnBlaster test')
+    return worker
+
+
+def random_program(num_instructions, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2**32, (num_instructions, 2), dtype=np.uint32).astype('<u4')
+
+
+@pytest.mark.parametrize('pipelined', [True, False])
+def test_upload_ranges(pipelined):
+    program_array = random_program(MAX_INSTRUCTIONS)
+    ranges = [(0, 10), (50, 51), (100, 400), (999, 1000)]
+    # Latency, so that any data sent before 'ready' is waiting once the emulator
+    # handles the setb command:
+    with PrawnBlasterEmulator(latency=0.02) as emulator:
+        worker = make_worker(emulator)
+        worker._upload_ranges(2, program_array, ranges, pipelined=pipelined)
+        worker.conn.close()
+    assert not emulator.errors
+    assert len(emulator.lines) == len(ranges)
+    expected = np.zeros_like(program_array)
+    for start, stop in ranges:
+        expected[start:stop] = program_array[start:stop]
+    np.testing.assert_array_equal(emulator.memory[2], expected)
+    assert not emulator.memory[[0, 1, 3]].any()
@@ -185,7 +185,8 @@ class PrawnDOWorker(Worker):
     def init(self):
         self.intf = PrawnDOInterface(self.com_port, self.pico_board)        
 
-        self.smart_cache = {'do_table':None, 'reps':None}
+        self.smart_cache = {'pulse_program':None, 'table_hash':None,
+                            'final_state':None}
 
     def _dict_to_int(self, d):
         """Converts dictionary of outputs to an integer mask.
@@ -269,7 +270,8 @@ class PrawnDOWorker(Worker):
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
 
         if fresh:
-            self.smart_cache = {'pulse_program':None}
+            self.smart_cache = {'pulse_program':None, 'table_hash':None,
+                                'final_state':None}
 
         with h5py.File(h5file, 'r') as hdf5_file:
             group = hdf5_file['devices'][device_name]
@@ -278,13 +280,26 @@ class PrawnDOWorker(Worker):
                 return
             self.device_properties = labscript_utils.properties.get(
                 hdf5_file, device_name, "device_properties")
-            pulse_program = group['pulse_program'][()]
+            table_hash = self.device_properties.get('table_hash', None)
+            # skip reading and comparing the program if it is already on the device
+            cached = (table_hash is not None
+                      and table_hash == self.smart_cache['table_hash'])
+            if not cached:
+                pulse_program = group['pulse_program'][()]
 
         # configure clock from device properties
         ext = self.device_properties['external_clock']
         freq = self.device_properties['clock_frequency']
         self.intf.send_command_ok(f"clk {ext:d} {freq:.0f}")
 
+        if cached:
+            # start program, waiting for beginning trigger from parent
+            self.intf.send_command_ok('run')
+            return self._int_to_dict(self.smart_cache['final_state'])
+
+        # invalidate the hash until the new program is on the device
+        self.smart_cache['table_hash'] = None
+
         # check if it is more efficient to fully refresh
         if not fresh and self.smart_cache['pulse_program'] is not None:
 
@@ -328,6 +343,11 @@ class PrawnDOWorker(Worker):
                     self.intf.send_command_ok(f'set {i:x} {instr[0]:x} {instr[1]:x}')
                     self.smart_cache['pulse_program'][i] = instr
 
+        # the cached program may extend beyond the end of this one,
+        # so store the final state separately
+        self.smart_cache['final_state'] = pulse_program[-1][0]
+        self.smart_cache['table_hash'] = table_hash
+
         final_values = self._int_to_dict(pulse_program[-1][0])
 
         # start program, waiting for beginning trigger from parent
@@ -23,6 +23,8 @@ from labscript import (
 )
 import numpy as np
 
+from labscript_devices.shot_prefetch import table_hash
+
 class _PrawnDOPseudoclock(Pseudoclock):
     """Dummy pseudoclock for use with PrawnDO.
     
@@ -313,6 +315,9 @@ class PrawnDO(PseudoclockDevice):
         pulse_program['bit_sets'] = bit_sets
         pulse_program['reps'] = reps
         group.create_dataset('pulse_program', data=pulse_program)
+        # lets the worker skip reading the program if it is already on the device
+        self.set_property('table_hash', table_hash(group, ['pulse_program']),
+                          location='device_properties')
 
 
 class _PrawnDOIntermediateDevice(IntermediateDevice):
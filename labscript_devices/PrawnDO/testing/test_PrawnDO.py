@@ -0,0 +1,153 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/PrawnDO/testing/test_PrawnDO.py                #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+import logging
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+from labscript_utils.properties import set_device_properties
+
+pytest.importorskip('pty')
+pytest.importorskip('serial')
+
+from labscript_devices.testing.serial_emulator import SerialEmulator
+from labscript_devices.PrawnDO.blacs_workers import PrawnDOWorker
+from labscript_devices.shot_prefetch import table_hash
+
+DEVICE = 'prawn_do'
+DTYPE = np.dtype([('bit_sets', '<u2'), ('reps', '<u4')])
+
+
+class PrawnDOEmulator(SerialEmulator):
+    """Responds to commands as the PrawnDO firmware does, recording the program and
+    the commands received"""
+
+    def __init__(self, **kwargs):
+        self.program = np.zeros(0, dtype=DTYPE)
+        self.commands = []
+        super().__init__(**kwargs)
+
+    def handle(self, line):
+        command, *args = line.decode().split()
+        self.commands.append(command)
+        if command == 'ver':
+            self.write(b'Version: 1.3.0\r\n')
+        elif command == 'brd':
+            self.write(b'board: pico1\r\n')
+        elif command == 'sts':
+            self.write(b'run-status:0 clock-status:0\r\n')
+        elif command == 'adm':
+            start, count = (int(arg, 16) for arg in args)
+            self.write(b'ready\r\n')
+            data = self.read(DTYPE.itemsize * count)
+            self.program = np.frombuffer(data, dtype=DTYPE).copy()
+            self.write(b'ok\r\n')
+        elif command == 'set':
+            address, bit_sets, reps = (int(arg, 16) for arg in args)
+            self.program[address] = (bit_sets, reps)
+            self.write(b'ok\r\n')
+        else:
+            self.write(b'ok\r\n')
+
+
+@pytest.fixture
+def dataset_reads(monkeypatch):
+    """The names of the datasets read from shot files"""
+    reads = []
+    getitem = h5py.Dataset.__getitem__
+
+    def __getitem__(self, *args, **kwargs):
+        reads.append(self.name)
+        return getitem(self, *args, **kwargs)
+
+    monkeypatch.setattr(h5py.Dataset, '__getitem__', __getitem__)
+    return reads
+
+
+def random_program(length, seed):
+    rng = np.random.default_rng(seed)
+    pulse_program = np.zeros(length, dtype=DTYPE)
+    pulse_program['bit_sets'] = rng.integers(0, 2**16, length)
+    pulse_program['reps'] = rng.integers(1, 2**32, length)
+    return pulse_program
+
+
+def make_shot(path, pulse_program):
+    """Write a shot file with the given program and, as PrawnDO.generate_code does,
+    its hash"""
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group(DEVICE)
+        group.create_dataset('pulse_program', data=pulse_program)
+        properties = {
+            'external_clock': False,
+            'clock_frequency': 100e6,
+            'table_hash': table_hash(group, ['pulse_program']),
+        }
+        set_device_properties(f, DEVICE, properties)
+    return str(path)
+
+
+def test_unchanged_program_is_not_read_or_programmed(tmp_path, dataset_reads):
+    pulse_program = random_program(20, seed=0)
+    changed_program = pulse_program.copy()
+    changed_program[7] = random_program(1, seed=1)[0]
+    shot = make_shot(tmp_path / 'shot.h5', pulse_program)
+    same = make_shot(tmp_path / 'same.h5', pulse_program)
+    changed = make_shot(tmp_path / 'changed.h5', changed_program)
+    program_path = '/devices/%s/pulse_program' % DEVICE
+
+    def run(h5file, fresh=False):
+        num_commands = len(emulator.commands)
+        del dataset_reads[:]
+        final_values = worker.transition_to_buffered(DEVICE, h5file, {}, fresh)
+        commands = emulator.commands[num_commands:]
+        return final_values, commands, program_path in dataset_reads
+
+    with PrawnDOEmulator() as emulator:
+        worker = PrawnDOWorker.__new__(PrawnDOWorker)
+        worker.com_port = emulator.port
+        worker.pico_board = 'pico1'
+        worker.logger = logging.getLogger('PrawnDO test')
+        worker.init()
+
+        final_values, commands, program_read = run(shot, fresh=True)
+        assert program_read
+        assert commands == ['clk', 'cls', 'adm', 'run']
+        np.testing.assert_array_equal(emulator.program, pulse_program)
+
+        # A different shot file with the same program is neither read nor programmed:
+        cached_final_values, commands, program_read = run(same)
+        assert not program_read
+        assert commands == ['clk', 'run']
+        assert cached_final_values == final_values
+
+        # A changed program is read, and its changed line programmed:
+        _, commands, program_read = run(changed)
+        assert program_read
+        assert commands == ['clk', 'set', 'run']
+        np.testing.assert_array_equal(emulator.program, changed_program)
+
+        # Including when changing back:
+        _, commands, program_read = run(same)
+        assert program_read
+        assert commands == ['clk', 'set', 'run']
+        np.testing.assert_array_equal(emulator.program, pulse_program)
+
+        # And everything is read and programmed again when fresh:
+        _, commands, program_read = run(same, fresh=True)
+        assert program_read
+        assert commands == ['clk', 'cls', 'adm', 'run']
+        np.testing.assert_array_equal(emulator.program, pulse_program)
+        worker.shutdown()
+    assert not emulator.errors
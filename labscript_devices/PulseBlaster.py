@@ -12,6 +12,7 @@
 #####################################################################
 
 from labscript_devices import BLACS_tab, runviewer_parser
+from labscript_devices.shot_prefetch import table_hash
 from labscript_utils import dedent
 
 from labscript import (
@@ -639,6 +640,13 @@ class PulseBlaster(PseudoclockDevice):
         pb_inst = self.convert_to_pb_inst(dig_outputs, dds_outputs, freqs, amps, phases)
         self._check_wait_monitor_ok()
         self.write_pb_inst_to_h5(pb_inst, hdf5_file)
+        # A hash of the tables, so that BLACS can tell without reading them whether
+        # they are the same as in the previous shot:
+        group = hdf5_file['/devices/' + self.name]
+        tables = ['DDS%d/%s'%(i, regs) for i in range(2)
+                  for regs in ['FREQ_REGS', 'AMP_REGS', 'PHASE_REGS']]
+        tables.append('PULSE_PROGRAM')
+        self.set_property('table_hash', table_hash(group, tables), location='device_properties')
         
 
 
@@ -665,6 +673,7 @@ from blacs.tab_base_classes import Worker, define_state
 from blacs.tab_base_classes import MODE_MANUAL, MODE_TRANSITION_TO_BUFFERED, MODE_TRANSITION_TO_MANUAL, MODE_BUFFERED  
 
 from blacs.device_base_class import DeviceTab
+from labscript_devices.shot_prefetch import prefetch_queued_shots
 
 from qtutils import UiLoader
 import qtutils.icons
@@ -732,6 +741,8 @@ class PulseBlasterTab(DeviceTab):
         self.create_worker("main_worker",PulseblasterWorker,{'board_number':self.board_number,
                                                              'programming_scheme': self.programming_scheme})
         self.primary_worker = "main_worker"
+        # Read the tables of the next shot in the queue in advance:
+        prefetch_queued_shots(self)
         
         # Set the capabilities of this device
         self.supports_smart_programming(True) 
@@ -865,13 +876,16 @@ class PulseblasterWorker(Worker):
         self.smart_cache = {'amps0':None,'freqs0':None,'phases0':None,
                             'amps1':None,'freqs1':None,'phases1':None,
                             'pulse_program':None,'ready_to_go':False,
-                            'initial_values':None}
+                            'initial_values':None,'table_hash':None}
                             
         # An event for checking when all waits (if any) have completed, so that
         # we can tell the difference between a wait and the end of an experiment.
         # The wait monitor device is expected to post such events, which we'll wait on:
         self.all_waits_finished = zprocess.Event('all_waits_finished')
         self.waits_pending = False
+        
+        from labscript_devices.shot_prefetch import ShotFilePrefetcher
+        self.prefetcher = ShotFilePrefetcher(self.device_name, self.read_shot_tables)
     
         pb_select_board(self.board_number)
         pb_init()
@@ -947,56 +961,119 @@ class PulseblasterWorker(Worker):
             import time
             self.time_based_shot_end_time = time.time() + self.time_based_shot_duration
     
+    def read_shot_tables(self, hdf5_file, use_cache=True):
+        """Read everything transition_to_buffered needs from an open shot file. Called
+        by self.prefetcher, possibly in a background thread, so this must not call
+        into spinapi or modify the state of the worker. If use_cache is True and the
+        shot's table hash matches that of the tables in the smart cache, the tables
+        are not read, and tables['cached'] is True."""
+        group = hdf5_file['devices/%s'%self.device_name]
+        tables = {}
+        tables['table_hash'] = group.attrs.get('table_hash', None)
+        tables['cached'] = (use_cache and tables['table_hash'] is not None
+                            and tables['table_hash'] == self.smart_cache['table_hash'])
+        
+        # Is this shot using the fixed-duration workaround instead of checking the PulseBlaster's status?
+        tables['time_based_stop_workaround'] = group.attrs.get('time_based_stop_workaround', False)
+        if tables['time_based_stop_workaround']:
+            tables['time_based_shot_duration'] = (group.attrs['stop_time']
+                                                  + hdf5_file['waits'][:]['timeout'].sum()
+                                                  + group.attrs['time_based_stop_workaround_extra_time'])
+        else:
+            tables['time_based_shot_duration'] = None
+        
+        if not tables['cached']:
+            for i in range(2):
+                tables['amps%d'%i] = group['DDS%d/AMP_REGS'%i][:]
+                tables['freqs%d'%i] = group['DDS%d/FREQ_REGS'%i][:]
+                tables['phases%d'%i] = group['DDS%d/PHASE_REGS'%i][:]
+                
+            tables['pulse_program'] = group['PULSE_PROGRAM'][2:]
+        
+        tables['wait_monitor_exists'] = bool(hdf5_file['waits'].attrs['wait_monitor_acquisition_device'])
+        tables['waits_in_use'] = bool(len(hdf5_file['waits']))
+        return tables
+        
+    def prefetch_shot(self, h5file):
+        """Read the tables for the given shot file in a background thread, so that
+        transition_to_buffered need only program the hardware. Called by the tab for
+        the shot at the front of the queue. Optional, if not called the tables are read
+        in transition_to_buffered."""
+        self.prefetcher.prefetch(h5file)
+        
     def transition_to_buffered(self,device_name,h5file,initial_values,fresh):
         self.h5file = h5file
         if self.programming_scheme == 'pb_stop_programming/STOP':
             # Need to ensure device is stopped before programming - or we wont know what line it's on.
             pb_stop()
         with h5py.File(h5file,'r') as hdf5_file:
-            group = hdf5_file['devices/%s'%device_name]
+            # Collect the tables already read by prefetch_shot(), or read them now:
+            tables = self.prefetcher.get(hdf5_file)
+            if tables['cached'] and tables['table_hash'] != self.smart_cache['table_hash']:
+                # The smart cache has changed since the file was prefetched:
+                tables = self.read_shot_tables(hdf5_file, use_cache=False)
+            # Whether the shot's tables are identical to those in the smart cache, in which
+            # case they were not read, and only the initial values (in the first register
+            # of each DDS table, and the first two instructions) may need reprogramming:
+            tables_cached = tables['cached']
+            if not tables_cached:
+                # Invalidate the table hash until the new tables are all in the smart cache:
+                self.smart_cache['table_hash'] = None
             
-            # Is this shot using the fixed-duration workaround instead of checking the PulseBlaster's status?
-            self.time_based_stop_workaround = group.attrs.get('time_based_stop_workaround', False)
+            self.time_based_stop_workaround = tables['time_based_stop_workaround']
             if self.time_based_stop_workaround:
-                self.time_based_shot_duration = (group.attrs['stop_time']
-                                                 + hdf5_file['waits'][:]['timeout'].sum()
-                                                 + group.attrs['time_based_stop_workaround_extra_time'])
+                self.time_based_shot_duration = tables['time_based_shot_duration']
             
             # Program the DDS registers:
             ampregs = []
             freqregs = []
             phaseregs = []
+            def changed(name, table):
+                cached = self.smart_cache[name]
+                if tables_cached:
+                    # Only the initial value can differ:
+                    return table[0] != cached[0]
+                return len(table) != len(cached) or (table != cached).any()
+            
             for i in range(2):
-                amps = group['DDS%d/AMP_REGS'%i][:]
-                freqs = group['DDS%d/FREQ_REGS'%i][:]
-                phases = group['DDS%d/PHASE_REGS'%i][:]
-                
+                if tables_cached:
+                    amps = self.smart_cache['amps%d'%i].copy()
+                    freqs = self.smart_cache['freqs%d'%i].copy()
+                    phases = self.smart_cache['phases%d'%i].copy()
+                else:
+                    amps = tables['amps%d'%i]
+                    freqs = tables['freqs%d'%i]
+                    phases = tables['phases%d'%i]
+            
                 amps[0] = initial_values['dds %d'%i]['amp']
                 freqs[0] = initial_values['dds %d'%i]['freq']/10.0**6 # had better be in MHz!
                 phases[0] = initial_values['dds %d'%i]['phase']
-                
+            
                 pb_select_dds(i)
                 # Only reprogram each thing if there's been a change:
-                if fresh or len(amps) != len(self.smart_cache['amps%d'%i]) or (amps != self.smart_cache['amps%d'%i]).any():   
+                if fresh or changed('amps%d'%i, amps):
                     self.smart_cache['amps%d'%i] = amps
                     program_amp_regs(*amps)
-                if fresh or len(freqs) != len(self.smart_cache['freqs%d'%i]) or (freqs != self.smart_cache['freqs%d'%i]).any():
+                if fresh or changed('freqs%d'%i, freqs):
                     self.smart_cache['freqs%d'%i] = freqs
                     # We must be careful not to call stop_programming() until the end,
                     # lest the pulseblaster become responsive to triggers before we are done programming.
                     # This is not an issue for program_amp_regs above, only for freq and phase regs.
                     program_freq_regs(*freqs, call_stop_programming=False)
-                if fresh or len(phases) != len(self.smart_cache['phases%d'%i]) or (phases != self.smart_cache['phases%d'%i]).any():      
+                if fresh or changed('phases%d'%i, phases):
                     self.smart_cache['phases%d'%i] = phases
                     # See above comment - we must not call pb_stop_programming here:
                     program_phase_regs(*phases, call_stop_programming=False)
-                
+            
                 ampregs.append(amps)
                 freqregs.append(freqs)
                 phaseregs.append(phases)
-                
+            
             # Now for the pulse program:
-            pulse_program = group['PULSE_PROGRAM'][2:]
+            if tables_cached:
+                pulse_program = self.smart_cache['pulse_program']
+            else:
+                pulse_program = tables['pulse_program']
             
             #Let's get the final state of the pulseblaster. z's are the args we don't need:
             freqreg0,phasereg0,ampreg0,en0,z,freqreg1,phasereg1,ampreg1,en1,z,flags,z,z,z = pulse_program[-1]
@@ -1013,10 +1090,12 @@ class PulseblasterWorker(Worker):
             # occurred due to smart programming:
             pb_start_programming(PULSE_PROGRAM)
             
+            pulse_program_changed = not (fresh or tables_cached) and (
+                (len(self.smart_cache['pulse_program']) != len(pulse_program)) or
+                (self.smart_cache['pulse_program'] != pulse_program).any())
+            
             if fresh or (self.smart_cache['initial_values'] != initial_values) or \
-                (len(self.smart_cache['pulse_program']) != len(pulse_program)) or \
-                (self.smart_cache['pulse_program'] != pulse_program).any() or \
-                not self.smart_cache['ready_to_go']:
+                pulse_program_changed or not self.smart_cache['ready_to_go']:
             
                 self.smart_cache['ready_to_go'] = True
                 self.smart_cache['initial_values'] = initial_values
@@ -1049,12 +1128,14 @@ class PulseblasterWorker(Worker):
                 # Line one is a continue with the current front panel values:
                 pb_inst_dds2(0,0,0,initial_values['dds 0']['gate'],0,0,0,0,initial_values['dds 1']['gate'],0,initial_flags, CONTINUE, 0, 100)
                 # Now the rest of the program:
-                if fresh or len(self.smart_cache['pulse_program']) != len(pulse_program) or \
-                (self.smart_cache['pulse_program'] != pulse_program).any():
+                if fresh or pulse_program_changed:
                     self.smart_cache['pulse_program'] = pulse_program
                     for args in pulse_program:
                         pb_inst_dds2(*args)
             
+            # The smart cache now holds this shot's tables:
+            self.smart_cache['table_hash'] = tables['table_hash']
+            
             if self.programming_scheme == 'pb_start/BRANCH':
                 # We will be triggered by pb_start() if we are are the master pseudoclock or a single hardware trigger
                 # from the master if we are not:
@@ -1069,8 +1150,8 @@ class PulseblasterWorker(Worker):
             
             # Are there waits in use in this experiment? The monitor waiting for the end
             # of the experiment will need to know:
-            wait_monitor_exists = bool(hdf5_file['waits'].attrs['wait_monitor_acquisition_device'])
-            waits_in_use = bool(len(hdf5_file['waits']))
+            wait_monitor_exists = tables['wait_monitor_exists']
+            waits_in_use = tables['waits_in_use']
             self.waits_pending = wait_monitor_exists and waits_in_use
             if waits_in_use and not wait_monitor_exists:
                 # This should be caught during labscript compilation, but just in case.
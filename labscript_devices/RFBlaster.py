@@ -11,11 +11,44 @@
 #                                                                   #
 #####################################################################
 import os
+import getpass
+import hashlib
+import shutil
+import tempfile
 from labscript import PseudoclockDevice, Pseudoclock, ClockLine, IntermediateDevice, DDS, config, startupinfo, LabscriptError, set_passed_properties
 import numpy as np
 from labscript_devices import BLACS_tab, runviewer_parser
 from labscript_utils.setup_logging import setup_logging
 
+def _default_binary_cache_dir():
+    """A directory for the current user in the system temp dir, or None, disabling the
+    binary cache, if the user can't be determined"""
+    try:
+        user = getpass.getuser()
+    except (ImportError, KeyError, OSError):
+        return None
+    return os.path.join(tempfile.gettempdir(), 'labscript_rfblaster_binaries_%s' % user)
+
+
+def split_at_trigger_times(abs_table, trigger_times):
+    """Split a table of absolute times and values, with the times in the first column,
+    into chunks delimited by the trigger times, with times relative to the trigger.
+    Both the times and the trigger times must be sorted. The chunks are views of the
+    table, which is modified."""
+    # Each chunk is a contiguous slice, starting at the first time at or after its
+    # trigger and ending where the next chunk starts:
+    starts = np.searchsorted(abs_table[:,0], trigger_times, side='left')
+    ends = np.append(starts[1:], len(abs_table))
+    abs_tables = []
+    for start, end, t in zip(starts, ends, trigger_times):
+        # The chunks don't overlap, so each time is only made relative to its own
+        # trigger once:
+        subtable = abs_table[start:end]
+        subtable[:,0] -= t
+        abs_tables.append(subtable)
+    return abs_tables
+
+
 # Define a RFBlasterPseudoclock that only accepts one child clockline
 class RFBlasterPseudoclock(Pseudoclock):    
     def add_device(self, device):
@@ -37,6 +70,14 @@ class RFBlaster(PseudoclockDevice):
     # TODO: find out what these actually are!
     trigger_delay = 873.75e-6
     wait_day = trigger_delay
+
+    # Assembled binaries are cached here, named by a hash of their assembly code and
+    # the assembler version, so that the assembler need only be run for new code. Set
+    # to None to disable the cache:
+    binary_cache_dir = _default_binary_cache_dir()
+    # The least recently used binaries are deleted to keep the cache below this size
+    # in bytes:
+    binary_cache_max_size = 64 * 2**20
     
     @set_passed_properties()
     def __init__(self, name, ip_address, trigger_device=None, trigger_connection=None):
@@ -82,8 +123,6 @@ class RFBlaster(PseudoclockDevice):
         from rfblaster.rfjuice.cython.make_diff_table import make_diff_table
         from rfblaster.rfjuice.cython.compile import compileD
         # from rfblaster.rfjuice.compile import compileD
-        import tempfile
-        from subprocess import Popen, PIPE
         
         # Generate clock and save raw instructions to the h5 file:
         PseudoclockDevice.generate_code(self, hdf5_file)
@@ -121,36 +160,26 @@ class RFBlaster(PseudoclockDevice):
         diff_group = group.create_group('DIFF_TABLES')
         # When should the RFBlaster wait for a trigger?
         quantised_trigger_times = np.array([c.tT*1e6*t + 0.5 for t in self.trigger_times], dtype=np.int64)
-        for dds in range(2):
-            abs_table = np.zeros((len(times), 4),dtype=np.int64)
-            abs_table[:,0] = quantised_data['time']
-            abs_table[:,1] = quantised_data['amp%d'%dds]
-            abs_table[:,2] = quantised_data['freq%d'%dds]
-            abs_table[:,3] = quantised_data['phase%d'%dds]
-            
-            # split up the table into chunks delimited by trigger times:
-            abs_tables = []
-            for i, t in enumerate(quantised_trigger_times):
-                subtable = abs_table[abs_table[:,0] >= t]
-                try:
-                    next_trigger_time = quantised_trigger_times[i+1]
-                except IndexError:
-                    # No next trigger time
-                    pass
-                else:
-                    subtable = subtable[subtable[:,0] < next_trigger_time]
-                subtable[:,0] -= t
-                abs_tables.append(subtable)
-
-            # convert to diff tables:
-            diff_tables = [make_diff_table(tab) for tab in abs_tables]
-            # Create temporary files, get their paths, and close them:
-            with tempfile.NamedTemporaryFile(delete=False) as f:
-                temp_assembly_filepath = f.name
-            with tempfile.NamedTemporaryFile(delete=False) as f:
-                temp_binary_filepath = f.name
+        temp_filepaths = []
+        assembly = {}
+        try:
+            for dds in range(2):
+                abs_table = np.zeros((len(times), 4),dtype=np.int64)
+                abs_table[:,0] = quantised_data['time']
+                abs_table[:,1] = quantised_data['amp%d'%dds]
+                abs_table[:,2] = quantised_data['freq%d'%dds]
+                abs_table[:,3] = quantised_data['phase%d'%dds]
                 
-            try:
+                # split up the table into chunks delimited by trigger times:
+                abs_tables = split_at_trigger_times(abs_table, quantised_trigger_times)
+
+                # convert to diff tables:
+                diff_tables = [make_diff_table(tab) for tab in abs_tables]
+                # Create a temporary file, get its path, and close it:
+                with tempfile.NamedTemporaryFile(delete=False) as f:
+                    temp_assembly_filepath = f.name
+                temp_filepaths.append(temp_assembly_filepath)
+                    
                 # Compile to assembly:
                 with open(temp_assembly_filepath,'w') as assembly_file:
                     for i, dtab in enumerate(diff_tables):
@@ -166,31 +195,168 @@ class RFBlaster(PseudoclockDevice):
                     assembly_group.create_dataset('DDS%d'%dds, data=assembly_code)
                     for i, diff_table in enumerate(diff_tables):
                         diff_group.create_dataset('DDS%d_difftable%d'%(dds,i), compression=config.compression, data=diff_table)
-                # compile to binary:
-                compilation = Popen([caspr,temp_assembly_filepath,temp_binary_filepath],
-                                     stdout=PIPE, stderr=PIPE, cwd=rfjuice_folder,startupinfo=startupinfo)
-                stdout, stderr = compilation.communicate()
-                if compilation.returncode:
-                    print(stdout)
-                    raise LabscriptError('RFBlaster compilation exited with code %d\n\n'%compilation.returncode +
-                                         'Stdout was:\n %s\n'%stdout + 'Stderr was:\n%s\n'%stderr)
+                assembly[dds] = (temp_assembly_filepath, assembly_code)
+
+            binaries = self.assemble(caspr, rfjuice_folder, assembly)
+            for dds in range(2):
                 # Save the binary to the h5 file:
-                with open(temp_binary_filepath,'rb') as binary_file:
-                    binary_data = binary_file.read()
                 # has to be numpy.string_ (string_ in this namespace,
                 # imported from pylab) as python strings get stored
                 # as h5py as 'variable length' strings, which 'cannot
                 # contain embedded nulls'. Presumably our binary data
                 # must contain nulls sometimes. So this crashes if we
                 # don't convert to a numpy 'fixes length' string:
-                binary_group.create_dataset('DDS%d'%dds, data=np.bytes_(binary_data))
-            finally:
-                # Delete the temporary files:
-                os.remove(temp_assembly_filepath)
-                os.remove(temp_binary_filepath)
-                # print 'assembly:', temp_assembly_filepath
-                # print 'binary for dds %d on %s:'%(dds,self.name), temp_binary_filepath
+                binary_group.create_dataset('DDS%d'%dds, data=np.bytes_(binaries[dds]))
+        finally:
+            # Delete the temporary files:
+            for filepath in temp_filepaths:
+                os.remove(filepath)
 
+    def assemble(self, caspr, cwd, assembly):
+        """Assemble to binary each item of assembly, a dict of (assembly filepath,
+        assembly code) tuples, and return a dict of the binaries with the same keys.
+        Binaries are taken from the cache where possible, and the assembler is run
+        concurrently for the rest."""
+        from subprocess import Popen, PIPE
+        caspr = self.find_assembler(caspr)
+        assembler_version = self.assembler_version(caspr)
+        temp_filepaths = []
+        compilations = {}
+        binaries = {}
+        try:
+            for name, (assembly_filepath, assembly_code) in assembly.items():
+                # Use the binary from a previous compilation of the same assembly, if
+                # there is one:
+                cache_key = hashlib.sha256(assembler_version + assembly_code.encode('utf8')).hexdigest()
+                binaries[name] = self.get_cached_binary(cache_key)
+                if binaries[name] is None:
+                    with tempfile.NamedTemporaryFile(delete=False) as f:
+                        temp_binary_filepath = f.name
+                    temp_filepaths.append(temp_binary_filepath)
+                    # compile to binary. All are compiled concurrently, we wait for
+                    # them below:
+                    compilation = Popen([caspr,assembly_filepath,temp_binary_filepath],
+                                         stdout=PIPE, stderr=PIPE, cwd=cwd,startupinfo=startupinfo)
+                    compilations[name] = (compilation, temp_binary_filepath, cache_key)
+
+            for name, (compilation, temp_binary_filepath, cache_key) in compilations.items():
+                stdout, stderr = compilation.communicate()
+                if compilation.returncode:
+                    print(stdout)
+                    raise LabscriptError('RFBlaster compilation exited with code %d\n\n'%compilation.returncode +
+                                         'Stdout was:\n %s\n'%stdout + 'Stderr was:\n%s\n'%stderr)
+                with open(temp_binary_filepath,'rb') as binary_file:
+                    binaries[name] = binary_file.read()
+                self.cache_binary(cache_key, binaries[name])
+        finally:
+            # Don't leave assemblers running if we're bailing out:
+            for compilation, _, _ in compilations.values():
+                if compilation.poll() is None:
+                    compilation.kill()
+                    compilation.wait()
+            # Delete the temporary files:
+            for filepath in temp_filepaths:
+                os.remove(filepath)
+        return binaries
+
+    @staticmethod
+    def find_assembler(caspr):
+        """Return the full path to the assembler, which may be given as a path or as a
+        command on the PATH"""
+        path = shutil.which(caspr)
+        if path is None:
+            raise LabscriptError('RFBlaster assembler %s not found' % caspr)
+        return os.path.abspath(path)
+
+    @staticmethod
+    def assembler_version(caspr):
+        """Return bytes identifying the assembler at the given full path, for use in
+        binary cache keys. The assembler has no version flag, so its path, size and
+        modification time are used, which change whenever it is updated."""
+        stat = os.stat(caspr)
+        return ('%s %d %d\n' % (caspr, stat.st_size, stat.st_mtime_ns)).encode('utf8')
+
+    def binary_cache_path(self, cache_key):
+        """Return the path of the cache file for the given key, or None if the cache is
+        disabled or its directory can't be used. The directory is created, readable
+        only by the current user, if it doesn't exist. One that exists and is owned by
+        another user is not used."""
+        if self.binary_cache_dir is None:
+            return None
+        try:
+            os.makedirs(self.binary_cache_dir, mode=0o700, exist_ok=True)
+            if hasattr(os, 'getuid') and os.stat(self.binary_cache_dir).st_uid != os.getuid():
+                return None
+        except OSError:
+            return None
+        return os.path.join(self.binary_cache_dir, cache_key)
+
+    @staticmethod
+    def binary_digest(cache_key, binary):
+        """Digest stored with each cached binary, to check it was stored under this
+        key and has not been corrupted"""
+        return hashlib.sha256(cache_key.encode('utf8') + binary).digest()
+
+    def get_cached_binary(self, cache_key):
+        """Return the cached binary for the given key, or None if there isn't one or it
+        fails its integrity check, in which case it is removed"""
+        path = self.binary_cache_path(cache_key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        digest, binary = data[:32], data[32:]
+        try:
+            if digest != self.binary_digest(cache_key, binary):
+                os.remove(path)
+                return None
+            # Mark it as recently used, so it is pruned last:
+            os.utime(path)
+        except OSError:
+            pass
+        return binary
+
+    def cache_binary(self, cache_key, binary):
+        """Store an assembled binary in the cache under the given key, along with its
+        digest, and prune the cache"""
+        path = self.binary_cache_path(cache_key)
+        if path is None:
+            return
+        # Write to a temporary file then rename it into place, so that concurrent
+        # compilations never see a partially written binary. The cache is only an
+        # optimisation, so failing to write to it is not an error:
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.binary_cache_dir, delete=False) as f:
+                f.write(self.binary_digest(cache_key, binary) + binary)
+            os.replace(f.name, path)
+        except OSError:
+            return
+        self.prune_binary_cache()
+
+    def prune_binary_cache(self):
+        """Delete the least recently used binaries until the cache is no larger than
+        binary_cache_max_size bytes"""
+        entries = []
+        try:
+            for entry in os.scandir(self.binary_cache_dir):
+                # Skip temporary files being written by other processes:
+                if len(entry.name) == 64 and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        except OSError:
+            return
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.binary_cache_max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
                 
 class RFBlasterDirectOutputs(IntermediateDevice):
     allowed_children = [DDS]
@@ -333,6 +499,7 @@ class RFBlasterWorker(Worker):
         exec('from numpy import *', globals())
         global h5py; import labscript_utils.h5_lock, h5py
         global re; import re
+        global requests; import requests
         self.timeout = 10   # How long do we wait until we assume that the RFBlaster is dead? (in seconds)
         self.retries = 3    # Retry attempts before (a) giving up, or (b) attempting to restart kloned (uniform timeout)
         p = re.compile('http://([0-9.]+):[0-9]+')
@@ -340,6 +507,10 @@ class RFBlasterWorker(Worker):
         self.ip = m.group(1)
         self.netlogger = setup_logging('rfBlaster_%s' % self.ip)
         self.netlogger.info('init: Started logging')
+        # A persistent session, so that the connection is kept alive between requests:
+        self.session = requests.Session()
+        # Regular expression for finding the values in the status page:
+        self.web_values_regex = re.compile(r'name="([fap])_ch(\d+?)_in"\s*?value="([0-9.]+?)"')
         self.http_request() # See if the RFBlaster answers
         self._last_program_manual_values = {}
 
@@ -360,6 +531,9 @@ class RFBlasterWorker(Worker):
         s.shutdown(socket.SHUT_WR)
         self.netlogger.info('restart_kloned: Finished. Closing socket.')
         s.close()
+        # Any kept-alive connection to the old kloned is dead:
+        self.session.close()
+        self.session = requests.Session()
 
     def program_manual(self,values):
         self._last_program_manual_values = values
@@ -418,7 +592,6 @@ class RFBlasterWorker(Worker):
      
     def http_request(self, form=None): 
         """Make a HTTP request to the RFBlaster, optionally submitting a form"""
-        import requests
         from urllib.request import urlopen, Request
         from urllib.error import URLError, HTTPError 
     
@@ -433,9 +606,9 @@ class RFBlasterWorker(Worker):
                     # ... rather than a dict. No matter. it seems requests sucks this up anyway.
                     # However we need to rearrange the file data into a nested tuple for requests. No big deal:
                     filelist = [(field_name, (filename, bytes(body), content_type)) for field_name, filename, content_type, body in form.files]
-                    r = requests.post(self.address, data=form.form_fields, files=filelist) # Needs to actually send the form
+                    r = self.session.post(self.address, data=form.form_fields, files=filelist) # Needs to actually send the form
                 else:
-                    r = requests.get(self.address)
+                    r = self.session.get(self.address)
                 r.raise_for_status() 
                 self.netlogger.info('Connected!')
                 break
@@ -454,10 +627,8 @@ class RFBlasterWorker(Worker):
         return r.text
 
     def get_web_values(self, page): 
-        import re
-        # Prepare regular expressions for finding the values:
-        search = re.compile(r'name="([fap])_ch(\d+?)_in"\s*?value="([0-9.]+?)"')
-        webvalues = re.findall(search, page)
+        # Find the values:
+        webvalues = self.web_values_regex.findall(page)
         
         register_name_map = {'f': 'freq', 'a': 'amp', 'p': 'phase'}
         newvals = {}
@@ -484,6 +655,5 @@ class RFBlasterWorker(Worker):
         return self.get_web_values(self.http_request())
         
     def shutdown(self):
-        # TODO: implement this?
-        pass
+        self.session.close()
 
@@ -1,6 +1,7 @@
 import pyvisa
 import numpy as np
 import time
+from .utils import trace_times, trace_volts
 
 class TekScope:
     def __init__(self, addr='USB?*::INSTR', 
@@ -15,6 +16,8 @@ class TekScope:
         self.read = self.dev.read
         self.write = self.dev.write
         self.query = self.dev.query
+        # parsed waveform preambles, keyed by the raw preamble response:
+        self._preamble_cache = {}
 
     def channels(self, all=True):
         """Return a dictionary of the channels supported by this scope and whether they are currently displayed.
@@ -43,57 +46,57 @@ class TekScope:
                 vals[name] = visible
         return vals
 
-    def waveform(self, channel='CH1', preamble_string='WFMO', int16=False):
-        """Download the waveform of the specified channel from the oscilloscope. All
-        acquired points are downloaded, as set by the 'Record length' setting in the
-        'Acquisition' menu. A dictionary of waveform formatting parameters is returned
-        in addition to the times and values.
-        """
-        # configure the data transfer
-        self.dev.write('DAT:SOU ' + channel)             # set the location of the data transferred by CURVe?
+    # waveform preamble keys queried along with each waveform
+    preamble_keys = [
+        'BYT_NR',                                 # data width for the outgoing waveform
+        'BIT_NR',                                 # number of bits per waveform point (8 or 16)
+        'ENCDG',                                  # type of encoding (ASCII or binary)
+        'BN_FMT',                                 # format of binary data (redundant for ASCII transfer) 
+        'BYT_OR',                                 # first transmitted byte of binray data (LSB or MSB) 
+        'NR_PT',                                  # number of points transmitted in response to a CURVe? query 
+        'WFID',                                   # acquisition parameters 
+        'PT_FMT',                                 # point format: {ENV: min/max pairs, Y: single points}
+        'XINCR',                                  # horizontal increment
+        'PT_OFF',                                 # trigger offset
+        'XZERO',                                  # time coordinate of the first point
+        'XUNIT',                                  # horizontal units
+        'YMULT',                                  # vertical scale factor per digitizing level
+        'YZERO',                                  # vertical offset
+        'YOFF',                                   # vertical position in digitizing levels
+        'YUNIT'                                   # vertical units
+        ]
+
+    def configure_transfer(self, preamble_string='WFMO', int16=False, frames=None):
+        """Configure the encoding and range of subsequent waveform transfers, common to
+        all channels. All acquired points are transferred, and if frames is not None,
+        all of that many FastFrame frames. Returns the record length."""
         self.dev.write('DAT:ENC RIB')                    # tranfer the waveform in binary format (signed, MSB)
         if int16:
-            self.dev.write(preamble_string + ':BYT_N 2')               # use 16-bit integers (but only return every second pt)
+            self.dev.write(preamble_string + ':BYT_N 2')               # use 16-bit integers
         else:
             self.dev.write(preamble_string + ':BYT_N 1')               # use 8-bit integers
         record_length = int(self.dev.query('HOR:RECO?')) # determine how many points exist
         self.dev.write('DAT:START ' + '1')               # set the first data point to transfer
         self.dev.write('DAT:STOP ' + str(record_length)) # set the last data point to transfer
-
-        # transfer the data and format into a sequence of strings
-        raw = self.dev.query_binary_values('CURV?', 
-            datatype='i' if int16 else 'b', 
-            is_big_endian=True,
-            container=np.array
-            )
-
-        # create a dictionary for the header information
-        keys = [
-            'BYT_NR',                                 # data width for the outgoing waveform
-            'BIT_NR',                                 # number of bits per waveform point (8 or 16)
-            'ENCDG',                                  # type of encoding (ASCII or binary)
-            'BN_FMT',                                 # format of binary data (redundant for ASCII transfer) 
-            'BYT_OR',                                 # first transmitted byte of binray data (LSB or MSB) 
-            'NR_PT',                                  # number of points transmitted in response to a CURVe? query 
-            'WFID',                                   # acquisition parameters 
-            'PT_FMT',                                 # point format: {ENV: min/max pairs, Y: single points}
-            'XINCR',                                  # horizontal increment
-            'PT_OFF',                                 # trigger offset
-            'XZERO',                                  # time coordinate of the first point
-            'XUNIT',                                  # horizontal units
-            'YMULT',                                  # vertical scale factor per digitizing level
-            'YZERO',                                  # vertical offset
-            'YOFF',                                   # vertical position in digitizing levels
-            'YUNIT'                                   # vertical units
-            ]
-
-        # wfstr = self.dev.query(preamble_string + '?').split(';')    # waveform transmission and formatting parameters
-        self.dev.write(';:'.join([preamble_string + ':' + k  + '?' for k in keys]))
-        wfstr = self.dev.read().split(';')
-
-        # create a dictionary of the waveform preamble
+        if frames is not None:
+            self.dev.write('DAT:FRAMESTART 1')           # transfer every frame, back to back
+            self.dev.write('DAT:FRAMESTOP ' + str(frames))
+        return record_length
+
+    def preamble_query(self, preamble_string='WFMO'):
+        """The compound query for the preamble of the current data source"""
+        return ';:'.join([preamble_string + ':' + k  + '?' for k in self.preamble_keys])
+
+    def parse_preamble(self, wfstr):
+        """Return a dictionary of the waveform preamble from the list of response
+        strings to the preamble query. The result is cached, since the preamble is the
+        same from one download to the next unless the scope settings change."""
+        wfstr = tuple(wfstr)
+        cache = self._preamble_cache
+        if wfstr in cache:
+            return dict(cache[wfstr])
         wfmp = {}
-        for key, x in zip(keys, wfstr):
+        for key, x in zip(self.preamble_keys, wfstr):
             x = str(x)
             if x[0] == '"':                             # is it an enclosed string?
                 x = x.split('"')[1]
@@ -103,13 +106,89 @@ class TekScope:
                 try: x = float(x)                       # try floating point number
                 except: pass
             wfmp[key] = x
+        # Only the most recent preambles are worth keeping:
+        if len(cache) > 64:
+            cache.clear()
+        cache[wfstr] = wfmp
+        return dict(wfmp)
+
+    def curve(self, int16=False):
+        """Transfer the data of the current data source"""
+        return self.dev.query_binary_values('CURV?', 
+            datatype='h' if int16 else 'b', 
+            is_big_endian=True,
+            container=np.array
+            )
+
+    def scale(self, wfmp, raw):
+        """Return the times and voltages of a waveform from its preamble and raw data.
+        Times are along the last axis of the raw data, as for FastFrame frames."""
+        return trace_times(wfmp, raw.shape[-1]), trace_volts(raw, wfmp)
+
+    def waveform(self, channel='CH1', preamble_string='WFMO', int16=False):
+        """Download the waveform of the specified channel from the oscilloscope. All
+        acquired points are downloaded, as set by the 'Record length' setting in the
+        'Acquisition' menu. A dictionary of waveform formatting parameters is returned
+        in addition to the times and values.
+        """
+        # configure the data transfer
+        self.dev.write('DAT:SOU ' + channel)             # set the location of the data transferred by CURVe?
+        self.configure_transfer(preamble_string, int16)
+
+        # transfer the data and format into a sequence of strings
+        raw = self.curve(int16)
+
+        # wfstr = self.dev.query(preamble_string + '?').split(';')    # waveform transmission and formatting parameters
+        self.dev.write(self.preamble_query(preamble_string))
+        wfmp = self.parse_preamble(self.dev.read().split(';'))
 
         # return the times and voltages
-        n = np.arange(0, wfmp['NR_PT'] / wfmp['BYT_NR'])
-        t = wfmp['BYT_NR'] * wfmp['XINCR'] * (n - wfmp['PT_OFF']) + wfmp['XZERO']
-        y = wfmp['YMULT'] * (raw - wfmp['YOFF']) + wfmp['YZERO']
+        t, y = self.scale(wfmp, raw)
         return wfmp, t, y
 
+    def waveforms(self, channels, preamble_string='WFMO', int16=False, frames=None):
+        """Download the waveforms of several channels, as with waveform(), but
+        configuring the transfer once and querying the preambles of all channels in a
+        single compound query. Returns a dictionary of (preamble, raw) tuples keyed by
+        channel, where raw is the array of integer samples as transferred (int8, or
+        int16 if int16 is True). Use scale() to convert to times and voltages.
+
+        If frames is not None, that many FastFrame frames are downloaded per channel in
+        a single transfer, and raw has shape (frames, record length). A ValueError is
+        raised if a channel's preamble or data does not have that many points, as
+        when the scope did not acquire all the frames.
+        """
+        channels = list(channels)
+        if not channels:
+            return {}
+        record_length = self.configure_transfer(preamble_string, int16, frames)
+
+        # One query for all the preambles, switching data source between them:
+        preamble_query = self.preamble_query(preamble_string)
+        self.dev.write(';:'.join(['DAT:SOU ' + ch + ';:' + preamble_query for ch in channels]))
+        wfstr = self.dev.read().split(';')
+        n_keys = len(self.preamble_keys)
+        if len(wfstr) != n_keys * len(channels):
+            msg = 'Expected {} preamble values for {} channels, got {}'
+            raise ValueError(msg.format(n_keys * len(channels), len(channels), len(wfstr)))
+
+        # Then the data, back to back:
+        results = {}
+        for i, channel in enumerate(channels):
+            self.dev.write('DAT:SOU ' + channel)
+            raw = self.curve(int16).astype(np.int16 if int16 else np.int8)
+            wfmp = self.parse_preamble(wfstr[i * n_keys:(i + 1) * n_keys])
+            if frames is not None:
+                n_points = frames * record_length
+                if wfmp['NR_PT'] != n_points or len(raw) != n_points:
+                    msg = ('{}: expected {} FastFrame frames of {} points ({} points), '
+                           'but the preamble reports {} points and {} were transferred')
+                    raise ValueError(msg.format(channel, frames, record_length, n_points,
+                                                wfmp['NR_PT'], len(raw)))
+                raw = raw.reshape(frames, record_length)
+            results[channel] = wfmp, raw
+        return results
+
     def get_screenshot(self, verbose=False):
         if verbose:
             print('Downloading screen image...')
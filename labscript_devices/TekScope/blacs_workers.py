@@ -18,6 +18,9 @@ class TekScopeWorker(Worker):
             manufacturer, model
         )
         print('Connected to {} (SN: {})'.format(model, sn))
+        # Whether we have turned on FastFrame, and so must turn it off again for shots
+        # that don't use it:
+        self.fastframe_enabled = False
 
     def transition_to_buffered(self, device_name, h5file, front_panel_values, refresh):
         self.h5file = h5file  # We'll need this in transition_to_manual
@@ -32,7 +35,18 @@ class TekScopeWorker(Worker):
 
         self.scope.unlock()
         self.scope.set_acquire_state(True)
-        # TODO: Make per-shot acquisition parameters and channels configurable here
+        # TODO: Make channels configurable here
+        record_length = self.scope_params.get('record_length', None)
+        if record_length is not None:
+            self.scope.write('HOR:RECO {:d}'.format(record_length))
+        self.frames = self.scope_params.get('fastframe_count', None)
+        if self.frames is not None:
+            self.scope.write('HOR:FAST:STATE ON')
+            self.scope.write('HOR:FAST:COUN {:d}'.format(self.frames))
+            self.fastframe_enabled = True
+        elif self.fastframe_enabled:
+            self.scope.write('HOR:FAST:STATE OFF')
+            self.fastframe_enabled = False
         self.scope.write('ACQUIRE:MODE SAMPLE')
         self.scope.write('ACQUIRE:STOPAFTER SEQUENCE')
         self.scope.write('ACQUIRE:STATE RUN')
@@ -40,19 +54,36 @@ class TekScopeWorker(Worker):
 
     def transition_to_manual(self):
         channels = self.scope.channels()
+        print('Downloading...')
+        waveforms = self.scope.waveforms(
+            [ch for ch, enabled in channels.items() if enabled],
+            int16=self.scope_params.get('int16', False),
+            preamble_string=self.preamble_string,
+            frames=self.frames,
+        )
+        for ch, (wfmp, raw) in waveforms.items():
+            print(wfmp['WFID'])
+
+        if self.scope_params.get('raw_traces', False) or self.frames is not None:
+            # Open the file after download so as not to hog the file lock
+            with h5py.File(self.h5file, 'r+') as hdf_file:
+                grp = hdf_file.require_group('/data/traces').create_group(self.device_name)
+                print('Saving traces...')
+                # One dataset of raw integer samples per channel, with the preamble
+                # needed to convert them to times and voltages as attributes (see
+                # utils.reconstruct_trace):
+                for ch, (wfmp, raw) in waveforms.items():
+                    dset = grp.create_dataset(ch, data=raw)
+                    dset.attrs.update(wfmp)
+            print('Done!')
+            return True
+
         wfmp = {}
         vals = {}
         wtype = [('t', 'float')]
-        print('Downloading...')
-        for ch, enabled in channels.items():
-            if enabled:
-                wfmp[ch], t, vals[ch] = self.scope.waveform(
-                    ch,
-                    int16=self.scope_params.get('int16', False),
-                    preamble_string=self.preamble_string,
-                )
-                wtype.append((ch, 'float'))
-                print(wfmp[ch]['WFID'])
+        for ch, (wfmp[ch], raw) in waveforms.items():
+            t, vals[ch] = self.scope.scale(wfmp[ch], raw)
+            wtype.append((ch, 'float'))
 
         # Collate all data in a structured array
         data = np.empty(len(t), dtype=wtype)
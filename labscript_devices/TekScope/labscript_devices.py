@@ -8,18 +8,37 @@ class TekScope(Device):
 
           device_properties (set per shot)
           timeout: in seconds for response to queries over visa interface
-          int16: download waveform pts as 16 bit integers (returns 1/2 as many pts) 
+          int16: download waveform pts as 16 bit integers
+          raw_traces: save the integer samples as downloaded, one dataset per channel
+                      in the group /data/traces/<name>, with the preamble needed to
+                      convert them to times and voltages as attributes (see
+                      labscript_devices.TekScope.utils.get_traces). Otherwise save
+                      times and voltages as floats in the dataset /data/traces/<name>
+          record_length: number of points to acquire per record, or None to leave the
+                         scope's 'Record length' setting as it is
+          fastframe_count: number of triggered records (frames) to acquire per shot
+                           using FastFrame segmented acquisition, or None to acquire
+                           a single record. Frames are always saved as raw integer
+                           samples as with raw_traces, one 2D dataset of shape
+                           (fastframe_count, record length) per channel
     """
     description = 'Tekstronix oscilloscope'
 
     @set_passed_properties(
         property_names = {
             'connection_table_properties': ['termination', 'preamble_string'],
-            'device_properties': ['timeout', 'int16']}
+            'device_properties': [
+                'timeout',
+                'int16',
+                'raw_traces',
+                'record_length',
+                'fastframe_count',
+            ]}
         )
     def __init__(self, name, addr, 
                  termination='\n', preamble_string='WFMP',
-                 timeout=5, int16=False,
+                 timeout=5, int16=False, raw_traces=False,
+                 record_length=None, fastframe_count=None,
                  **kwargs):
         Device.__init__(self, name, None, addr, **kwargs)
         self.name = name
@@ -27,6 +46,10 @@ class TekScope(Device):
         self.termination = termination
         self.preamble_string = preamble_string
         assert preamble_string in ['WFMO', 'WFMP'], "preamble_string must be one of 'WFMO' or 'WFMP'"
+        if record_length is not None and record_length < 1:
+            raise LabscriptError('record_length must be a positive integer or None')
+        if fastframe_count is not None and fastframe_count < 1:
+            raise LabscriptError('fastframe_count must be a positive integer or None')
 
     def generate_code(self, hdf5_file):
         # group = self.init_device_name(hdf5_file)
@@ -0,0 +1,122 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/TekScope/testing/test_TekScope.py              #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of the TekScope driver against a fake instrument"""
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pyvisa')
+
+
+def test_import_does_not_import_h5py():
+    code = (
+        'import sys\n'
+        'import labscript_devices.TekScope.TekScope\n'
+        'assert "h5py" not in sys.modules, "h5py was imported"\n'
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+class FakeScope(object):
+    """Stands in for the pyvisa resource of a scope, with the given data for each
+    channel as acquired, one row per FastFrame frame"""
+
+    def __init__(self, data, record_length):
+        self.data = data
+        self.record_length = record_length
+        self.source = None
+        self.responses = []
+        self.writes = []
+
+    def write(self, message):
+        self.writes.append(message)
+        for command in message.split(';:'):
+            if command.startswith('DAT:SOU '):
+                self.source = command.split()[1]
+            elif command.startswith('WFMO:') and command.endswith('?'):
+                self.responses.append(self.preamble_value(command[5:-1]))
+
+    def read(self):
+        response = ';'.join(self.responses)
+        self.responses = []
+        return response
+
+    def query(self, message):
+        assert message == 'HOR:RECO?'
+        return str(self.record_length)
+
+    def query_binary_values(self, message, datatype, is_big_endian, container):
+        assert message == 'CURV?'
+        return container(self.data[self.source].ravel())
+
+    def preamble_value(self, key):
+        values = {
+            'BYT_NR': '1', 'BIT_NR': '8', 'ENCDG': 'BIN', 'BN_FMT': 'RI',
+            'BYT_OR': 'MSB', 'NR_PT': str(self.data[self.source].size),
+            'WFID': '"%s, DC coupling"' % self.source, 'PT_FMT': 'Y',
+            'XINCR': '1.0E-9', 'PT_OFF': '0', 'XZERO': '-5.0E-6', 'XUNIT': '"s"',
+            'YMULT': '4.0E-3', 'YZERO': '0.0E+0', 'YOFF': '0.0E+0', 'YUNIT': '"V"',
+        }
+        return values[key]
+
+
+def make_scope(data, record_length):
+    from labscript_devices.TekScope.TekScope import TekScope
+
+    scope = TekScope.__new__(TekScope)
+    scope.dev = FakeScope(data, record_length)
+    scope._preamble_cache = {}
+    return scope
+
+
+def random_data(channels, frames, record_length):
+    rng = np.random.default_rng(0)
+    return {
+        ch: rng.integers(-128, 128, (frames, record_length), dtype=np.int8)
+        for ch in channels
+    }
+
+
+def test_fastframe_waveforms():
+    data = random_data(['CH1', 'CH2'], 4, 100)
+    scope = make_scope(data, 100)
+    waveforms = scope.waveforms(['CH1', 'CH2'], frames=4)
+    assert 'DAT:FRAMESTOP 4' in scope.dev.writes
+    for ch in ['CH1', 'CH2']:
+        wfmp, raw = waveforms[ch]
+        assert wfmp['NR_PT'] == 400
+        assert wfmp['WFID'] == '%s, DC coupling' % ch
+        np.testing.assert_array_equal(raw, data[ch])
+        t, v = scope.scale(wfmp, raw)
+        assert t.shape == (100,)
+        assert v.shape == (4, 100)
+
+
+def test_single_frame_waveforms():
+    data = random_data(['CH1'], 1, 100)
+    scope = make_scope(data, 100)
+    wfmp, raw = scope.waveforms(['CH1'])['CH1']
+    np.testing.assert_array_equal(raw, data['CH1'][0])
+
+
+def test_fastframe_point_count_mismatch():
+    # The scope acquired only three of the four frames:
+    data = random_data(['CH1', 'CH2'], 4, 100)
+    data['CH2'] = data['CH2'][:3]
+    scope = make_scope(data, 100)
+    msg = 'CH2: expected 4 FastFrame frames of 100 points \\(400 points\\), '
+    msg += 'but the preamble reports 300 points and 300 were transferred'
+    with pytest.raises(ValueError, match=msg):
+        scope.waveforms(['CH1', 'CH2'], frames=4)
@@ -0,0 +1,40 @@
+import numpy as np
+
+# h5py is imported only where needed, so that TekScope.py can use the scaling
+# functions here without importing h5py, which in processes using
+# labscript_utils.h5_lock must not be imported before it.
+
+
+def trace_times(attrs, n_points):
+    """Return the times of the points of a trace from its preamble attributes. The
+    times are the same for each frame of a FastFrame acquisition."""
+    n = np.arange(n_points)
+    return attrs['XINCR'] * (n - attrs['PT_OFF']) + attrs['XZERO']
+
+
+def trace_volts(raw, attrs):
+    """Return the voltages of a raw integer trace from its preamble attributes"""
+    return attrs['YMULT'] * (raw - attrs['YOFF']) + attrs['YZERO']
+
+
+def reconstruct_trace(dataset):
+    """Return the times and voltages of one channel of a trace saved with
+    raw_traces=True, given its h5py dataset at /data/traces/<device_name>/<channel>.
+    The raw integer samples are scaled using the preamble stored in the dataset's
+    attributes. Times are along the last axis."""
+    raw = dataset[()]
+    attrs = dict(dataset.attrs)
+    return trace_times(attrs, raw.shape[-1]), trace_volts(raw, attrs)
+
+
+def get_traces(hdf5_file, device_name):
+    """Return a dictionary of (times, voltages) tuples, keyed by channel, of the traces
+    saved by the given scope in an open shot file. Works whether the traces were saved
+    as raw integers or as voltages."""
+    import h5py
+
+    traces = hdf5_file['/data/traces'][device_name]
+    if isinstance(traces, h5py.Group):
+        return {ch: reconstruct_trace(dataset) for ch, dataset in traces.items()}
+    data = traces[()]
+    return {ch: (data['t'], data[ch]) for ch in data.dtype.names if ch != 't'}
@@ -12,7 +12,7 @@
 #####################################################################
 
 from blacs.tab_base_classes import Worker
-from time import monotonic
+from time import monotonic, sleep
 from labscript_utils import dedent
 import labscript_utils.h5_lock, h5py
 
@@ -23,15 +23,35 @@ zaber = None
 
 TIMEOUT = 60
 
+# Binary protocol command numbers:
+MOVE_ABSOLUTE = 20
+ERROR = 255
+
 
 class MockZaberInterface(object):
+    # Simulated stage speed in microsteps per second, or None for instantaneous moves.
+    # Stages move concurrently, so a call to move_many() takes as long as the longest
+    # of its moves:
+    speed = None
+
     def __init__(self, com_port):
         from collections import defaultdict
         self.positions = defaultdict(int)
 
     def move(self, device_number, position):
-        print(f"Mock move device {device_number} to position {position}")
-        self.positions[device_number] = position
+        self.move_many({device_number: position})
+
+    def move_many(self, positions):
+        travel_time = 0
+        for device_number, position in positions.items():
+            if self.positions[device_number] == position:
+                continue
+            print(f"Mock move device {device_number} to position {position}")
+            if self.speed is not None:
+                distance = abs(position - self.positions[device_number])
+                travel_time = max(travel_time, distance / self.speed)
+            self.positions[device_number] = position
+        sleep(travel_time)
 
     def get_position(self, device_number):
         return self.positions[device_number]
@@ -53,13 +73,46 @@ class ZaberInterface(object):
         self.port = zaber.BinarySerial(com_port)
 
     def move(self, device_number, position):
-        device = zaber.BinaryDevice(self.port, device_number)
-        device.move_abs(position)
+        self.move_many({device_number: position})
+
+    def move_many(self, positions):
+        """Move the devices to the given positions, a dict of positions keyed by device
+        number, concurrently. Moves are sent to all devices not already at their
+        targets before waiting for any of them. Devices using the binary protocol
+        reply to a move once it is complete, so we then wait for all the replies."""
+        # Read all current positions before sending any move, since a position query
+        # reads the next reply on the port, which once a move is in flight may be the
+        # reply to that move instead:
+        pending = {
+            device_number: position
+            for device_number, position in positions.items()
+            if self.get_position(device_number) != position
+        }
+        for device_number, position in pending.items():
+            self.port.write(zaber.BinaryCommand(device_number, MOVE_ABSOLUTE, position))
         deadline = monotonic() + TIMEOUT
-        while device.get_position() != position:
+        while pending:
             if monotonic() > deadline:
                 msg = "Device did not move to requested position within timeout"
                 raise TimeoutError(msg)
+            try:
+                reply = self.port.read()
+            except zaber.TimeoutError:
+                # Long moves may take longer than the port's read timeout:
+                continue
+            if reply.device_number not in pending:
+                continue
+            if reply.command_number == ERROR:
+                msg = f"Device {reply.device_number} replied with error code {reply.data}"
+                raise RuntimeError(msg)
+            if reply.command_number != MOVE_ABSOLUTE:
+                # Not the reply to our move, for example a manual move notification
+                continue
+            position = pending.pop(reply.device_number)
+            if reply.data != position:
+                msg = f"""Device {reply.device_number} stopped at position {reply.data}
+                    instead of requested position {position}"""
+                raise RuntimeError(dedent(msg))
 
     def get_position(self, device_number):
         device = zaber.BinaryDevice(self.port, device_number)
@@ -84,9 +137,11 @@ class ZaberWorker(Worker):
         return remote_values
 
     def program_manual(self, values):
+        positions = {}
         for connection, value in values.items():
             device_number = get_device_number(connection)
-            self.controller.move(device_number, int(round(value)))
+            positions[device_number] = int(round(value))
+        self.controller.move_many(positions)
         return self.check_remote_values()
 
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
@@ -0,0 +1,184 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/ZaberStageController/testing/                  #
+#     test_ZaberStageController_move_many.py                        #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of concurrent moves of Zaber stages"""
+import time
+import types
+from collections import namedtuple
+
+import pytest
+
+from labscript_devices.ZaberStageController import blacs_workers
+from labscript_devices.ZaberStageController.blacs_workers import (
+    ERROR,
+    MOVE_ABSOLUTE,
+    MockZaberInterface,
+    ZaberInterface,
+    ZaberWorker,
+)
+
+
+@pytest.fixture
+def mock(monkeypatch):
+    monkeypatch.setattr(MockZaberInterface, 'speed', 10000)
+    return MockZaberInterface('COM1')
+
+
+def test_mock_move_many_moves_concurrently(mock):
+    start = time.monotonic()
+    mock.move_many({1: 2000, 2: -2000, 3: 0})
+    elapsed = time.monotonic() - start
+    assert mock.positions == {1: 2000, 2: -2000, 3: 0}
+    # As long as the longest move, not the sum of them:
+    assert 0.2 <= elapsed < 0.35
+    # Devices already at their targets don't move:
+    start = time.monotonic()
+    mock.move_many({1: 2000, 2: -2000})
+    assert time.monotonic() - start < 0.05
+
+
+def test_worker_program_manual(mock):
+    worker = ZaberWorker.__new__(ZaberWorker)
+    worker.controller = mock
+    worker.child_connections = ['device 1', 'device 2']
+    start = time.monotonic()
+    values = worker.program_manual({'device 1': 2000.4, 'device 2': -2000})
+    assert time.monotonic() - start < 0.35
+    assert values == {'device 1': 2000, 'device 2': -2000}
+
+
+Reply = namedtuple('Reply', ['device_number', 'command_number', 'data'])
+RETURN_CURRENT_POSITION = 60
+
+
+class UnexpectedReplyError(Exception):
+    pass
+
+
+class FakeBinarySerial(object):
+    """Stands in for zaber.serial.BinarySerial. Replies are read in the order they
+    arrive. Each device replies to a position query at once, and to a move when it
+    completes, which takes the given time per device. Devices in `stop_short` stop
+    short of their target, and devices in `errors` reply to a move with the given
+    error code."""
+
+    def __init__(self, move_times, stop_short=(), errors=None):
+        self.move_times = move_times
+        self.stop_short = stop_short
+        self.errors = errors or {}
+        self.positions = {device_number: 0 for device_number in move_times}
+        self.events = []
+        self.replies = []
+
+    def write(self, command):
+        device_number, command_number, data = command
+        now = time.monotonic()
+        if command_number == RETURN_CURRENT_POSITION:
+            self.events.append(('position', device_number))
+            reply = Reply(device_number, command_number, self.positions[device_number])
+            self.replies.append((now, reply))
+        else:
+            assert command_number == MOVE_ABSOLUTE
+            self.events.append(('write', device_number))
+            if device_number in self.errors:
+                reply = Reply(device_number, ERROR, self.errors[device_number])
+            else:
+                if device_number in self.stop_short:
+                    data -= 1
+                reply = Reply(device_number, MOVE_ABSOLUTE, data)
+            due = now + self.move_times[device_number]
+            self.replies.append((due, reply))
+        self.replies.sort()
+
+    def read(self):
+        due, reply = self.replies.pop(0)
+        time.sleep(max(0, due - time.monotonic()))
+        if reply.command_number == MOVE_ABSOLUTE:
+            self.positions[reply.device_number] = reply.data
+            self.events.append(('read', reply.device_number))
+        return reply
+
+
+class FakeBinaryDevice(object):
+    """Stands in for zaber.serial.BinaryDevice, which sends a command and then reads
+    the next reply on the port, raising an exception if it is not from this device"""
+
+    def __init__(self, port, number):
+        self.port = port
+        self.number = number
+
+    def send(self, command_number, data=0):
+        self.port.write((self.number, command_number, data))
+        reply = self.port.read()
+        if reply.device_number != self.number:
+            raise UnexpectedReplyError(reply)
+        return reply
+
+    def get_position(self):
+        return self.send(RETURN_CURRENT_POSITION).data
+
+
+@pytest.fixture
+def fake_zaber(monkeypatch):
+    zaber = types.SimpleNamespace(
+        BinaryCommand=lambda device_number, command_number, data=0: (
+            device_number,
+            command_number,
+            data,
+        ),
+        BinaryDevice=FakeBinaryDevice,
+        TimeoutError=TimeoutError,
+    )
+    monkeypatch.setattr(blacs_workers, 'zaber', zaber, raising=False)
+
+
+def make_interface(port):
+    interface = ZaberInterface.__new__(ZaberInterface)
+    interface.port = port
+    return interface
+
+
+def test_move_many_sends_all_moves_before_waiting(fake_zaber):
+    port = FakeBinarySerial({1: 0.2, 2: 0.15, 3: 0.2})
+    port.positions[3] = 500
+    interface = make_interface(port)
+    start = time.monotonic()
+    interface.move_many({1: 100, 2: 200, 3: 500})
+    assert time.monotonic() - start < 0.35
+    # Positions are all read before any move is sent, and device 3 was already there:
+    assert port.events == [
+        ('position', 1),
+        ('position', 2),
+        ('position', 3),
+        ('write', 1),
+        ('write', 2),
+        ('read', 2),
+        ('read', 1),
+    ]
+    assert port.positions == {1: 100, 2: 200, 3: 500}
+
+
+def test_move_many_fast_move_does_not_confuse_position_query(fake_zaber):
+    # Device 1's move completes before device 2's position could be queried after it:
+    port = FakeBinarySerial({1: 0, 2: 0.1})
+    make_interface(port).move_many({1: 100, 2: 200})
+    assert port.positions == {1: 100, 2: 200}
+
+
+def test_move_many_errors(fake_zaber):
+    interface = make_interface(FakeBinarySerial({1: 0, 2: 0}, stop_short=[2]))
+    with pytest.raises(RuntimeError, match='Device 2 stopped at position 199'):
+        interface.move_many({1: 100, 2: 200})
+    interface = make_interface(FakeBinarySerial({1: 0}, errors={1: 2}))
+    with pytest.raises(RuntimeError, match='Device 1 replied with error code 2'):
+        interface.move_many({1: 100})
@@ -0,0 +1,303 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/shot_prefetch.py                               #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+import os
+import hashlib
+import threading
+
+# importing this wraps zlock calls around HDF file openings and closings:
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+
+
+def table_hash(group, names):
+    """Return a hash of the contents of the named datasets in an HDF5 group.
+
+    Devices' `generate_code` methods save this as a `table_hash` device property, so
+    that their workers can tell that a shot's tables are identical to those they last
+    programmed without reading the tables from the shot file or comparing them.
+
+    Args:
+        group (:obj:`h5py.Group`): Group containing the datasets.
+        names (list): Names of the datasets to include, in a fixed order.
+
+    Returns:
+        str: Hexadecimal digest of the datasets' names, dtypes, shapes and data.
+    """
+    digest = hashlib.sha256()
+    for name in names:
+        data = np.ascontiguousarray(group[name][()])
+        digest.update(name.encode('utf8'))
+        digest.update(repr((data.dtype.descr, data.shape)).encode('utf8'))
+        digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
+def group_key(group):
+    """Return a hash identifying the contents of a device's group in a shot file.
+
+    BLACS modifies shot files after they are compiled, for example to save front panel
+    values, but never a device's group. So data read from the group can be reused for
+    as long as this key is unchanged, however the rest of the file has changed. If the
+    group has a `table_hash` attribute, saved at compile time by :func:`table_hash`,
+    only the group's attributes are hashed. Otherwise its datasets are hashed too.
+
+    Args:
+        group (:obj:`h5py.Group`): The device's group.
+
+    Returns:
+        str: Hexadecimal digest of the group's contents.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(group.attrs):
+        value = np.asarray(group.attrs[name])
+        digest.update(name.encode('utf8'))
+        if value.dtype.kind == 'O':
+            digest.update(repr(value.tolist()).encode('utf8'))
+        else:
+            digest.update(repr((value.dtype.descr, value.shape)).encode('utf8'))
+            digest.update(value.tobytes())
+    if 'table_hash' not in group.attrs:
+        datasets = []
+        group.visititems(
+            lambda name, obj: datasets.append(name)
+            if isinstance(obj, h5py.Dataset)
+            else None
+        )
+        digest.update(table_hash(group, sorted(datasets)).encode('utf8'))
+    return digest.hexdigest()
+
+
+class ShotFilePrefetcher(object):
+    """Reads a device's tables from shot files in background threads, so that reading
+    and decoding them is off the critical path between shots.
+
+    A worker creates one of these in its `init` method, passing it a function that
+    reads (and converts, if required) everything `transition_to_buffered` needs from
+    the shot file. The worker then exposes a `prefetch_shot(h5file)` method calling
+    :meth:`prefetch`, which the device's tab calls for the shot at the front of the
+    BLACS queue (see :func:`prefetch_queued_shots`). `transition_to_buffered` opens
+    the shot file and calls :meth:`get`, which returns the prefetched result if there
+    is one, and otherwise reads the file itself, so that prefetching is always
+    optional.
+
+    A prefetched result is only used if the device's group in the shot file is
+    unchanged since it was read, as determined by :func:`group_key`. `read_tables`
+    must therefore read only data that is fixed at compile time: the device's group,
+    and things like the waits table that BLACS does not modify.
+
+    Args:
+        device_name (str): Name of the device, whose group is checked for changes.
+        read_tables (callable): Function taking an open, read-only
+            :obj:`h5py.File` and returning the device's data in whatever form
+            `transition_to_buffered` requires. It may be called from a background
+            thread, and so must not touch the hardware or mutate worker state.
+        max_pending (int, optional): Number of prefetched shots to keep. The
+            default of two is enough for the shot about to run and the next one.
+    """
+
+    def __init__(self, device_name, read_tables, max_pending=2):
+        self.device_name = device_name
+        self.read_tables = read_tables
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # Pending prefetches, oldest first, as {h5file: (thread, result)}. result is
+        # a dict that the thread fills in with 'key' and 'value' keys on success or an
+        # 'exception' key on failure:
+        self.pending = {}
+
+    def _run(self, h5file, result):
+        try:
+            with h5py.File(h5file, 'r') as hdf5_file:
+                result['key'] = group_key(hdf5_file['devices'][self.device_name])
+                result['value'] = self.read_tables(hdf5_file)
+        except Exception as e:
+            result['exception'] = e
+
+    def prefetch(self, h5file):
+        """Start reading the given shot file in a background thread, unless it is
+        already being read. If more than `max_pending` shots are then pending, the
+        oldest is forgotten."""
+        h5file = os.path.abspath(h5file)
+        with self.lock:
+            if h5file in self.pending:
+                return
+            while len(self.pending) >= self.max_pending:
+                del self.pending[next(iter(self.pending))]
+            result = {}
+            thread = threading.Thread(
+                target=self._run, args=(h5file, result), daemon=True
+            )
+            self.pending[h5file] = (thread, result)
+        thread.start()
+
+    def get(self, hdf5_file):
+        """Return the data for an open shot file, as prefetched if a prefetch of it
+        has completed and the device's group is unchanged since, or otherwise read
+        now. A prefetch still in progress is not waited for, since it may be waiting
+        for the lock on the file that the caller holds. If the prefetch failed the
+        file is read again, so that any error is raised here with a normal
+        traceback."""
+        with self.lock:
+            pending = self.pending.pop(os.path.abspath(hdf5_file.filename), None)
+        if pending is not None:
+            thread, result = pending
+            if not thread.is_alive() and 'value' in result:
+                group = hdf5_file['devices'][self.device_name]
+                if result['key'] == group_key(group):
+                    return result['value']
+        return self.read_tables(hdf5_file)
+
+    def discard(self):
+        """Forget any pending prefetches. Their threads, if still running, are not
+        waited for, and their results are discarded."""
+        with self.lock:
+            self.pending.clear()
+
+
+class QueuedShotPrefetcher(object):
+    """Asks a device tab's worker to prefetch the shot at the front of the BLACS queue
+    whenever that changes, by calling the worker's `prefetch_shot` method. Created by
+    :func:`prefetch_queued_shots`.
+
+    Device tabs are created before the BLACS queue exists, so :meth:`connect` waits
+    for it, checking again every :attr:`retry_interval` milliseconds until it does or
+    until the tab is closed. :meth:`disconnect` stops watching the queue.
+
+    Args:
+        tab (:obj:`DeviceTab`): The device's tab.
+        worker_name (str): Name of the worker with the `prefetch_shot` method.
+    """
+
+    retry_interval = 1000
+
+    def __init__(self, tab, worker_name):
+        from blacs.tab_base_classes import define_state
+        from blacs.tab_base_classes import (
+            MODE_MANUAL,
+            MODE_TRANSITION_TO_MANUAL,
+            MODE_BUFFERED,
+        )
+
+        self.tab = tab
+        self.worker_name = worker_name
+        # The queue's model, once connected to it:
+        self.model = None
+        self.closed = False
+
+        # Queued indefinitely so that a prefetch requested whilst transitioning to
+        # buffered runs once that is done, and with stale states deleted so that a
+        # burst of queue changes results in only one prefetch:
+        @define_state(
+            MODE_MANUAL | MODE_BUFFERED | MODE_TRANSITION_TO_MANUAL, True, True
+        )
+        def prefetch_next_shot(tab, h5file):
+            yield (tab.queue_work(worker_name, 'prefetch_shot', h5file))
+
+        self.prefetch_next_shot = prefetch_next_shot
+
+    @staticmethod
+    def get_queue():
+        """Return the BLACS queue manager, or None if it does not exist (yet)"""
+        import __main__
+
+        return getattr(getattr(__main__, 'app', None), 'queue', None)
+
+    def tab_closed(self):
+        thread = getattr(self.tab, '_mainloop_thread', None)
+        return thread is not None and not thread.is_alive()
+
+    def connect(self):
+        """Start watching the queue, or retry later if it does not exist yet"""
+        from qtutils.qt.QtCore import QTimer
+
+        if self.closed or self.model is not None:
+            return
+        if self.tab_closed():
+            self.disconnect()
+            return
+        queue = self.get_queue()
+        if queue is None:
+            QTimer.singleShot(self.retry_interval, self.connect)
+            return
+        # The QueueManager has no public interface for this:
+        self.model = queue._model
+        self.model.rowsInserted.connect(self.on_queue_changed)
+        self.model.rowsRemoved.connect(self.on_queue_changed)
+        self.model.rowsMoved.connect(self.on_queue_changed)
+        self.on_queue_changed()
+
+    def disconnect(self, *args):
+        """Stop watching the queue. Called with the device name as a restart receiver
+        of the tab."""
+        self.closed = True
+        if self.model is None:
+            return
+        for signal in [
+            self.model.rowsInserted,
+            self.model.rowsRemoved,
+            self.model.rowsMoved,
+        ]:
+            try:
+                signal.disconnect(self.on_queue_changed)
+            except (TypeError, RuntimeError):
+                # Already disconnected, or the model has been deleted:
+                pass
+        self.model = None
+
+    def on_queue_changed(self, *args):
+        from qtutils import inmain_later
+
+        # Called with the queue's model mid-update, so look at it once that is done:
+        inmain_later(self.check_queue)
+
+    def check_queue(self):
+        from blacs.experiment_queue import FILEPATH_COLUMN
+
+        if self.model is None:
+            return
+        if self.tab_closed():
+            self.disconnect()
+            return
+        if self.model.rowCount():
+            h5file = self.model.item(0, FILEPATH_COLUMN).text()
+            self.prefetch_next_shot(self.tab, h5file)
+
+
+def prefetch_queued_shots(tab, worker_name=None):
+    """Have a device tab ask its worker to prefetch the shot at the front of the BLACS
+    queue whenever that changes, by calling the worker's `prefetch_shot` method.
+
+    Device tabs call this from `initialise_workers`, after creating the worker. The
+    queue is watched once BLACS has created it, and no longer once the tab is
+    restarted or closed. When the tab is restarted, it calls this again, replacing
+    the previous :class:`QueuedShotPrefetcher`.
+
+    Args:
+        tab (:obj:`DeviceTab`): The device's tab.
+        worker_name (str, optional): Name of the worker with the `prefetch_shot`
+            method. Defaults to the tab's primary worker.
+
+    Returns:
+        :class:`QueuedShotPrefetcher`: The object watching the queue.
+    """
+    if worker_name is None:
+        worker_name = tab.primary_worker
+    previous = getattr(tab, '_queued_shot_prefetcher', None)
+    if previous is not None:
+        previous.disconnect()
+    prefetcher = QueuedShotPrefetcher(tab, worker_name)
+    tab._queued_shot_prefetcher = prefetcher
+    tab.connect_restart_receiver(prefetcher.disconnect)
+    prefetcher.connect()
+    return prefetcher
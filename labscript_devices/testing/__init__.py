@@ -0,0 +1,14 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/__init__.py                            #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of modules shared between devices, and of single-module devices. Tests of
+devices with their own subpackage are in that subpackage's `testing` folder."""
@@ -0,0 +1,145 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/serial_emulator.py                     #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Emulation of serial devices on pseudoterminals, so that BLACS workers can be tested
+with a real :obj:`serial.Serial` connection but no hardware. POSIX only."""
+import os
+import pty
+import queue
+import select
+import termios
+import threading
+import time
+import tty
+
+
+class SerialEmulator(object):
+    """A serial device, emulated in a thread on the master side of a pseudoterminal.
+    Workers connect to :attr:`port` as if it were the device.
+
+    Subclasses implement :meth:`handle`, which is called with each line received, up
+    to and including :attr:`terminator`, and may call :meth:`read`, :meth:`readline`, :meth:`data_waiting` and :meth:`write`.
+
+    Args:
+        latency (float, optional): Time in seconds to wait before handling each line,
+            as a stand-in for the time a real device takes to process a command.
+        response_delay (float, optional): Time in seconds by which everything
+            written is delayed, without holding up the handling of further lines, as
+            a stand-in for the round trip time of a real connection.
+    """
+
+    terminator = b'\n'
+
+    def __init__(self, latency=0, response_delay=0):
+        self.latency = latency
+        self.response_delay = response_delay
+        self.responses = queue.Queue()
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.buffer = b''
+        self.lines = []
+        self.errors = []
+        self.stopping = False
+        self.thread = threading.Thread(target=self.mainloop, daemon=True)
+        self.thread.start()
+        self.delivery_thread = None
+        if response_delay:
+            self.delivery_thread = threading.Thread(target=self.deliver, daemon=True)
+            self.delivery_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.stopping = True
+        self.thread.join()
+        if self.delivery_thread is not None:
+            self.responses.put(None)
+            self.delivery_thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    @property
+    def baud_rate(self):
+        """The baud rate the connection is currently set to"""
+        speed = termios.tcgetattr(self.slave)[5]
+        for name in dir(termios):
+            if name.startswith('B') and name[1:].isdigit():
+                if getattr(termios, name) == speed:
+                    return int(name[1:])
+
+    def _fill(self, timeout):
+        readable, _, _ = select.select([self.master], [], [], timeout)
+        if readable:
+            self.buffer += os.read(self.master, 65536)
+            return True
+        return False
+
+    def data_waiting(self):
+        """Whether any data has been received that has not yet been read"""
+        return bool(self.buffer) or self._fill(0)
+
+    def read(self, size):
+        """Read exactly `size` bytes, or return None if closed before then"""
+        while len(self.buffer) < size:
+            if self.stopping:
+                return None
+            self._fill(0.05)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, terminator=b'\n'):
+        """Read up to and including the terminator, or return None if closed before
+        then"""
+        while terminator not in self.buffer:
+            if self.stopping:
+                return None
+            self._fill(0.05)
+        index = self.buffer.index(terminator) + len(terminator)
+        line, self.buffer = self.buffer[:index], self.buffer[index:]
+        return line
+
+    def write(self, data):
+        if self.response_delay:
+            self.responses.put((time.monotonic() + self.response_delay, data))
+        else:
+            os.write(self.master, data)
+
+    def deliver(self):
+        while True:
+            response = self.responses.get()
+            if response is None:
+                return
+            due, data = response
+            time.sleep(max(0, due - time.monotonic()))
+            os.write(self.master, data)
+
+    def mainloop(self):
+        while True:
+            line = self.readline(self.terminator)
+            if line is None:
+                return
+            self.lines.append(line)
+            if self.latency:
+                time.sleep(self.latency)
+            try:
+                self.handle(line)
+            except Exception as e:
+                self.errors.append(e)
+
+    def handle(self, line):
+        """Respond to a line received from the worker"""
+        raise NotImplementedError
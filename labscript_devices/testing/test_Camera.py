@@ -0,0 +1,135 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_Camera.py                         #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+import random
+
+import pytest
+from labscript import LabscriptError
+
+from labscript_devices.Camera import Camera
+
+
+class OldCamera(Camera):
+    """Camera with the exposure checks as they were before they used bisection and
+    sets, scanning all exposures of all cameras"""
+
+    def expose(self, name, t, frametype, exposure_time=None):
+        duration = exposure_time
+        already_requested = False
+        for camera in self.trigger_device.child_devices:
+            if camera is not self:
+                for _, other_t, _, other_duration in camera.exposures:
+                    if t == other_t and duration == other_duration:
+                        already_requested = True
+        if not already_requested:
+            self.trigger_device.trigger(t, duration)
+        start = t
+        end = t + duration
+        for exposure in self.exposures:
+            _, other_t, _, other_duration = exposure
+            other_start = other_t
+            other_end = other_t + other_duration
+            if (
+                abs(other_start - end) < self.minimum_recovery_time
+                or abs(other_end - start) < self.minimum_recovery_time
+            ):
+                raise LabscriptError('exposures too close together')
+        self.exposures.append((name, t, frametype, duration))
+        return duration
+
+    def do_checks(self):
+        for camera in self.trigger_device.child_devices:
+            if camera is not self:
+                for exposure in self.exposures:
+                    if exposure not in camera.exposures:
+                        raise LabscriptError('no matching exposure')
+
+
+class FakeTrigger(object):
+    def __init__(self):
+        self.child_devices = []
+        self.triggers = []
+
+    def trigger(self, t, duration):
+        self.triggers.append((t, duration))
+
+
+def make_camera(cls, name, trigger, minimum_recovery_time):
+    """Make a camera without a labscript connection table, with only the attributes
+    expose() and do_checks() need"""
+    camera = cls.__new__(cls)
+    camera.name = name
+    camera.description = 'camera'
+    camera.minimum_recovery_time = minimum_recovery_time
+    camera.exposure_time = None
+    camera.exposures = []
+    camera._exposure_times = set()
+    camera._exposure_starts = []
+    camera._exposure_ends = []
+    camera.trigger_device = trigger
+    trigger.child_devices.append(camera)
+    return camera
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except LabscriptError:
+        return 'error'
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_exposure_checks_match_linear_scan(seed):
+    rng = random.Random(seed)
+    # Times and durations that are exact in binary, so that exposures exactly the
+    # minimum recovery time apart, and exact repeats, are common:
+    minimum_recovery_time = rng.choice([0, 0.25, 0.5, 1.0])
+    n_cameras = rng.choice([1, 2, 3])
+    trigger, old_trigger = FakeTrigger(), FakeTrigger()
+    cameras = [
+        make_camera(Camera, f'camera{i}', trigger, minimum_recovery_time)
+        for i in range(n_cameras)
+    ]
+    old_cameras = [
+        make_camera(OldCamera, f'camera{i}', old_trigger, minimum_recovery_time)
+        for i in range(n_cameras)
+    ]
+    for i in range(200):
+        index = rng.randrange(n_cameras)
+        t = rng.randrange(100) * 0.25
+        duration = rng.choice([0.125, 0.25, 0.5, 1.0])
+        args = (f'exposure{i}', t, 'frame', duration)
+        expected = outcome(old_cameras[index].expose, *args)
+        assert outcome(cameras[index].expose, *args) == expected
+    assert trigger.triggers == old_trigger.triggers
+    for camera, old_camera in zip(cameras, old_cameras):
+        assert camera.exposures == old_camera.exposures
+        assert outcome(camera.do_checks) == outcome(old_camera.do_checks)
+
+
+def test_exposure_checks_shared_trigger():
+    trigger = FakeTrigger()
+    camera0 = make_camera(Camera, 'camera0', trigger, 0.5)
+    camera1 = make_camera(Camera, 'camera1', trigger, 0.5)
+    for camera in [camera0, camera1]:
+        camera.expose('a', 1, 'frame', 0.25)
+        camera.expose('b', 2, 'frame', 0.25)
+    # Each trigger is only requested once for cameras sharing it:
+    assert trigger.triggers == [(1, 0.25), (2, 0.25)]
+    camera0.do_checks()
+    camera1.do_checks()
+
+    with pytest.raises(LabscriptError, match='another at t = 2.000000s for 0.250000s'):
+        camera0.expose('c', 2.5, 'frame', 0.25)
+    camera0.expose('c', 3, 'frame', 0.25)
+    with pytest.raises(LabscriptError, match='share a trigger'):
+        camera0.do_checks()
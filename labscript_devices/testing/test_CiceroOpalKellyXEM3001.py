@@ -0,0 +1,165 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_CiceroOpalKellyXEM3001.py         #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of the CiceroOpalKellyXEM3001 pulse program packing and BLACS worker"""
+import logging
+import os
+import sys
+import types
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+import zprocess
+from labscript_utils.properties import serialise, set_device_properties
+
+from labscript_devices.CiceroOpalKellyXEM3001 import (
+    CiceroOpalKellyXEM3001,
+    CiceroOpalKellyXEM3001Worker,
+    add_instruction_to_bytearray,
+    pulse_program_to_bytearray,
+)
+
+DTYPE = [('on_period', np.int64), ('off_period', np.int64), ('reps', np.int64)]
+
+
+def random_pulse_program(length, seed):
+    rng = np.random.default_rng(seed)
+    pulse_program = np.zeros(length, dtype=DTYPE)
+    # Periods are 6 bytes and reps 4 bytes:
+    pulse_program['on_period'] = rng.integers(0, 2**48, length)
+    pulse_program['off_period'] = rng.integers(0, 2**48, length)
+    pulse_program['reps'] = rng.integers(0, 2**32, length)
+    return pulse_program
+
+
+def old_pulse_program_to_bytearray(pulse_program):
+    """How the worker packed pulse programs before it was vectorised"""
+    data = bytearray(len(pulse_program) * 16)
+    for i, instruction in enumerate(pulse_program):
+        add_instruction_to_bytearray(
+            data,
+            i,
+            instruction['on_period'],
+            instruction['off_period'],
+            instruction['reps'],
+        )
+    return data
+
+
+@pytest.mark.parametrize('length', [0, 1, 2, 100])
+def test_pulse_program_to_bytearray_matches_old_packer(length):
+    pulse_program = random_pulse_program(length, seed=length)
+    data = pulse_program_to_bytearray(pulse_program)
+    assert isinstance(data, bytearray)
+    assert data == old_pulse_program_to_bytearray(pulse_program)
+
+
+def test_pulse_program_to_bytearray_max_instructions():
+    length = CiceroOpalKellyXEM3001.max_instructions
+    pulse_program = random_pulse_program(length, seed=0)
+    # Including the extreme values of each field:
+    pulse_program[0] = (0, 0, 0)
+    pulse_program[1] = (2**48 - 1, 2**48 - 1, 2**32 - 1)
+    pulse_program[2] = (2**47, 2**32, 2**31)
+    data = pulse_program_to_bytearray(pulse_program)
+    assert len(data) == 16 * length
+    assert data == old_pulse_program_to_bytearray(pulse_program)
+
+
+class FakeFrontPanel(object):
+    """Stands in for ok.okCFrontPanel, recording the calls made to it"""
+
+    NoError = 0
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def method(*args):
+            self.calls.append((name,) + args)
+            if name == 'WriteToPipeIn':
+                return len(args[1])
+            if name in ['OpenBySerial', 'ActivateTriggerIn', 'GetWireOutValue']:
+                return 0
+            return True
+
+        return method
+
+    def calls_to(self, name):
+        return [call[1:] for call in self.calls if call[0] == name]
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    ok = types.ModuleType('ok')
+    ok.okCFrontPanel = FakeFrontPanel
+    monkeypatch.setitem(sys.modules, 'ok', ok)
+    monkeypatch.setattr(zprocess, 'Event', lambda *args, **kwargs: None)
+    worker = CiceroOpalKellyXEM3001Worker.__new__(CiceroOpalKellyXEM3001Worker)
+    worker.serial = 'fake'
+    worker.reference_clock = 'internal'
+    worker.logger = logging.getLogger('CiceroOpalKellyXEM3001 test')
+    worker.init()
+    return worker
+
+
+def make_shot(path, pulse_program, trigger_debounce_clock_ticks=10):
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group('cicero')
+        group.create_dataset('PULSE_PROGRAM', data=pulse_program)
+        set_device_properties(f, 'cicero', {'is_master_pseudoclock': True})
+        properties = {
+            'clock_frequency': 100e6,
+            'trigger_debounce_clock_ticks': trigger_debounce_clock_ticks,
+        }
+        connection_table = np.array(
+            [('cicero', serialise(properties))],
+            dtype=[('name', 'S256'), ('properties', 'S4096')],
+        )
+        f.create_dataset('connection table', data=connection_table)
+        waits = f.create_dataset('waits', data=np.zeros(0, dtype=[('time', float)]))
+        waits.attrs['wait_monitor_acquisition_device'] = ''
+        waits.attrs['wait_monitor_timeout_device'] = ''
+    return str(path)
+
+
+def test_smart_programming(worker, tmp_path, monkeypatch):
+    pulse_program = random_pulse_program(100, seed=0)
+    shot = make_shot(tmp_path / 'shot.h5', pulse_program)
+    changed = make_shot(tmp_path / 'changed.h5', pulse_program, 20)
+    for fresh in [True, False, False]:
+        worker.transition_to_buffered('cicero', shot, {}, fresh)
+        worker.transition_to_manual()
+    # The debounce value is set only once, but since each transition aborts the
+    # state machine, the program is uploaded every time:
+    assert worker.dev.calls_to('SetWireInValue') == [(0x01, 10)]
+    expected = old_pulse_program_to_bytearray(pulse_program)
+    assert worker.dev.calls_to('WriteToPipeIn') == 3 * [(0x80, expected)]
+    # A changed debounce value is set, as is an unchanged one when fresh:
+    worker.transition_to_buffered('cicero', changed, {}, False)
+    worker.transition_to_buffered('cicero', changed, {}, True)
+    assert worker.dev.calls_to('SetWireInValue') == [(0x01, 10), (0x01, 20), (0x01, 20)]
+    # And after the FPGA is reflashed, with a stand-in for the bit file:
+    exists = os.path.exists
+    monkeypatch.setattr(os.path, 'exists', lambda p: p.endswith('.bit') or exists(p))
+    worker.flash_FPGA()
+    worker.transition_to_buffered('cicero', changed, {}, False)
+    assert worker.dev.calls_to('SetWireInValue')[-1] == (0x01, 20)
+    assert len(worker.dev.calls_to('SetWireInValue')) == 4
+    # Every upload follows an abort:
+    names = [call[0] for call in worker.dev.calls]
+    for i, name in enumerate(names):
+        if name == 'WriteToPipeIn':
+            aborts = [j for j, n in enumerate(names[:i]) if n == 'ActivateTriggerIn']
+            assert worker.dev.calls[aborts[-1]][1:] == (0x40, 1)
@@ -0,0 +1,202 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_LightCrafterDMD.py                #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of LightCrafterDMD bitmap encoding and the BLACS worker"""
+import logging
+import socket
+import struct
+import threading
+from io import BytesIO
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+from labscript_devices.LightCrafterDMD import (
+    HEIGHT,
+    WIDTH,
+    LightCrafterWorker,
+    arr_to_bmp,
+)
+
+
+def old_arr_to_bmp(arr):
+    """How arrays were converted to BMPs before the conversion used NumPy"""
+    import PIL.Image
+
+    binary_arr = 255 * (arr != 0).astype(np.uint8)
+    im = PIL.Image.fromarray(binary_arr, mode='L').convert('1')
+    f = BytesIO()
+    im.save(f, "BMP")
+    return f.getvalue()
+
+
+@pytest.mark.parametrize(
+    'shape', [(HEIGHT, WIDTH), (1, 1), (3, 7), (5, 8), (2, 31), (4, 32), (6, 33), (9, 100)]
+)
+@pytest.mark.parametrize('dtype', [np.uint8, bool, np.int32, float])
+def test_arr_to_bmp_matches_pil(shape, dtype):
+    pytest.importorskip('PIL')
+    rng = np.random.default_rng(0)
+    # Random values, including some not 0 or 1:
+    arr = rng.integers(-1, 3, shape).astype(dtype)
+    assert arr_to_bmp(arr) == old_arr_to_bmp(arr)
+
+
+def test_arr_to_bmp_all_black_and_all_white():
+    pytest.importorskip('PIL')
+    for value in [0, 1]:
+        arr = np.full((HEIGHT, WIDTH), value, dtype=np.uint8)
+        assert arr_to_bmp(arr) == old_arr_to_bmp(arr)
+
+
+class LightCrafterEmulator(object):
+    """Responds to packets as a LightCrafter does, over TCP on localhost, recording the
+    (command, data) of each packet received. Replies 'System Busy' to the first
+    busy[command] packets of each command, and doesn't reply at all to commands in
+    silent"""
+
+    def __init__(self, busy=None, silent=()):
+        self.busy = dict(busy or {})
+        self.silent = set(silent)
+        self.packets = []
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.server = '127.0.0.1:%d' % self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.mainloop, daemon=True)
+        self.thread.start()
+
+    def recv_exactly(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def mainloop(self):
+        conn, _ = self.listener.accept()
+        with conn:
+            while True:
+                header = self.recv_exactly(conn, 6)
+                if header is None:
+                    return
+                length = struct.unpack('<H', header[4:6])[0]
+                body = self.recv_exactly(conn, length + 1)
+                command, data = header[1:3], body[:-1]
+                assert body[-1] == sum(header + data) % 256
+                self.packets.append((command, data))
+                if command in self.silent:
+                    continue
+                if self.busy.get(command):
+                    self.busy[command] -= 1
+                    self.reply(conn, b'\x00', command)
+                else:
+                    self.reply(conn, b'\x03', command)
+
+    def reply(self, conn, packet_type, command):
+        packet = packet_type + command + b'\x00' + struct.pack('<H', 0)
+        conn.sendall(packet + bytes([sum(packet) % 256]))
+
+    def commands(self):
+        return [command for command, _ in self.packets]
+
+    def close(self):
+        self.listener.close()
+
+
+def make_worker(emulator, **attributes):
+    worker = LightCrafterWorker.__new__(LightCrafterWorker)
+    worker.server = emulator.server
+    worker.logger = logging.getLogger('LightCrafterDMD test')
+    worker.busy_initial_delay = 0.001
+    for name, value in attributes.items():
+        setattr(worker, name, value)
+    worker.init()
+    return worker
+
+
+def make_shot(path, arrays):
+    images = [arr_to_bmp(arr) for arr in arrays]
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group('dmd')
+        distinct = sorted(set(images), key=images.index)
+        group.create_dataset('PATTERN_TABLE', data=np.void(np.array(distinct)))
+        group.create_dataset(
+            'PATTERN_INDICES', data=np.array([distinct.index(i) for i in images])
+        )
+    return str(path)
+
+
+def test_busy_packets_are_sent_again():
+    display_mode = LightCrafterWorker.command['display_mode']
+    emulator = LightCrafterEmulator(busy={display_mode: 3})
+    worker = make_worker(emulator)
+    # The packet was sent again after each busy response, until it was processed:
+    assert emulator.commands() == 4 * [display_mode]
+    assert len(set(emulator.packets)) == 1
+    worker.shutdown()
+    emulator.close()
+
+
+def test_busy_retries_run_out():
+    display_mode = LightCrafterWorker.command['display_mode']
+    emulator = LightCrafterEmulator(busy={display_mode: 10})
+    with pytest.raises(Exception, match='still busy after 3 retries of command 0x0101'):
+        make_worker(emulator, busy_retries=3)
+    assert emulator.commands() == 4 * [display_mode]
+    emulator.close()
+
+
+def test_no_response_times_out():
+    display_mode = LightCrafterWorker.command['display_mode']
+    emulator = LightCrafterEmulator(silent=[display_mode])
+    with pytest.raises(Exception, match='No response from device'):
+        make_worker(emulator, timeout=0.1)
+    emulator.close()
+
+
+def test_only_changed_patterns_are_uploaded(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = [rng.integers(0, 2, (HEIGHT, WIDTH)) for _ in range(5)]
+    first = make_shot(tmp_path / 'first.h5', arrays + [arrays[0]])
+    changed = make_shot(tmp_path / 'changed.h5', arrays[:2] + arrays[3:] + [arrays[0]] * 2)
+    pattern_definition = LightCrafterWorker.command['pattern_definition']
+    emulator = LightCrafterEmulator()
+    worker = make_worker(emulator)
+
+    def uploaded_slots(shot, fresh):
+        num_packets = len(emulator.packets)
+        worker.transition_to_buffered('dmd', shot, {}, fresh)
+        return [
+            data[0]
+            for command, data in emulator.packets[num_packets:]
+            if command == pattern_definition
+        ]
+
+    # Six patterns, padded to eight with the last one:
+    assert uploaded_slots(first, True) == list(range(8))
+    assert uploaded_slots(first, False) == []
+    # Slots 2, 3 and 4 have changed:
+    assert uploaded_slots(changed, False) == [2, 3, 4]
+    assert uploaded_slots(changed, True) == list(range(8))
+    # The patterns are uploaded intact:
+    num_packets = len(emulator.packets)
+    uploaded_slots(first, True)
+    uploaded = [
+        data[1:] for command, data in emulator.packets[num_packets:]
+        if command == pattern_definition
+    ]
+    assert uploaded[:6] == [arr_to_bmp(arr) for arr in arrays + [arrays[0]]]
+    worker.shutdown()
+    emulator.close()
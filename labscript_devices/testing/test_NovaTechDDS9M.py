@@ -0,0 +1,398 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_NovaTechDDS9M.py                  #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of the NovaTechDDS9M BLACS worker against an emulated device"""
+import logging
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('pty')
+pytest.importorskip('serial')
+
+from labscript_devices.testing.serial_emulator import SerialEmulator
+from labscript_devices.NovaTechDDS9M import NovatechDDS9mWorker, bauds
+from labscript_devices.shot_prefetch import table_hash
+
+DEVICE = 'novatech'
+TABLE_DTYPE = (
+    [('freq%d' % i, np.uint32) for i in range(2)]
+    + [('phase%d' % i, np.uint16) for i in range(2)]
+    + [('amp%d' % i, np.uint16) for i in range(2)]
+)
+STATIC_DTYPE = (
+    [('freq%d' % i, np.uint32) for i in range(2, 4)]
+    + [('phase%d' % i, np.uint16) for i in range(2, 4)]
+    + [('amp%d' % i, np.uint16) for i in range(2, 4)]
+)
+
+
+class NovaTechEmulator(SerialEmulator):
+    """Responds to commands as a NovaTech DDS9m does, recording the table and the
+    commands received. Lines received at a baud rate other than the device's are
+    ignored, and switching to a rate above `max_rate` is rejected, as a stand-in for
+    a connection that is unreliable at high rates. Each table command whose line
+    number is in `fail_once` is rejected the first time it is received."""
+
+    def __init__(self, rate=115200, max_rate=None, fail_once=(), **kwargs):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.fail_once = set(fail_once)
+        self.table = {}
+        self.commands = []
+        super().__init__(**kwargs)
+
+    def handle(self, line):
+        if self.baud_rate != self.rate:
+            return
+        command = line.decode().strip()
+        self.commands.append(command)
+        if command in [b.decode() for b in bauds.values()]:
+            rate = {b.decode(): rate for rate, b in bauds.items()}[command]
+            if self.max_rate is not None and rate > self.max_rate:
+                self.write(b'?0\r\n')
+                return
+            self.write(b'OK\r\n')
+            self.rate = rate
+        elif command.startswith('t'):
+            channel, rest = command[1:].split(' ', 1)
+            address, values = rest.split(' ')
+            address = int(address, 16)
+            if address in self.fail_once:
+                self.fail_once.remove(address)
+                self.write(b'?1\r\n')
+                return
+            freq, phase, amp, _ = values.split(',')
+            self.table[int(channel), address] = (
+                int(freq, 16),
+                int(phase, 16),
+                int(amp, 16),
+            )
+            self.write(b'OK\r\n')
+        elif command == 'QUE':
+            for _ in range(4):
+                self.write(b'0000000 0000 0000 00 00 00 00\r\n')
+            self.write(b'\r\n')
+        else:
+            self.write(b'OK\r\n')
+
+    def table_array(self, length):
+        """The table programmed into the device, as a table data array"""
+        table = np.zeros(length, dtype=TABLE_DTYPE)
+        for (channel, address), (freq, phase, amp) in self.table.items():
+            if address < length:
+                table[address]['freq%d' % channel] = freq
+                table[address]['phase%d' % channel] = phase
+                table[address]['amp%d' % channel] = amp
+        return table
+
+
+def make_worker(emulator, baud_rate=115200, default_baud_rate=None, upload_window=16):
+    worker = NovatechDDS9mWorker.__new__(NovatechDDS9mWorker)
+    worker.device_name = DEVICE
+    worker.com_port = emulator.port
+    worker.baud_rate = baud_rate
+    worker.default_baud_rate = default_baud_rate
+    worker.update_mode = 'synchronous'
+    worker.phase_mode = 'continuous'
+    worker.upload_window = upload_window
+    worker.logger = logging.getLogger('NovaTechDDS9M test')
+    worker.init()
+    return worker
+
+
+def random_table(length, seed):
+    rng = np.random.default_rng(seed)
+    table = np.zeros(length, dtype=TABLE_DTYPE)
+    for i in range(2):
+        # Frequencies up to 171 MHz in units of 0.1 Hz, 14 bit phases and 10 bit
+        # amplitudes:
+        table['freq%d' % i] = rng.integers(0, 1710000000, length)
+        table['phase%d' % i] = rng.integers(0, 2**14, length)
+        table['amp%d' % i] = rng.integers(0, 2**10, length)
+    return table
+
+
+def make_shot(path, table_data, static_data=None, with_hash=False):
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group(DEVICE)
+        group.create_dataset('TABLE_DATA', data=table_data)
+        if static_data is None:
+            static_data = np.zeros(1, dtype=STATIC_DTYPE)
+        group.create_dataset('STATIC_DATA', data=static_data)
+        if with_hash:
+            group.attrs['table_hash'] = table_hash(group, ['TABLE_DATA'])
+    return str(path)
+
+
+def old_table_commands(data, oldtable, fresh):
+    """The table commands sent by the worker before table diffing was vectorised"""
+    commands = []
+    for i, line in enumerate(data):
+        for ddsno in range(2):
+            if (
+                fresh
+                or i >= len(oldtable)
+                or (
+                    line['freq%d' % ddsno],
+                    line['phase%d' % ddsno],
+                    line['amp%d' % ddsno],
+                )
+                != (
+                    oldtable[i]['freq%d' % ddsno],
+                    oldtable[i]['phase%d' % ddsno],
+                    oldtable[i]['amp%d' % ddsno],
+                )
+            ):
+                commands.append(
+                    b't%d %04x %08x,%04x,%04x,ff\r\n'
+                    % (
+                        ddsno,
+                        i,
+                        line['freq%d' % ddsno],
+                        line['phase%d' % ddsno],
+                        line['amp%d' % ddsno],
+                    )
+                )
+    return commands
+
+
+@pytest.mark.parametrize('fresh', [False, True])
+@pytest.mark.parametrize('old_length', [0, 50, 100, 150])
+def test_table_commands_match_old_implementation(fresh, old_length):
+    worker = NovatechDDS9mWorker.__new__(NovatechDDS9mWorker)
+    data = random_table(100, seed=0)
+    oldtable = random_table(old_length, seed=1) if old_length else ''
+    if old_length:
+        # Make some lines of each channel the same as the new table:
+        n = min(old_length, len(data))
+        oldtable[:n:3] = data[:n:3]
+        oldtable['freq0'][1:n:5] = data['freq0'][1:n:5]
+        oldtable['phase0'][1:n:5] = data['phase0'][1:n:5]
+        oldtable['amp0'][1:n:5] = data['amp0'][1:n:5]
+    commands = worker.table_commands(data, oldtable, fresh)
+    assert commands == old_table_commands(data, oldtable, fresh)
+
+
+@pytest.mark.parametrize('upload_window', [1, 16])
+def test_table_upload(tmp_path, upload_window):
+    first = random_table(100, seed=0)
+    second = first.copy()
+    second[[3, 50, 99]] = random_table(3, seed=1)
+    with NovaTechEmulator() as emulator:
+        worker = make_worker(emulator, upload_window=upload_window)
+        worker.transition_to_buffered(
+            DEVICE, make_shot(tmp_path / 'first.h5', first), {}, True
+        )
+        np.testing.assert_array_equal(emulator.table_array(100), first)
+        num_commands = len(emulator.commands)
+        # Only changed lines are programmed in the next shot:
+        worker.transition_to_buffered(
+            DEVICE, make_shot(tmp_path / 'second.h5', second), {}, False
+        )
+        np.testing.assert_array_equal(emulator.table_array(100), second)
+        table_commands = [c for c in emulator.commands[num_commands:] if c[0] == 't']
+        assert len(table_commands) == 6
+        worker.shutdown()
+    assert not emulator.errors
+
+
+def test_failed_table_upload_is_retried_in_lockstep(tmp_path):
+    table = random_table(100, seed=0)
+    with NovaTechEmulator(fail_once=[10]) as emulator:
+        worker = make_worker(emulator)
+        worker.transition_to_buffered(
+            DEVICE, make_shot(tmp_path / 'shot.h5', table), {}, True
+        )
+        np.testing.assert_array_equal(emulator.table_array(100), table)
+        np.testing.assert_array_equal(worker.smart_cache['TABLE_DATA'], table)
+        worker.shutdown()
+    assert not emulator.errors
+
+
+def test_failure_during_lockstep_retry_raises(tmp_path):
+    table = random_table(100, seed=0)
+    with NovaTechEmulator(fail_once=[10, 60]) as emulator:
+        worker = make_worker(emulator)
+        with pytest.raises(Exception, match='t0 003c'):
+            worker.transition_to_buffered(
+                DEVICE, make_shot(tmp_path / 'shot.h5', table), {}, True
+            )
+        # The smart cache does not claim that the failed table was programmed:
+        assert worker.smart_cache['TABLE_DATA'] == ''
+        assert worker.smart_cache['table_hash'] is None
+        worker.shutdown()
+    assert not emulator.errors
+
+
+
+@pytest.fixture
+def dataset_reads(monkeypatch):
+    """The names of the datasets read from shot files"""
+    reads = []
+    getitem = h5py.Dataset.__getitem__
+
+    def __getitem__(self, *args, **kwargs):
+        reads.append(self.name)
+        return getitem(self, *args, **kwargs)
+
+    monkeypatch.setattr(h5py.Dataset, '__getitem__', __getitem__)
+    return reads
+
+
+def test_unchanged_table_is_not_read_or_programmed(tmp_path, dataset_reads):
+    table = random_table(100, seed=0)
+    changed_table = table.copy()
+    changed_table[[3, 50]] = random_table(2, seed=1)
+    shot = make_shot(tmp_path / 'shot.h5', table, with_hash=True)
+    same = make_shot(tmp_path / 'same.h5', table, with_hash=True)
+    changed = make_shot(tmp_path / 'changed.h5', changed_table, with_hash=True)
+    table_path = '/devices/%s/TABLE_DATA' % DEVICE
+
+    def run(h5file, fresh=False):
+        num_commands = len(emulator.commands)
+        del dataset_reads[:]
+        final_values = worker.transition_to_buffered(DEVICE, h5file, {}, fresh)
+        table_commands = [c for c in emulator.commands[num_commands:] if c[0] == 't']
+        return final_values, table_commands, table_path in dataset_reads
+
+    with NovaTechEmulator() as emulator:
+        worker = make_worker(emulator)
+        final_values, table_commands, table_read = run(shot, fresh=True)
+        assert table_read
+        assert len(table_commands) == 200
+
+        # A different shot file with the same table is neither read nor programmed:
+        cached_final_values, table_commands, table_read = run(same)
+        assert not table_read
+        assert table_commands == []
+        assert cached_final_values == final_values
+
+        # A changed table is read, and its changed lines programmed:
+        _, table_commands, table_read = run(changed)
+        assert table_read
+        assert len(table_commands) == 4
+        np.testing.assert_array_equal(emulator.table_array(100), changed_table)
+
+        # Including when changing back:
+        _, table_commands, table_read = run(same)
+        assert table_read
+        assert len(table_commands) == 4
+        np.testing.assert_array_equal(emulator.table_array(100), table)
+
+        # A fresh shot with the hash of the table on the device reprograms every line
+        # of it without reading it:
+        _, table_commands, table_read = run(same, fresh=True)
+        assert not table_read
+        assert len(table_commands) == 200
+        np.testing.assert_array_equal(emulator.table_array(100), table)
+        worker.shutdown()
+    assert not emulator.errors
+
+
+def static_table(freq2, amp3):
+    static_data = np.zeros(1, dtype=STATIC_DTYPE)
+    static_data['freq2'] = freq2
+    static_data['freq3'] = 1
+    static_data['amp3'] = amp3
+    return static_data
+
+
+def run_shot(worker, emulator, path, fresh=False):
+    """Run a shot through transition_to_buffered and transition_to_manual, and return
+    the commands sent in each"""
+    initial_values = {
+        'channel %d' % i: {'freq': 1e6, 'amp': 0.5, 'phase': 0} for i in range(4)
+    }
+    num_commands = len(emulator.commands)
+    worker.transition_to_buffered(DEVICE, path, initial_values, fresh)
+    buffered_commands = emulator.commands[num_commands:]
+    num_commands = len(emulator.commands)
+    worker.transition_to_manual()
+    return buffered_commands, emulator.commands[num_commands:]
+
+
+def static_commands(commands):
+    return sorted(c for c in commands if c[0] in 'FVP')
+
+
+def test_unchanged_static_commands_are_skipped(tmp_path):
+    table = random_table(10, seed=0)
+    first = make_shot(tmp_path / 'first.h5', table, static_table(1000, 500))
+    changed = make_shot(tmp_path / 'changed.h5', table, static_table(1000, 600))
+    all_static_commands = [
+        'F2 0.0001000', 'F3 0.0000001', 'P2 0', 'P3 0', 'V2 0', 'V3 500'
+    ]
+    with NovaTechEmulator() as emulator:
+        worker = make_worker(emulator)
+        commands, _ = run_shot(worker, emulator, first, fresh=True)
+        assert static_commands(commands) == all_static_commands
+        # The same static values again are not sent:
+        commands, _ = run_shot(worker, emulator, first)
+        assert static_commands(commands) == []
+        # Only the changed value is sent:
+        commands, _ = run_shot(worker, emulator, changed)
+        assert static_commands(commands) == ['V3 600']
+        # Everything is sent again on fresh programming:
+        commands, _ = run_shot(worker, emulator, first, fresh=True)
+        assert static_commands(commands) == all_static_commands
+        # And after an abort, which sets the static channels to their initial values,
+        # those that differ from the shot's are sent:
+        worker.transition_to_buffered(DEVICE, first, worker.initial_values, False)
+        worker.abort_buffered()
+        commands, _ = run_shot(worker, emulator, first)
+        assert static_commands(commands) == ['F2 0.0001000', 'F3 0.0000001', 'V2 0', 'V3 500']
+        worker.shutdown()
+    assert not emulator.errors
+
+
+def test_mode_commands(tmp_path):
+    shot = make_shot(tmp_path / 'shot.h5', random_table(10, seed=0), static_table(1000, 500))
+    with NovaTechEmulator() as emulator:
+        worker = make_worker(emulator)
+        for fresh in [True, False]:
+            buffered_commands, manual_commands = run_shot(worker, emulator, shot, fresh)
+            # The double clutch is always sent, then table mode for the shot:
+            assert [c for c in buffered_commands if c[0] in 'mI'] == [
+                'm t', 'm 0', 'm t', 'I e'
+            ]
+            # And back to manual mode after it:
+            assert [c for c in manual_commands if c[0] in 'mI'] == ['m 0', 'I a']
+        # Manual mode is not set again when the device is known to be in it:
+        num_commands = len(emulator.commands)
+        worker.transition_to_manual()
+        assert not [c for c in emulator.commands[num_commands:] if c[0] in 'mI']
+        # But is after an abort, since the mode is then unknown:
+        worker.transition_to_buffered(DEVICE, shot, worker.initial_values, False)
+        num_commands = len(emulator.commands)
+        worker.abort_buffered()
+        assert [c for c in emulator.commands[num_commands:] if c[0] in 'mI'] == [
+            'm 0', 'I a'
+        ]
+        worker.shutdown()
+    assert not emulator.errors
+
+
+@pytest.mark.parametrize('default_baud_rate', [None, 19200])
+def test_auto_baud_rate_falls_back_to_fastest_reliable_rate(default_baud_rate):
+    # The device starts at its factory default rate, and rejects switching to 115200:
+    with NovaTechEmulator(rate=19200, max_rate=57600) as emulator:
+        worker = make_worker(
+            emulator, baud_rate='auto', default_baud_rate=default_baud_rate
+        )
+        assert worker.connection.baudrate == 57600
+        assert emulator.rate == 57600
+        assert emulator.baud_rate == 57600
+        worker.shutdown()
+    assert not emulator.errors
@@ -0,0 +1,132 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_PhaseMatrixQuickSyn.py            #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of the PhaseMatrixQuickSyn BLACS worker against an emulated device"""
+import logging
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('pty')
+pytest.importorskip('serial')
+
+from labscript_devices.testing.serial_emulator import SerialEmulator
+from labscript_devices.PhaseMatrixQuickSyn import QuickSynWorker
+
+DEVICE = 'quicksyn'
+
+
+class QuickSynEmulator(SerialEmulator):
+    """Responds to commands as a QuickSyn does, reporting its frequency in mHz with
+    three decimal places, and recording the commands received"""
+
+    terminator = b'\r'
+
+    def __init__(self, **kwargs):
+        self.freq = 1000000000000
+        self.gate = 0
+        self.commands = []
+        super().__init__(**kwargs)
+
+    def handle(self, line):
+        command = line.decode().strip()
+        self.commands.append(command)
+        if command == 'ROSC:SOUR?':
+            self.write(b'EXT\n')
+        elif command == 'FREQ?':
+            self.write(b'%.3f\n' % self.freq)
+        elif command == 'OUTP:STAT?':
+            self.write(b'ON\n' if self.gate else b'OFF\n')
+        elif command.startswith('FREQ '):
+            self.freq = int(command.split()[1])
+        elif command.startswith('OUTP:STAT '):
+            self.gate = int(command.split()[1])
+        else:
+            raise ValueError(command)
+
+    def set_commands(self):
+        return [c for c in self.commands if '?' not in c]
+
+
+def make_worker(emulator):
+    worker = QuickSynWorker.__new__(QuickSynWorker)
+    worker.device_name = DEVICE
+    worker.address = emulator.port
+    worker.logger = logging.getLogger('PhaseMatrixQuickSyn test')
+    worker.init()
+    return worker
+
+
+def front_panel_values(freq, gate):
+    return {'dds 0': {'freq': freq, 'gate': gate}}
+
+
+def test_unchanged_values_are_not_reprogrammed():
+    # A frequency in Hz that is not an exact number of mHz in floating point:
+    freq = 4000000000.001
+    with QuickSynEmulator() as emulator:
+        worker = make_worker(emulator)
+        results = worker.program_manual(front_panel_values(freq, 1))
+        assert emulator.set_commands() == ['FREQ 4000000000001', 'OUTP:STAT 1']
+        assert results == front_panel_values(4000000000.001, 1)
+        # The cache and the requested value compare equal as integer mHz:
+        results = worker.program_manual(front_panel_values(freq, 1))
+        assert emulator.set_commands() == ['FREQ 4000000000001', 'OUTP:STAT 1']
+        assert results == front_panel_values(4000000000.001, 1)
+        # As do the values in a shot file:
+        worker.program_freq(np.uint64(4000000000001))
+        assert emulator.set_commands() == ['FREQ 4000000000001', 'OUTP:STAT 1']
+        worker.program_manual(front_panel_values(5e9, 1))
+        assert emulator.set_commands()[2:] == ['FREQ 5000000000000']
+        worker.shutdown()
+    assert not emulator.errors
+
+
+def test_program_manual_reads_back_from_device():
+    with QuickSynEmulator() as emulator:
+        worker = make_worker(emulator)
+        worker.program_manual(front_panel_values(5e9, 1))
+        # A change not made by the worker is reported:
+        emulator.freq = 6000000000000
+        emulator.gate = 0
+        results = worker.program_manual(front_panel_values(5e9, 1))
+        assert results == front_panel_values(6e9, 0)
+        # And corrected the next time the values are programmed:
+        results = worker.program_manual(front_panel_values(5e9, 1))
+        assert results == front_panel_values(5e9, 1)
+        worker.shutdown()
+    assert not emulator.errors
+
+
+def test_transition_to_buffered(tmp_path):
+    static_data = np.zeros(1, dtype=[('freq0', np.uint64), ('gate0', np.uint16)])
+    static_data['freq0'] = 7000000000000
+    static_data['gate0'] = 1
+    path = str(tmp_path / 'shot.h5')
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group(DEVICE)
+        group.create_dataset('STATIC_DATA', data=static_data)
+    with QuickSynEmulator() as emulator:
+        worker = make_worker(emulator)
+        for fresh in [True, False, True]:
+            final_values = worker.transition_to_buffered(DEVICE, path, {}, fresh)
+            assert final_values == front_panel_values(7e9, 1)
+            worker.transition_to_manual()
+        # Programmed once, and again only when fresh:
+        assert emulator.set_commands() == [
+            'FREQ 7000000000000', 'OUTP:STAT 1', 'FREQ 7000000000000', 'OUTP:STAT 1'
+        ]
+        assert emulator.freq == 7000000000000
+        worker.shutdown()
+    assert not emulator.errors
@@ -0,0 +1,151 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_PineBlaster.py                    #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of windowed uploads to an emulated PineBlaster"""
+import logging
+import time
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('pty')
+serial = pytest.importorskip('serial')
+
+import labscript_utils.properties
+from labscript_devices.testing.serial_emulator import SerialEmulator
+from labscript_devices.PineBlaster import PineblasterWorker
+
+RESPONSE_DELAY = 0.005
+
+
+class PineBlasterEmulator(SerialEmulator):
+    """Programs `set` commands into memory, failing once for each index in
+    `fail_once`"""
+
+    def __init__(self, fail_once=(), **kwargs):
+        self.memory = {}
+        self.fail_once = fail_once if isinstance(fail_once, set) else set(fail_once)
+        super().__init__(**kwargs)
+
+    def handle(self, line):
+        command, *args = line.decode().split()
+        if command == 'go':
+            self.write(b'ok\r\n')
+        elif command == 'set':
+            index, period, reps = map(int, args)
+            if index in self.fail_once:
+                self.fail_once.remove(index)
+                self.write(b'invalid request\r\n')
+                return
+            self.memory[index] = (period, reps)
+            self.write(b'ok\r\n')
+        else:
+            self.errors.append('unexpected command %r' % line)
+
+
+class FailAlways(set):
+    """For PineBlasterEmulator.fail_once, to fail every time instead"""
+
+    def remove(self, item):
+        pass
+
+
+def make_program(num_instructions, seed=0):
+    rng = np.random.default_rng(seed)
+    pulse_program = np.zeros(num_instructions, dtype=[('period', int), ('reps', int)])
+    pulse_program['period'] = rng.integers(1, 1000, num_instructions)
+    pulse_program['reps'] = rng.integers(1, 1000, num_instructions)
+    return pulse_program
+
+
+def make_shot(path, pulse_program):
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group('pineblaster')
+        group.create_dataset('PULSE_PROGRAM', data=pulse_program)
+        labscript_utils.properties.set_device_properties(
+            f, 'pineblaster', {'is_master_pseudoclock': True}
+        )
+
+
+def make_worker(emulator, upload_window):
+    worker = PineblasterWorker.__new__(PineblasterWorker)
+    worker.pineblaster = serial.Serial(emulator.port, 115200, timeout=1)
+    worker.upload_window = upload_window
+    worker.smart_cache = []
+    worker.logger = logging.getLogger('PineBlaster test')
+    return worker
+
+
+def upload(path, pulse_program, upload_window, fresh=True, **kwargs):
+    """Run transition_to_buffered with the given program. Return the emulator and the
+    time taken"""
+    make_shot(path, pulse_program)
+    with PineBlasterEmulator(response_delay=RESPONSE_DELAY, **kwargs) as emulator:
+        worker = make_worker(emulator, upload_window)
+        start_time = time.perf_counter()
+        worker.transition_to_buffered('pineblaster', str(path), {}, fresh)
+        duration = time.perf_counter() - start_time
+        worker.shutdown()
+    assert not emulator.errors
+    return emulator, worker, duration
+
+
+def check_programmed(emulator, worker, pulse_program):
+    assert emulator.memory == {
+        i: (instruction['period'], instruction['reps'])
+        for i, instruction in enumerate(pulse_program)
+    }
+    assert worker.smart_cache == list(pulse_program)
+
+
+@pytest.mark.parametrize('upload_window', [1, 8])
+def test_upload(tmp_path, upload_window):
+    pulse_program = make_program(50)
+    emulator, worker, _ = upload(tmp_path / 'shot.h5', pulse_program, upload_window)
+    check_programmed(emulator, worker, pulse_program)
+
+
+def test_windowed_upload_is_faster(tmp_path):
+    pulse_program = make_program(100)
+    _, _, lockstep = upload(tmp_path / 'shot.h5', pulse_program, 1)
+    _, _, windowed = upload(tmp_path / 'shot.h5', pulse_program, 8)
+    print('lockstep: %.0f ms, windowed: %.0f ms' % (1e3 * lockstep, 1e3 * windowed))
+    # Lockstep takes at least one response delay per instruction:
+    assert lockstep > len(pulse_program) * RESPONSE_DELAY
+    assert windowed < lockstep / 3
+
+
+@pytest.mark.parametrize('failing_index', [0, 7, 20, 49])
+def test_failed_upload_is_retried_in_lockstep(tmp_path, failing_index):
+    pulse_program = make_program(50)
+    emulator, worker, _ = upload(
+        tmp_path / 'shot.h5', pulse_program, 8, fail_once=[failing_index]
+    )
+    check_programmed(emulator, worker, pulse_program)
+    # One go low, then the window, then a lockstep retry of every instruction from
+    # the failed one on:
+    num_set_commands = len(emulator.lines) - 1
+    assert num_set_commands <= len(pulse_program) + 8 + 1
+
+
+def test_failure_during_retry_raises(tmp_path):
+    pulse_program = make_program(20)
+    make_shot(tmp_path / 'shot.h5', pulse_program)
+    with PineBlasterEmulator(fail_once=FailAlways([5])) as emulator:
+        worker = make_worker(emulator, 8)
+        with pytest.raises(AssertionError, match='invalid request'):
+            worker.transition_to_buffered(
+                'pineblaster', str(tmp_path / 'shot.h5'), {}, True
+            )
+        worker.shutdown()
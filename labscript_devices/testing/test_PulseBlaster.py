@@ -0,0 +1,232 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_PulseBlaster.py                   #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of the PulseBlaster BLACS worker's smart programming against a fake spinapi"""
+import logging
+import sys
+import types
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+import zprocess
+
+from labscript_devices.PulseBlaster import PulseBlaster, PulseblasterWorker
+from labscript_devices.shot_prefetch import table_hash
+
+DEVICE = 'pulseblaster'
+PB_DTYPE = [
+    ('freq0', np.int32), ('phase0', np.int32), ('amp0', np.int32),
+    ('dds_en0', np.int32), ('phase_reset0', np.int32),
+    ('freq1', np.int32), ('phase1', np.int32), ('amp1', np.int32),
+    ('dds_en1', np.int32), ('phase_reset1', np.int32),
+    ('flags', np.int32), ('inst', np.int32),
+    ('inst_data', np.int32), ('length', np.float64),
+]
+TABLES = [
+    'DDS%d/%s' % (i, regs)
+    for i in range(2)
+    for regs in ['FREQ_REGS', 'AMP_REGS', 'PHASE_REGS']
+] + ['PULSE_PROGRAM']
+
+
+class FakeSpinapi(types.ModuleType):
+    """Stand-in for the spinapi module, recording the calls made to it"""
+
+    PULSE_PROGRAM = 0
+    CONTINUE = PulseBlaster.pb_instructions['CONTINUE']
+    STOP = PulseBlaster.pb_instructions['STOP']
+    BRANCH = PulseBlaster.pb_instructions['BRANCH']
+    WAIT = PulseBlaster.pb_instructions['WAIT']
+
+    FUNCTIONS = [
+        'pb_select_board', 'pb_init', 'pb_core_clock', 'pb_start', 'pb_stop',
+        'pb_reset', 'pb_close', 'pb_select_dds', 'program_amp_regs',
+        'program_freq_regs', 'program_phase_regs', 'pb_start_programming',
+        'pb_inst_dds2', 'pb_stop_programming',
+    ]
+
+    def __init__(self):
+        super().__init__('spinapi')
+        self.calls = []
+        for name in self.FUNCTIONS:
+            setattr(self, name, self._recorder(name))
+        self.pb_read_status = lambda: {'waiting': True, 'stopped': False}
+        self.__all__ = self.FUNCTIONS + [
+            'pb_read_status', 'PULSE_PROGRAM', 'CONTINUE', 'STOP', 'BRANCH', 'WAIT'
+        ]
+
+    def _recorder(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args))
+        return record
+
+
+@pytest.fixture
+def spinapi(monkeypatch):
+    spinapi = FakeSpinapi()
+    monkeypatch.setitem(sys.modules, 'spinapi', spinapi)
+    monkeypatch.setattr(zprocess, 'Event', lambda *args, **kwargs: None)
+    return spinapi
+
+
+@pytest.fixture
+def worker(spinapi):
+    worker = PulseblasterWorker.__new__(PulseblasterWorker)
+    worker.device_name = DEVICE
+    worker.board_number = 0
+    worker.programming_scheme = 'pb_start/BRANCH'
+    worker.logger = logging.getLogger('PulseBlaster test')
+    worker.init()
+    return worker
+
+
+@pytest.fixture
+def dataset_reads(monkeypatch):
+    """The names of the datasets read from shot files"""
+    reads = []
+    getitem = h5py.Dataset.__getitem__
+
+    def __getitem__(self, *args, **kwargs):
+        reads.append(self.name)
+        return getitem(self, *args, **kwargs)
+
+    monkeypatch.setattr(h5py.Dataset, '__getitem__', __getitem__)
+    return reads
+
+
+def random_tables(seed, length=10):
+    rng = np.random.default_rng(seed)
+    tables = {}
+    for i in range(2):
+        tables['DDS%d/FREQ_REGS' % i] = rng.uniform(0, 100, 4)
+        tables['DDS%d/AMP_REGS' % i] = rng.uniform(0, 1, 4)
+        tables['DDS%d/PHASE_REGS' % i] = rng.uniform(0, 360, 4)
+    # Two lines that the worker writes itself, then the program, ending in a branch:
+    pulse_program = np.zeros(length + 2, dtype=PB_DTYPE)
+    for name in ['freq0', 'phase0', 'amp0', 'freq1', 'phase1', 'amp1']:
+        pulse_program[name] = rng.integers(0, 4, length + 2)
+    pulse_program['flags'] = rng.integers(0, 2**12, length + 2)
+    pulse_program['length'] = 1e3
+    pulse_program['inst'][-1] = PulseBlaster.pb_instructions['BRANCH']
+    tables['PULSE_PROGRAM'] = pulse_program
+    return tables
+
+
+def make_shot(path, tables):
+    """Write a shot file with the given tables and, as PulseBlaster.generate_code
+    does, their hash"""
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group(DEVICE)
+        for name, data in tables.items():
+            group.create_dataset(name, data=data)
+        group.attrs['table_hash'] = table_hash(group, TABLES)
+        waits = f.create_dataset('waits', data=np.zeros(0, dtype=[('time', float)]))
+        waits.attrs['wait_monitor_acquisition_device'] = ''
+    return str(path)
+
+
+def initial_values(amp0=0.5):
+    values = {
+        'dds %d' % i: {'freq': 1e6, 'amp': 0.5, 'phase': 0, 'gate': 1}
+        for i in range(2)
+    }
+    values['dds 0']['amp'] = amp0
+    values.update({'flag %d' % i: 0 for i in range(12)})
+    return values
+
+
+def run_shot(worker, spinapi, dataset_reads, h5file, values, fresh=False):
+    """Run transition_to_buffered, and return the final values, the spinapi calls
+    made and the tables read"""
+    del spinapi.calls[:], dataset_reads[:]
+    final_values = worker.transition_to_buffered(DEVICE, h5file, values, fresh)
+    tables_read = sorted(
+        name.split(DEVICE + '/')[1] for name in dataset_reads if DEVICE in name
+    )
+    return final_values, list(spinapi.calls), tables_read
+
+
+def programmed(calls, name):
+    return [args for call, args in calls if call == name]
+
+
+def test_unchanged_tables_are_not_read_or_programmed(
+    worker, spinapi, dataset_reads, tmp_path
+):
+    tables = random_tables(seed=0)
+    shot = make_shot(tmp_path / 'shot.h5', tables)
+    same = make_shot(tmp_path / 'same.h5', tables)
+    changed_tables = {name: data.copy() for name, data in tables.items()}
+    changed_tables['DDS1/FREQ_REGS'][2] += 1
+    changed_tables['PULSE_PROGRAM']['flags'][5] ^= 1
+    changed = make_shot(tmp_path / 'changed.h5', changed_tables)
+    program_length = len(tables['PULSE_PROGRAM']) - 2
+
+    final_values, calls, tables_read = run_shot(
+        worker, spinapi, dataset_reads, shot, initial_values(), fresh=True
+    )
+    assert tables_read == sorted(TABLES)
+    assert len(programmed(calls, 'program_amp_regs')) == 2
+    assert len(programmed(calls, 'program_freq_regs')) == 2
+    assert len(programmed(calls, 'program_phase_regs')) == 2
+    assert len(programmed(calls, 'pb_inst_dds2')) == 2 + program_length
+
+    # A different shot file with the same tables is neither read nor programmed:
+    cached_final_values, calls, tables_read = run_shot(
+        worker, spinapi, dataset_reads, same, initial_values()
+    )
+    assert tables_read == []
+    for name in ['program_amp_regs', 'program_freq_regs', 'program_phase_regs']:
+        assert programmed(calls, name) == []
+    assert programmed(calls, 'pb_inst_dds2') == []
+    assert cached_final_values == final_values
+
+    # Changed front panel values are programmed into the first register and the
+    # first two instructions only, still without reading the tables:
+    _, calls, tables_read = run_shot(
+        worker, spinapi, dataset_reads, same, initial_values(amp0=0.25)
+    )
+    assert tables_read == []
+    (amps,) = programmed(calls, 'program_amp_regs')
+    assert amps[0] == 0.25
+    assert list(amps[1:]) == list(tables['DDS0/AMP_REGS'][1:])
+    assert programmed(calls, 'program_freq_regs') == []
+    assert programmed(calls, 'program_phase_regs') == []
+    assert len(programmed(calls, 'pb_inst_dds2')) == 2
+
+    # Changed tables are read, and what has changed is programmed:
+    _, calls, tables_read = run_shot(
+        worker, spinapi, dataset_reads, changed, initial_values(amp0=0.25)
+    )
+    assert tables_read == sorted(TABLES)
+    assert programmed(calls, 'program_amp_regs') == []
+    (freqs,) = programmed(calls, 'program_freq_regs')
+    assert list(freqs[1:]) == list(changed_tables['DDS1/FREQ_REGS'][1:])
+    assert programmed(calls, 'program_phase_regs') == []
+    instructions = programmed(calls, 'pb_inst_dds2')
+    assert len(instructions) == 2 + program_length
+    assert [args[10] for args in instructions[2:]] == list(
+        changed_tables['PULSE_PROGRAM']['flags'][2:]
+    )
+
+    # And a fresh shot with the hash of the tables on the device reprograms them all
+    # without reading them:
+    _, calls, tables_read = run_shot(
+        worker, spinapi, dataset_reads, changed, initial_values(amp0=0.25), fresh=True
+    )
+    assert tables_read == []
+    assert len(programmed(calls, 'program_amp_regs')) == 2
+    assert len(programmed(calls, 'program_freq_regs')) == 2
+    assert len(programmed(calls, 'program_phase_regs')) == 2
+    assert len(programmed(calls, 'pb_inst_dds2')) == 2 + program_length
@@ -0,0 +1,329 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_RFBlaster.py                      #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Tests of RFBlaster binary caching and the BLACS worker"""
+import getpass
+import http.server
+import logging
+import os
+import re
+import sys
+import threading
+import urllib.parse
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+from labscript_devices.RFBlaster import RFBlaster, RFBlasterWorker, split_at_trigger_times
+
+# Writes the reversed assembly as the binary, and appends the assembly to a log file:
+STAND_IN_ASSEMBLER = '''#!%s
+import sys
+with open(sys.argv[1], 'rb') as f:
+    assembly = f.read()
+with open(sys.argv[2], 'wb') as f:
+    f.write(assembly[::-1])
+with open(%r, 'ab') as f:
+    f.write(assembly + b'\\n')
+'''
+
+
+@pytest.fixture
+def assembler(tmp_path, monkeypatch):
+    """A stand-in for caspr, installed as a command on the PATH. Returns the path of
+    its log of the assembly it was run on"""
+    if os.name != 'posix':
+        pytest.skip('stand-in assembler requires POSIX')
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    log = tmp_path / 'assembler.log'
+    log.write_bytes(b'')
+    caspr = bin_dir / 'caspr'
+    caspr.write_text(STAND_IN_ASSEMBLER % (sys.executable, str(log)))
+    caspr.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    return log
+
+
+@pytest.fixture
+def rfblaster(tmp_path):
+    rfblaster = RFBlaster.__new__(RFBlaster)
+    rfblaster.binary_cache_dir = str(tmp_path / 'cache')
+    return rfblaster
+
+
+def assemble(rfblaster, tmp_path, codes):
+    assembly = {}
+    for name, code in codes.items():
+        path = tmp_path / ('%s.asm' % name)
+        path.write_text(code)
+        assembly[name] = (str(path), code)
+    return rfblaster.assemble('caspr', str(tmp_path), assembly)
+
+
+def assembler_runs(log):
+    return log.read_bytes().decode().splitlines()
+
+
+def test_default_binary_cache_dir_is_per_user():
+    assert RFBlaster.binary_cache_dir.endswith(getpass.getuser())
+
+
+def test_bare_command_is_resolved(assembler):
+    caspr = RFBlaster.find_assembler('caspr')
+    assert os.path.isabs(caspr)
+    assert caspr.encode('utf8') in RFBlaster.assembler_version(caspr)
+    with pytest.raises(Exception, match='not found'):
+        RFBlaster.find_assembler('no_such_assembler')
+
+
+def test_binaries_are_cached(assembler, rfblaster, tmp_path):
+    codes = {0: 'dds0 code', 1: 'dds1 code'}
+    binaries = assemble(rfblaster, tmp_path, codes)
+    assert binaries == {0: b'edoc 0sdd', 1: b'edoc 1sdd'}
+    assert sorted(assembler_runs(assembler)) == ['dds0 code', 'dds1 code']
+    # Cached binaries are used without running the assembler:
+    assert assemble(rfblaster, tmp_path, codes) == binaries
+    assert len(assembler_runs(assembler)) == 2
+    # Only changed code is assembled:
+    binaries = assemble(rfblaster, tmp_path, {0: 'dds0 code', 1: 'new code'})
+    assert binaries == {0: b'edoc 0sdd', 1: b'edoc wen'}
+    assert assembler_runs(assembler)[2:] == ['new code']
+    # A new assembler invalidates the cache:
+    caspr = RFBlaster.find_assembler('caspr')
+    os.utime(caspr, ns=(0, 0))
+    assert assemble(rfblaster, tmp_path, codes) == {0: b'edoc 0sdd', 1: b'edoc 1sdd'}
+    assert len(assembler_runs(assembler)) == 5
+
+
+def test_corrupt_binaries_are_not_used(assembler, rfblaster, tmp_path):
+    codes = {0: 'dds0 code'}
+    assemble(rfblaster, tmp_path, codes)
+    [entry] = os.listdir(rfblaster.binary_cache_dir)
+    path = os.path.join(rfblaster.binary_cache_dir, entry)
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'X')
+    assert assemble(rfblaster, tmp_path, codes) == {0: b'edoc 0sdd'}
+    assert len(assembler_runs(assembler)) == 2
+    # A binary stored under another key is not used either:
+    other_codes = {0: 'other code'}
+    assemble(rfblaster, tmp_path, other_codes)
+    other_entry = [e for e in os.listdir(rfblaster.binary_cache_dir) if e != entry][0]
+    os.replace(os.path.join(rfblaster.binary_cache_dir, other_entry), path)
+    assert assemble(rfblaster, tmp_path, codes) == {0: b'edoc 0sdd'}
+    assert len(assembler_runs(assembler)) == 4
+
+
+def test_cache_size_is_bounded(assembler, rfblaster, tmp_path):
+    # Room for two of these binaries, each stored with a 32 byte digest:
+    rfblaster.binary_cache_max_size = 2 * (32 + 1000)
+    codes = ['%d' % i * 1000 for i in range(3)]
+    cache_dir = rfblaster.binary_cache_dir
+    for i, code in enumerate(codes):
+        entries = set(os.listdir(cache_dir)) if os.path.exists(cache_dir) else set()
+        assemble(rfblaster, tmp_path, {0: code})
+        # Make sure modification times are distinct, oldest first:
+        for entry in set(os.listdir(cache_dir)) - entries:
+            os.utime(os.path.join(cache_dir, entry), ns=(i * 10**9, i * 10**9))
+    assert len(os.listdir(cache_dir)) == 2
+    # The oldest was deleted:
+    assemble(rfblaster, tmp_path, {0: codes[2]})
+    assemble(rfblaster, tmp_path, {0: codes[1]})
+    assert len(assembler_runs(assembler)) == 3
+    assemble(rfblaster, tmp_path, {0: codes[0]})
+    assert len(assembler_runs(assembler)) == 4
+
+
+def test_cache_owned_by_another_user_is_not_used(assembler, rfblaster, tmp_path, monkeypatch):
+    if not hasattr(os, 'getuid'):
+        pytest.skip('requires POSIX user IDs')
+    monkeypatch.setattr(os, 'getuid', lambda: -1)
+    assemble(rfblaster, tmp_path, {0: 'dds0 code'})
+    assemble(rfblaster, tmp_path, {0: 'dds0 code'})
+    assert len(assembler_runs(assembler)) == 2
+    assert os.listdir(rfblaster.binary_cache_dir) == []
+
+
+class RFBlasterWebServer(object):
+    """Serves a page with the RFBlaster's value form, which is updated by posts of the
+    form, and records the requests, the files uploaded and the number of connections
+    made"""
+
+    def __init__(self):
+        self.values = {'f_ch0_in': '100', 'a_ch0_in': '0.5', 'p_ch0_in': '0',
+                       'f_ch1_in': '200', 'a_ch1_in': '0.25', 'p_ch1_in': '90'}
+        self.requests = []
+        self.files = {}
+        self.connections = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+
+            def do_GET(self):
+                server.requests.append(('GET', None))
+                self.send_page()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers['Content-Type'].startswith('multipart/form-data'):
+                    # Only the simple fields, not the uploaded files:
+                    fields = re.findall(rb'name="(\w+)"\r\n\r\n(.*?)\r\n', body)
+                    fields = {k.decode(): v.decode() for k, v in fields}
+                    files = re.findall(
+                        rb'name="(\w+)"; filename="[^"]*"\r\n[^\r]*\r\n\r\n(.*?)\r\n--',
+                        body,
+                        re.DOTALL,
+                    )
+                    server.files.update((k.decode(), v) for k, v in files)
+                else:
+                    fields = dict(urllib.parse.parse_qsl(body.decode()))
+                server.requests.append(('POST', fields))
+                for name in server.values:
+                    if name in fields:
+                        server.values[name] = fields[name]
+                self.send_page()
+
+            def send_page(self):
+                page = ''.join(
+                    '<input type="text" name="%s" value="%s">\n' % item
+                    for item in server.values.items()
+                ).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.address = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def web_server():
+    server = RFBlasterWebServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def worker(web_server):
+    pytest.importorskip('requests')
+    worker = RFBlasterWorker.__new__(RFBlasterWorker)
+    worker.address = web_server.address
+    worker.num_DDS = 2
+    worker.logger = logging.getLogger('RFBlaster test')
+    worker.init()
+    yield worker
+    worker.shutdown()
+
+
+def front_panel_values(freq0, amp0, freq1=200e6, amp1=0.25):
+    return {
+        'dds 0': {'freq': freq0, 'amp': amp0, 'phase': 0.0, 'gate': True},
+        'dds 1': {'freq': freq1, 'amp': amp1, 'phase': 90.0, 'gate': True},
+    }
+
+
+def test_program_manual(web_server, worker):
+    assert worker.check_remote_values() == front_panel_values(100e6, 0.5)
+    assert worker.program_manual(front_panel_values(150e6, 0.75)) == front_panel_values(
+        150e6, 0.75
+    )
+    assert web_server.values['f_ch0_in'] == '150.0'
+    assert web_server.values['a_ch0_in'] == '0.75'
+    # Each page is parsed afresh, even if the same as the last, since the device's
+    # values may have changed since a page identical to an older one was fetched:
+    for freq0 in [100e6, 150e6, 100e6]:
+        web_server.values['f_ch0_in'] = str(freq0 * 1e-6)
+        assert worker.check_remote_values() == front_panel_values(freq0, 0.75)
+    # A gated off output is reported with its front panel amplitude:
+    values = front_panel_values(150e6, 0.75)
+    values['dds 1']['gate'] = False
+    assert worker.program_manual(values) == values
+    assert web_server.values['a_ch1_in'] == '0.0'
+    # All over one connection:
+    assert len(web_server.requests) == 7
+    assert web_server.connections == 1
+
+
+def test_transition_to_buffered(web_server, worker, tmp_path):
+    dtype = [('time', float)] + [
+        ('%s%d' % (name, i), float) for i in range(2) for name in ['amp', 'freq', 'phase']
+    ]
+    table = np.zeros(2, dtype=dtype)
+    table[-1] = (1.0, 0.5, 100e6, 0.0, 0.25, 200e6, 90.0)
+    path = str(tmp_path / 'shot.h5')
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group('rfblaster')
+        group.create_dataset('TABLE_DATA', data=table)
+        for i in range(2):
+            group.create_dataset('BINARY_CODE/DDS%d' % i, data=np.bytes_(b'\0binary%d' % i))
+    final_values = worker.transition_to_buffered('rfblaster', path, {}, True)
+    assert final_values['dds 1'] == {'freq': 200e6, 'amp': 25.0, 'phase': 90.0, 'gate': True}
+    method, fields = web_server.requests[-1]
+    assert method == 'POST'
+    assert fields == {'upload_and_run': 'Upload and start'}
+    assert web_server.files == {'pulse_ch0': b'\0binary0', 'pulse_ch1': b'\0binary1'}
+
+
+def old_split_at_trigger_times(abs_table, trigger_times):
+    """How generate_code split tables before it used searchsorted"""
+    abs_tables = []
+    for i, t in enumerate(trigger_times):
+        subtable = abs_table[abs_table[:, 0] >= t]
+        try:
+            next_trigger_time = trigger_times[i + 1]
+        except IndexError:
+            # No next trigger time
+            pass
+        else:
+            subtable = subtable[subtable[:, 0] < next_trigger_time]
+        subtable[:, 0] -= t
+        abs_tables.append(subtable)
+    return abs_tables
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_split_at_trigger_times_matches_old_implementation(seed):
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.choice(10**6, size=1000, replace=False))
+    # Triggers at the start, at times in the table, between them and after the end:
+    trigger_times = np.unique(
+        np.concatenate(
+            [[0], rng.choice(times, 5), rng.integers(0, 10**6, 5), [10**6 + 1]]
+        )
+    ).astype(np.int64)
+    abs_table = rng.integers(0, 2**31, (len(times), 4), dtype=np.int64)
+    abs_table[:, 0] = times
+    expected = old_split_at_trigger_times(abs_table.copy(), trigger_times)
+    abs_tables = split_at_trigger_times(abs_table, trigger_times)
+    assert len(abs_tables) == len(expected)
+    for subtable, expected_subtable in zip(abs_tables, expected):
+        assert subtable.dtype == expected_subtable.dtype
+        np.testing.assert_array_equal(subtable, expected_subtable)
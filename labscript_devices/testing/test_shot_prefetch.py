@@ -0,0 +1,316 @@
+#####################################################################
+#                                                                   #
+# /labscript_devices/testing/test_shot_prefetch.py                  #
+#                                                                   #
+# Copyright 2026, The labscript suite community                     #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+import __main__
+import threading
+import time
+import types
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+from labscript_devices.shot_prefetch import (
+    QueuedShotPrefetcher,
+    ShotFilePrefetcher,
+    group_key,
+    prefetch_queued_shots,
+    table_hash,
+)
+
+DEVICE = 'dev'
+NUM_ROWS = 2_000_000
+
+
+class Reader(object):
+    """read_tables function for the tests, counting the calls in each thread. If
+    `block` is set, calls from background threads wait for `unblocked` to be set."""
+
+    def __init__(self):
+        self.calls = []
+        self.block = threading.Event()
+        self.unblocked = threading.Event()
+        self.started_in_background = threading.Event()
+
+    def __call__(self, hdf5_file):
+        background = threading.current_thread() is not threading.main_thread()
+        self.calls.append('background' if background else 'main')
+        if background:
+            self.started_in_background.set()
+            if self.block.is_set():
+                self.unblocked.wait()
+        return hdf5_file['devices'][DEVICE]['table'][:] * 2
+
+
+def make_shot(path, data, with_hash=True):
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('devices').create_group(DEVICE)
+        group.create_dataset('table', data=data)
+        group.attrs['stop_time'] = 1.0
+        if with_hash:
+            group.attrs['table_hash'] = table_hash(group, ['table'])
+
+
+def rewrite_table(path, data):
+    with h5py.File(path, 'a') as f:
+        group = f['devices'][DEVICE]
+        del group['table']
+        group.create_dataset('table', data=data)
+        if 'table_hash' in group.attrs:
+            group.attrs['table_hash'] = table_hash(group, ['table'])
+
+
+def wait_for_prefetch(prefetcher, path):
+    thread, result = prefetcher.pending[str(path)]
+    thread.join()
+    assert 'exception' not in result, result.get('exception')
+
+
+@pytest.fixture
+def shot(tmp_path):
+    path = tmp_path / 'shot.h5'
+    make_shot(path, np.arange(NUM_ROWS, dtype=np.float64))
+    return path
+
+
+def test_prefetched_result_survives_blacs_writing_to_the_file(shot):
+    reader = Reader()
+    prefetcher = ShotFilePrefetcher(DEVICE, reader)
+    prefetcher.prefetch(str(shot))
+    wait_for_prefetch(prefetcher, shot)
+    # As BLACS does before transition_to_buffered, changing the file's mtime:
+    with h5py.File(shot, 'a') as f:
+        f.create_group('front_panel').attrs['dds 0'] = 1.0
+    with h5py.File(shot, 'r') as f:
+        data = prefetcher.get(f)
+    assert reader.calls == ['background']
+    np.testing.assert_array_equal(data, 2 * np.arange(NUM_ROWS))
+
+
+def test_changed_group_is_read_again(shot):
+    reader = Reader()
+    prefetcher = ShotFilePrefetcher(DEVICE, reader)
+    prefetcher.prefetch(str(shot))
+    wait_for_prefetch(prefetcher, shot)
+    rewrite_table(shot, np.ones(10))
+    with h5py.File(shot, 'r') as f:
+        data = prefetcher.get(f)
+    assert reader.calls == ['background', 'main']
+    np.testing.assert_array_equal(data, 2 * np.ones(10))
+
+
+def test_group_key_without_table_hash(tmp_path):
+    path = tmp_path / 'shot.h5'
+    make_shot(path, np.arange(10), with_hash=False)
+    with h5py.File(path, 'r') as f:
+        key = group_key(f['devices'][DEVICE])
+    rewrite_table(path, np.arange(10) + 1)
+    with h5py.File(path, 'r') as f:
+        assert group_key(f['devices'][DEVICE]) != key
+    rewrite_table(path, np.arange(10))
+    with h5py.File(path, 'r') as f:
+        assert group_key(f['devices'][DEVICE]) == key
+
+
+def test_table_hash(tmp_path):
+    rng = np.random.default_rng(0)
+    table = np.zeros(100, dtype=[('t', '<f8'), ('value', '<u2')])
+    table['t'] = rng.uniform(0, 1, 100)
+    table['value'] = rng.integers(0, 2**16, 100)
+    other = np.arange(12, dtype='<i4').reshape(3, 4)
+
+    def hash_of(datasets, names=('table', 'other'), compression=None):
+        with h5py.File(tmp_path / 'hash.h5', 'w') as f:
+            group = f.create_group('devices').create_group(DEVICE)
+            for name, data in datasets.items():
+                group.create_dataset(name, data=data, compression=compression)
+            return table_hash(group, list(names))
+
+    reference = hash_of({'table': table, 'other': other})
+    # The same tables in another file, including one stored differently, have the
+    # same hash:
+    assert hash_of({'other': other, 'table': table}) == reference
+    assert hash_of({'table': table, 'other': other}, compression='gzip') == reference
+    # But changing any value does not:
+    changed = table.copy()
+    changed['value'][50] += 1
+    assert hash_of({'table': changed, 'other': other}) != reference
+    # Nor the same bytes with a different dtype or shape:
+    assert hash_of({'table': table, 'other': other.astype('<u4')}) != reference
+    assert hash_of({'table': table, 'other': other.reshape(4, 3)}) != reference
+    # Nor the same data under different names, or in a different order:
+    assert hash_of({'table': table, 'other2': other}, ('table', 'other2')) != reference
+    assert hash_of({'table': table, 'other': other}, ('other', 'table')) != reference
+    # Datasets in subgroups are named by their paths, as PulseBlaster's are:
+    assert hash_of({'DDS0/table': table}, ['DDS0/table']) != hash_of(
+        {'DDS1/table': table}, ['DDS1/table']
+    )
+
+
+def test_unfinished_prefetch_is_not_waited_for(shot):
+    reader = Reader()
+    reader.block.set()
+    prefetcher = ShotFilePrefetcher(DEVICE, reader)
+    prefetcher.prefetch(str(shot))
+    thread, _ = prefetcher.pending[str(shot)]
+    reader.started_in_background.wait()
+    try:
+        with h5py.File(shot, 'r') as f:
+            data = prefetcher.get(f)
+    finally:
+        reader.unblocked.set()
+        thread.join()
+    assert reader.calls == ['background', 'main']
+    np.testing.assert_array_equal(data, 2 * np.arange(NUM_ROWS))
+
+
+def test_oldest_prefetch_is_forgotten(tmp_path):
+    reader = Reader()
+    prefetcher = ShotFilePrefetcher(DEVICE, reader)
+    paths = [str(tmp_path / ('shot_%d.h5' % i)) for i in range(3)]
+    for path in paths:
+        make_shot(path, np.arange(10))
+        prefetcher.prefetch(path)
+        # Prefetching a shot twice does not read it twice:
+        prefetcher.prefetch(path)
+    assert list(prefetcher.pending) == paths[1:]
+    for path in paths[1:]:
+        wait_for_prefetch(prefetcher, path)
+    prefetcher.discard()
+    assert not prefetcher.pending
+
+
+def test_prefetch_latency(shot):
+    """The time from opening the shot file to having the tables, with and without
+    prefetching."""
+    reader = Reader()
+    prefetcher = ShotFilePrefetcher(DEVICE, reader)
+    start_time = time.perf_counter()
+    with h5py.File(shot, 'r') as f:
+        prefetcher.get(f)
+    synchronous = time.perf_counter() - start_time
+
+    prefetcher.prefetch(str(shot))
+    wait_for_prefetch(prefetcher, shot)
+    start_time = time.perf_counter()
+    with h5py.File(shot, 'r') as f:
+        prefetcher.get(f)
+    prefetched = time.perf_counter() - start_time
+
+    print('synchronous: %.1f ms, prefetched: %.1f ms' % (1e3 * synchronous, 1e3 * prefetched))
+    assert reader.calls == ['main', 'background']
+    assert prefetched < synchronous
+
+
+class FakeTab(object):
+    """The parts of a BLACS DeviceTab that prefetch_queued_shots uses. States queued
+    are recorded rather than run."""
+
+    primary_worker = 'main_worker'
+
+    def __init__(self):
+        self.states = []
+        self.event_queue = types.SimpleNamespace(put=self.put)
+        self._restart_receiver = []
+        self._mainloop_thread = types.SimpleNamespace(is_alive=lambda: self.alive)
+        self.alive = True
+
+    def put(self, allowed_modes, queue_indefinitely, delete_stale, state):
+        function, (args, kwargs) = state
+        self.states.append((function, args, kwargs))
+
+    def queue_work(self, worker_process, worker_function, *args, **kwargs):
+        return worker_process, worker_function, args, kwargs
+
+    def connect_restart_receiver(self, function):
+        self._restart_receiver.append(function)
+
+    def restart(self):
+        for function in self._restart_receiver:
+            function('dev')
+        self._restart_receiver = []
+
+    def prefetched(self):
+        """The shots the worker has been asked to prefetch, clearing the record"""
+        shots = []
+        for function, args, kwargs in self.states:
+            worker, method, (h5file,), _ = next(function(self, *args, **kwargs))
+            assert (worker, method) == ('main_worker', 'prefetch_shot')
+            shots.append(h5file)
+        del self.states[:]
+        return shots
+
+
+def test_prefetch_queued_shots(monkeypatch):
+    pytest.importorskip('blacs')
+    from qtutils.qt.QtGui import QStandardItem, QStandardItemModel
+    from qtutils.qt.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([])
+
+    def process_events():
+        deadline = time.monotonic() + 0.1
+        while time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.005)
+
+    monkeypatch.setattr(QueuedShotPrefetcher, 'retry_interval', 10)
+    monkeypatch.delattr(__main__, 'app', raising=False)
+    model = QStandardItemModel()
+    for h5file in ['a.h5', 'b.h5']:
+        model.appendRow(QStandardItem(h5file))
+
+    # As when BLACS creates its tabs, before the queue exists:
+    tab = FakeTab()
+    prefetcher = prefetch_queued_shots(tab)
+    process_events()
+    assert prefetcher.model is None
+    assert tab.prefetched() == []
+
+    # Once it does, the shot at the front of the queue is prefetched:
+    blacs = types.SimpleNamespace(queue=types.SimpleNamespace(_model=model))
+    monkeypatch.setattr(__main__, 'app', blacs, raising=False)
+    process_events()
+    assert prefetcher.model is model
+    assert tab.prefetched() == ['a.h5']
+
+    # And again whenever the queue changes:
+    model.takeRow(0)
+    process_events()
+    assert tab.prefetched() == ['b.h5']
+    model.insertRow(0, QStandardItem('c.h5'))
+    process_events()
+    assert tab.prefetched() == ['c.h5']
+    model.takeRow(1)
+    process_events()
+    assert tab.prefetched() == ['c.h5']
+
+    # A restarted tab watches the queue once only:
+    tab.restart()
+    assert prefetcher.model is None
+    restarted_prefetcher = prefetch_queued_shots(tab)
+    process_events()
+    assert tab.prefetched() == ['c.h5']
+    model.appendRow(QStandardItem('d.h5'))
+    process_events()
+    assert tab.prefetched() == ['c.h5']
+
+    # And a closed tab not at all:
+    tab.alive = False
+    model.takeRow(0)
+    process_events()
+    assert tab.prefetched() == []
+    assert restarted_prefetcher.model is None
+    model.takeRow(0)
+    process_events()
+    assert tab.prefetched() == []